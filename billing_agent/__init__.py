@@ -1 +1,10 @@
-from . import agent
+import importlib
+
+
+def __getattr__(name):
+    # The agent tree is built on first access (e.g. by the ADK loader's
+    # `billing_agent.agent`), so other agents can import `billing_agent.utils`
+    # without creating the billing agents and their clients.
+    if name == "agent":
+        return importlib.import_module(f"{__name__}.agent")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
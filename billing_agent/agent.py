@@ -5,22 +5,36 @@ from google.genai import types
 from google.adk.tools.base_tool import BaseTool
 from google.adk.tools.tool_context import ToolContext
 import logging
+import os
 from zoneinfo import ZoneInfo
 from google.adk.agents import Agent
-from google.adk.models.lite_llm import LiteLlm
 from google.adk.agents.callback_context import CallbackContext
 from .sub_agents.bigquery.tools import (
     get_database_settings as get_bq_database_settings,
 )
 from .prompts import return_instructions_root
 from .tools import call_db_agent, call_ds_agent
+from .utils import client_registry, history_compression, tracing
+from .utils.structured_logging import log_event
+
+logger = logging.getLogger(__name__)
 
 date_today = date.today()
 
+# Past this estimated size, older turns of the root agent's history are sent
+# as a summary plus references to their SQL and results.
+HISTORY_COMPRESSION = history_compression.HistoryCompressionConfig(
+    max_history_tokens=int(os.getenv("ROOT_AGENT_MAX_HISTORY_TOKENS", 16000)),
+    keep_recent_turns=3,
+)
+
 
 def setup_before_agent_call(callback_context: CallbackContext):
     """Setup the agent."""
 
+    # Tag every span of this invocation with the session ID.
+    tracing.bind_session(callback_context._invocation_context.session.id)
+
     # setting up database settings in session.state
     if "database_settings" not in callback_context.state:
         db_settings = dict()
@@ -29,8 +43,11 @@ def setup_before_agent_call(callback_context: CallbackContext):
 
     # setting up schema in instruction
     if callback_context.state["all_db_settings"]["use_database"] == "BigQuery":
-        callback_context.state["database_settings"] = get_bq_database_settings(
-        )
+        # Only write the settings (which include the schema) when they
+        # change, so they are not persisted again with every turn.
+        database_settings = get_bq_database_settings()
+        if callback_context.state.get("database_settings") != database_settings:
+            callback_context.state["database_settings"] = database_settings
         schema = callback_context.state["database_settings"]["bq_ddl_schema"]
 
         callback_context._invocation_context.agent.instruction = (
@@ -45,14 +62,17 @@ def setup_before_agent_call(callback_context: CallbackContext):
 
 
 def after_call_back(callback_context: CallbackContext):
-    print("**********************************************")
-    # print(callback_context.state.to_dict()['sql_query'])
-    print(callback_context.state.to_dict()['question'])
-    print(callback_context._invocation_context.session.id,)
-    print(callback_context._invocation_context.user_content.to_json_dict(),)
-    print(callback_context.state.to_dict()['raw_sql'],)
-    print(callback_context.state.to_dict()['final_sql'],)
-    print("**********************************************")
+    state = callback_context.state
+    log_event(
+        logger,
+        "agent_turn",
+        "Agent turn finished",
+        question=state.get("question"),
+        user_content=(
+            callback_context._invocation_context.user_content.to_json_dict()),
+        raw_sql=state.get("raw_sql"),
+        final_sql=state.get("final_sql"),
+    )
 
 
 def after_tool_callback(
@@ -80,20 +100,22 @@ def after_tool_callback(
         Optional[Dict]: If a dictionary is returned, it will replace the original tool response.
                        If None is returned, the original tool response will be used.
     """
-    # Log information about the tool call
-    logging.info(f"Tool called: {tool.name}")
-    logging.info(f"Arguments: {args}")
-    logging.info(f"Response: {tool_response}")
+    # Log information about the tool call (sampled and truncated)
+    log_event(
+        logger,
+        "tool_response",
+        f"Tool called: {tool.name}",
+        tool=tool.name,
+        arguments=args,
+        response=tool_response,
+    )
 
     # Store information in the session state
     # This can be used to track tool usage across multiple turns
-    if "tool_usage" not in tool_context.state:
-        tool_context.state["tool_usage"] = {}
-
-    if tool.name not in tool_context.state["tool_usage"]:
-        tool_context.state["tool_usage"][tool.name] = 0
-
-    tool_context.state["tool_usage"][tool.name] += 1
+    # One counter per tool, reassigned so the change is persisted
+    tool_usage = dict(tool_context.state.get("tool_usage") or {})
+    tool_usage[tool.name] = tool_usage.get(tool.name, 0) + 1
+    tool_context.state["tool_usage"] = tool_usage
 
     # Example: Add metadata to the response
     modified_response = {}
@@ -125,14 +147,7 @@ def after_tool_callback(
 
 root_agent = Agent(
     name="db_ds_multiagent",
-    model=LiteLlm(
-        model='litellm_proxy/gemini-2.5-pro',
-        api_base='https://litellm-cloudrun-668429440317.us-central1.run.app',
-        # Pass authentication headers if needed
-        # extra_headers=auth_headers
-        # Alternatively, if endpoint uses an API key:
-        api_key='sk-zQZEBtCjkNzFvxNFUtTDew'
-    ),
+    model=client_registry.litellm_model(),
     # model='gemini-2.5-pro-preview-05-06',
     instruction=return_instructions_root(),
     global_instruction=f"""
@@ -145,6 +160,8 @@ Todays date: {date_today}
     ],
     before_agent_callback=setup_before_agent_call,
     after_agent_callback=after_call_back,
+    before_model_callback=history_compression.before_model_callback(
+        HISTORY_COMPRESSION),
     # after_tool_callback=after_tool_callback,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
 
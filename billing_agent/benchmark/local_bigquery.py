@@ -0,0 +1,143 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local BigQuery stand-in backed by DuckDB.
+
+`LocalBigQueryClient` implements the small part of `bigquery.Client` that the
+database agent tools use (`query(...).result()`), so the tools can run
+unchanged against the synthetic billing export tables of
+`billing_agent.utils.synthetic_billing_data`. BigQuery SQL is transpiled
+to DuckDB with SQLGlot and fully qualified table names are mapped to the local
+tables by their table ID.
+"""
+
+import time
+from pathlib import Path
+from typing import Any
+
+import duckdb
+import pyarrow as pa
+import sqlglot
+
+from billing_agent.utils import synthetic_billing_data
+
+
+class LocalRow(dict):
+    """A result row that behaves like `bigquery.Row` for `.items()` access."""
+
+
+class LocalRowIterator:
+    """The result of a local query, iterable like `bigquery.table.RowIterator`."""
+
+    def __init__(self, columns: list[str], rows: list[tuple[Any, ...]]):
+        self.schema = columns
+        self.total_rows = len(rows)
+        self._rows = rows
+
+    def __iter__(self):
+        for row in self._rows:
+            yield LocalRow(zip(self.schema, row))
+
+    def to_arrow(self):
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        return pa.Table.from_pylist([dict(row) for row in self])
+
+
+class LocalQueryJob:
+    """A finished local query, shaped like `bigquery.QueryJob`."""
+
+    def __init__(self, sql: str, result: LocalRowIterator, elapsed: float):
+        self.query = sql
+        self.elapsed_seconds = elapsed
+        self.total_bytes_processed = 0
+        self.cache_hit = False
+        self._result = result
+
+    def result(self, timeout: float | None = None) -> LocalRowIterator:
+        del timeout  # Unused, the query has finished.
+        return self._result
+
+
+class LocalBigQueryClient:
+    """DuckDB-backed stand-in for `bigquery.Client`.
+
+    Attributes:
+        project: The project ID reported by the client.
+        connection: The DuckDB connection that holds the local tables.
+    """
+
+    def __init__(self, project: str = "local"):
+        self.project = project
+        self.connection = duckdb.connect(":memory:")
+        self._tables: set[str] = set()
+
+    def load_table(self, table_id: str, table: pa.Table) -> None:
+        """Creates (or replaces) a local table from an Arrow table.
+
+        Args:
+            table_id (str): The table ID. A fully qualified name is accepted;
+              only the last part is used locally.
+            table (pa.Table): The rows to load.
+        """
+        name = table_id.split(".")[-1]
+        self.connection.register("_incoming", table)
+        self.connection.execute(
+            f'CREATE OR REPLACE TABLE "{name}" AS SELECT * FROM _incoming'
+        )
+        self.connection.unregister("_incoming")
+        self._tables.add(name)
+
+    def load_parquet_export(self, table_id: str, table_dir: Path) -> None:
+        """Loads a billing export written by `write_billing_export`.
+
+        Args:
+            table_id (str): The table ID. A fully qualified name is accepted;
+              only the last part is used locally.
+            table_dir (Path): The directory holding the daily Parquet files.
+        """
+        name = table_id.split(".")[-1]
+        synthetic_billing_data.load_to_duckdb(self.connection, name, table_dir)
+        self._tables.add(name)
+
+    def to_local_sql(self, sql: str) -> str:
+        """Transpiles BigQuery SQL to DuckDB SQL over the local tables.
+
+        Scripts of several statements are supported. Tables created by the
+        SQL are added to the local tables.
+        """
+        statements = []
+        for statement in sqlglot.parse(sql, read="bigquery"):
+            if statement is None:
+                continue
+            if isinstance(statement, sqlglot.exp.Create) and statement.kind == "TABLE":
+                self._tables.add(statement.find(sqlglot.exp.Table).name)
+            for table in statement.find_all(sqlglot.exp.Table):
+                if table.name in self._tables:
+                    table.set("catalog", None)
+                    table.set("db", None)
+            statements.append(statement.sql("duckdb"))
+        return ";\n".join(statements)
+
+    def query(self, sql: str, job_config: Any = None) -> LocalQueryJob:
+        """Runs a BigQuery SQL query against the local tables."""
+        del job_config  # Unused.
+        start = time.perf_counter()
+        # A cursor per query, so queries can run from several threads.
+        cursor = self.connection.cursor().execute(self.to_local_sql(sql))
+        columns = [column[0] for column in cursor.description or []]
+        rows = cursor.fetchall() if columns else []
+        return LocalQueryJob(
+            sql, LocalRowIterator(columns, rows), time.perf_counter() - start
+        )
@@ -0,0 +1,151 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replay of recorded model responses for the NL2SQL benchmark.
+
+A `Cassette` holds the recorded responses for one benchmark question, in the
+order the pipeline requested them. `RecordedGenaiClient` stands in for the
+`google.genai.Client` used by the baseline tools and `RecordedGeminiModel` for
+the `GeminiModel` used by the ChaseSQL tools. Both count calls and prompt and
+output tokens, and optionally sleep for the recorded model latency.
+"""
+
+import dataclasses
+import time
+from typing import Any, Callable, List, Optional
+
+# Rough characters-per-token ratio used when the prompt is not sent to a real
+# tokenizer. It is only used to compare prompt sizes between runs.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str | None) -> int:
+    """Estimates the number of tokens in a text."""
+    return len(text or "") // CHARS_PER_TOKEN
+
+
+class CassetteExhaustedError(RuntimeError):
+    """Raised when the pipeline makes more model calls than were recorded."""
+
+
+@dataclasses.dataclass
+class LlmCallRecord:
+    """Accounting for a single replayed model call."""
+
+    stage: str
+    prompt_tokens: int
+    output_tokens: int
+    latency_ms: float
+
+
+class Cassette:
+    """Recorded model responses for a single benchmark question.
+
+    Attributes:
+        responses: Recorded responses per stage, each a list of
+          `{"text": ..., "latency_ms": ...}` dictionaries in call order.
+        simulate_latency: True if replayed calls should sleep for the recorded
+          latency.
+        calls: The calls replayed so far.
+    """
+
+    def __init__(
+        self, responses: dict[str, list[dict[str, Any]]], simulate_latency: bool
+    ):
+        self.responses = {k: list(v) for k, v in responses.items()}
+        self.simulate_latency = simulate_latency
+        self.calls: list[LlmCallRecord] = []
+        self.stage: str | None = None
+
+    def replay(self, prompt_text: str) -> str:
+        """Returns the next recorded response for the current stage."""
+        recorded = self.responses.get(self.stage) or []
+        if not recorded:
+            raise CassetteExhaustedError(
+                f"No recorded response left for stage {self.stage}"
+            )
+        response = recorded.pop(0)
+        latency_ms = float(response.get("latency_ms", 0))
+        if self.simulate_latency:
+            time.sleep(latency_ms / 1000)
+        self.calls.append(
+            LlmCallRecord(
+                stage=self.stage,
+                prompt_tokens=estimate_tokens(prompt_text),
+                output_tokens=estimate_tokens(response["text"]),
+                latency_ms=latency_ms,
+            )
+        )
+        return response["text"]
+
+
+@dataclasses.dataclass
+class _RecordedResponse:
+    text: str
+
+
+class _RecordedModels:
+    def __init__(self, client: "RecordedGenaiClient"):
+        self._client = client
+
+    def generate_content(self, model: str, contents: Any, config: Any = None):
+        del model, config  # Unused.
+        if not isinstance(contents, list):
+            contents = [contents]
+        prompt_text = "".join(
+            part if isinstance(part, str) else (getattr(part, "text", "") or "")
+            for part in contents
+        )
+        return _RecordedResponse(text=self._client.cassette.replay(prompt_text))
+
+
+class RecordedGenaiClient:
+    """Stand-in for `google.genai.Client` that replays a cassette."""
+
+    def __init__(self):
+        self.cassette: Cassette | None = None
+        self.models = _RecordedModels(self)
+
+
+class RecordedGeminiModel:
+    """Stand-in for the ChaseSQL `GeminiModel` that replays a cassette.
+
+    The benchmark points `RecordedGeminiModel.cassette` at the cassette of the
+    question being run before each pipeline invocation.
+    """
+
+    cassette: Cassette | None = None
+
+    def __init__(
+        self, model_name: str = "recorded", temperature: float = 0.0, **kwargs
+    ):
+        del kwargs  # Unused.
+        self.model_name = model_name
+        self.temperature = temperature
+
+    def call(self, prompt: str, parser_func=None) -> str:
+        response = self.cassette.replay(prompt)
+        if parser_func:
+            return parser_func(response)
+        return response
+
+    def call_parallel(
+        self,
+        prompts: List[str],
+        parser_func: Optional[Callable[[str], str]] = None,
+        timeout: int = 60,
+        max_retries: int = 5,
+    ) -> List[Optional[str]]:
+        del timeout, max_retries  # Unused.
+        return [self.call(prompt, parser_func) for prompt in prompts]
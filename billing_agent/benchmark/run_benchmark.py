@@ -0,0 +1,407 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline benchmark of the NL2SQL pipeline of the database agent.
+
+Replays a corpus of billing questions through the database agent tools
+(`initial_bq_nl2sql` or the ChaseSQL `initial_bq_nl2sql`, then
+`expand_to_actual_billing_tables` and `run_bigquery_validation`) with recorded
+model responses and a DuckDB stand-in for BigQuery, and reports:
+
+- p50/p95 latency per stage and for the whole pipeline,
+- estimated prompt and output tokens per question,
+- LLM calls per question,
+- execution-match accuracy against the gold SQL of each question.
+
+Usage:
+    python -m billing_agent.benchmark.run_benchmark --pipeline baseline
+    python -m billing_agent.benchmark.run_benchmark --pipeline chase \
+        --simulate-latency --output bench_output.json
+    python -m billing_agent.benchmark.run_benchmark --rollup
+    python -m billing_agent.benchmark.run_benchmark --parallel-tables
+"""
+
+import argparse
+import dataclasses
+import datetime
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+import pyarrow as pa
+from billing_agent.sub_agents.bigquery import harvest, rollups
+from billing_agent.sub_agents.bigquery import tools as bq_tools
+from billing_agent.sub_agents.bigquery.chase_sql import (
+    chase_constants,
+    chase_db_tools,
+)
+
+from billing_agent.utils.synthetic_billing_data import (
+    BILLING_EXPORT_SCHEMA,
+    generate_table,
+)
+
+from .local_bigquery import LocalBigQueryClient
+from .recorded_models import Cassette, RecordedGeminiModel, RecordedGenaiClient
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+DEFAULT_CORPUS = FIXTURES_DIR / "billing_questions.jsonl"
+
+PROJECT_ID = "billing-bench"
+DATASET_ID = "billing"
+PROTOTYPE_TABLE = "gcp_billing_export_resource_v1_01"
+TARGET_TABLES = [
+    f"{PROJECT_ID}.{DATASET_ID}.gcp_billing_export_resource_v1_01",
+    f"{PROJECT_ID}.{DATASET_ID}.gcp_billing_export_resource_v1_02",
+]
+ROLLUP_TABLE = f"{PROJECT_ID}.{DATASET_ID}.billing_daily_rollup"
+FIXTURE_START_DATE = datetime.date(2025, 1, 1)
+FIXTURE_NUM_DAYS = 90
+
+STAGES = [
+    "initial_bq_nl2sql",
+    "expand_to_actual_billing_tables",
+    "run_bigquery_validation",
+]
+
+_ARROW_TO_BQ_TYPES = {
+    "string": "STRING",
+    "double": "FLOAT",
+    "int64": "INTEGER",
+    "bool": "BOOLEAN",
+}
+
+
+class _ToolContext:
+    """Minimal stand-in for `ToolContext`; the tools only use `state`."""
+
+    def __init__(self, state: dict[str, Any]):
+        self.state = state
+
+
+@dataclasses.dataclass
+class QuestionResult:
+    """Benchmark outcome for a single question."""
+
+    id: str
+    stage_latency_ms: dict[str, float]
+    llm_calls: int
+    prompt_tokens: int
+    output_tokens: int
+    recorded_model_latency_ms: float
+    execution_match: bool
+    error: str | None = None
+
+
+def render_ddl_schema(client: LocalBigQueryClient, table_id: str) -> str:
+    """Renders the schema of a local table like `get_bigquery_schema` does."""
+    ddl_statement = f"CREATE OR REPLACE TABLE `{table_id}` (\n"
+    for field in BILLING_EXPORT_SCHEMA:
+        field_type = field.type
+        is_array = pa.types.is_list(field_type)
+        if is_array:
+            field_type = field_type.value_type
+        if pa.types.is_struct(field_type):
+            bq_type = "RECORD"
+        elif pa.types.is_timestamp(field_type):
+            bq_type = "TIMESTAMP"
+        else:
+            bq_type = _ARROW_TO_BQ_TYPES.get(str(field_type), "STRING")
+        ddl_statement += f"  `{field.name}` {bq_type}"
+        if is_array:
+            ddl_statement += " ARRAY"
+        ddl_statement += ",\n"
+    ddl_statement = ddl_statement[:-2] + "\n);\n\n"
+
+    sample_rows = client.query(f"SELECT * FROM `{table_id}` LIMIT 5").result()
+    ddl_statement += f"-- Example values for table `{table_id}`:\n"
+    for row in sample_rows:
+        values = []
+        for key, value in row.items():
+            if key.startswith("_"):
+                continue  # Pseudo-columns are not part of the exported schema.
+            if isinstance(value, str):
+                values.append(f"'{value}'")
+            elif value is None:
+                values.append("NULL")
+            else:
+                values.append(f"{value}")
+        ddl_statement += f"INSERT INTO `{table_id}` VALUES\n({','.join(values)});\n\n"
+    return ddl_statement
+
+
+def build_local_bigquery(
+    rows_per_day: int, data_dir: Path | None = None
+) -> LocalBigQueryClient:
+    """Loads the synthetic billing export tables into a local client.
+
+    Args:
+        rows_per_day (int): The number of generated rows per table and day.
+        data_dir (Path | None): A directory written by
+          `synthetic_billing_data.write_billing_export` to load instead of
+          generating the tables in memory, e.g. for scale tests.
+
+    Returns:
+        LocalBigQueryClient: The client holding all `TARGET_TABLES`.
+    """
+    client = LocalBigQueryClient(project=PROJECT_ID)
+    for seed, table_id in enumerate(TARGET_TABLES):
+        if data_dir:
+            client.load_parquet_export(table_id, data_dir / table_id.split(".")[-1])
+            continue
+        client.load_table(
+            table_id,
+            generate_table(
+                start_date=FIXTURE_START_DATE,
+                num_days=FIXTURE_NUM_DAYS,
+                rows_per_day=rows_per_day,
+                billing_account_id=f"01A2B3-C4D5E6-F7A8B{seed}",
+                seed=seed,
+            ),
+        )
+    return client
+
+
+def load_corpus(path: Path) -> list[dict[str, Any]]:
+    """Loads the benchmark questions from a JSONL file."""
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+def _normalize_rows(rows: list[dict[str, Any]]) -> list[tuple[str, ...]]:
+    """Normalizes result rows for order- and name-insensitive comparison."""
+
+    def _normalize(value: Any) -> str:
+        if isinstance(value, datetime.date):
+            return value.strftime("%Y-%m-%d")
+        if isinstance(value, float):
+            return "nan" if math.isnan(value) else f"{value:.4f}"
+        return str(value)
+
+    return sorted(tuple(_normalize(v) for v in row.values()) for row in rows)
+
+
+def _strip_code_fences(sql: str) -> str:
+    # The root agent passes the SQL on without markdown fences.
+    return sql.replace("```sql", "").replace("```", "").strip()
+
+
+def run_question(
+    entry: dict[str, Any],
+    pipeline: str,
+    client: LocalBigQueryClient,
+    genai_client: RecordedGenaiClient,
+    database_settings: dict[str, Any],
+    simulate_latency: bool,
+) -> QuestionResult:
+    """Runs a single benchmark question through the pipeline."""
+    cassette = Cassette(entry["responses"], simulate_latency=simulate_latency)
+    genai_client.cassette = cassette
+    RecordedGeminiModel.cassette = cassette
+    tool_context = _ToolContext({"database_settings": database_settings})
+    question = entry["question"]
+    stage_latency_ms: dict[str, float] = {}
+    error = None
+    query_result = None
+
+    try:
+        start = time.perf_counter()
+        if pipeline == "chase":
+            cassette.stage = "chase_initial_bq_nl2sql"
+            raw_sql = chase_db_tools.initial_bq_nl2sql(question, tool_context)
+        else:
+            cassette.stage = "initial_bq_nl2sql"
+            raw_sql = bq_tools.initial_bq_nl2sql(question, tool_context)
+        stage_latency_ms["initial_bq_nl2sql"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        cassette.stage = "expand_to_actual_billing_tables"
+        final_sql = bq_tools.expand_to_actual_billing_tables(
+            question, raw_sql, tool_context
+        )
+        stage_latency_ms["expand_to_actual_billing_tables"] = (
+            time.perf_counter() - start
+        ) * 1000
+
+        start = time.perf_counter()
+        validation = bq_tools.run_bigquery_validation(
+            _strip_code_fences(final_sql), tool_context
+        )
+        stage_latency_ms["run_bigquery_validation"] = (
+            time.perf_counter() - start
+        ) * 1000
+        query_result = validation["query_result"]
+        error = None if query_result is not None else validation["error_message"]
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        error = f"{type(e).__name__}: {e}"
+
+    execution_match = False
+    if query_result is not None:
+        gold_rows = list(client.query(entry["gold_sql"]).result())
+        execution_match = _normalize_rows(
+            gold_rows[: bq_tools.MAX_NUM_ROWS]
+        ) == _normalize_rows(query_result)
+
+    return QuestionResult(
+        id=entry["id"],
+        stage_latency_ms=stage_latency_ms,
+        llm_calls=len(cassette.calls),
+        prompt_tokens=sum(c.prompt_tokens for c in cassette.calls),
+        output_tokens=sum(c.output_tokens for c in cassette.calls),
+        recorded_model_latency_ms=sum(c.latency_ms for c in cassette.calls),
+        execution_match=execution_match,
+        error=error,
+    )
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(results: list[QuestionResult]) -> dict[str, Any]:
+    """Aggregates per-question results into the benchmark report."""
+    num_questions = len(results)
+    latency = {}
+    for stage in STAGES + ["total"]:
+        if stage == "total":
+            values = [sum(r.stage_latency_ms.values()) for r in results]
+        else:
+            values = [
+                r.stage_latency_ms[stage] for r in results if stage in r.stage_latency_ms
+            ]
+        latency[stage] = {
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+        }
+    return {
+        "questions": num_questions,
+        "latency": latency,
+        "prompt_tokens_per_question": sum(r.prompt_tokens for r in results)
+        / max(num_questions, 1),
+        "output_tokens_per_question": sum(r.output_tokens for r in results)
+        / max(num_questions, 1),
+        "llm_calls_per_question": sum(r.llm_calls for r in results)
+        / max(num_questions, 1),
+        "recorded_model_latency_ms": {
+            "p50_ms": percentile([r.recorded_model_latency_ms for r in results], 50),
+            "p95_ms": percentile([r.recorded_model_latency_ms for r in results], 95),
+        },
+        "execution_match_accuracy": sum(r.execution_match for r in results)
+        / max(num_questions, 1),
+        "errors": {r.id: r.error for r in results if r.error},
+    }
+
+
+def print_report(report: dict[str, Any]) -> None:
+    print(f"Questions: {report['questions']}")
+    print(f"{'stage':<35}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage, values in report["latency"].items():
+        print(f"{stage:<35}{values['p50_ms']:>12.1f}{values['p95_ms']:>12.1f}")
+    model_latency = report["recorded_model_latency_ms"]
+    print(
+        f"{'recorded model latency':<35}"
+        f"{model_latency['p50_ms']:>12.1f}{model_latency['p95_ms']:>12.1f}"
+    )
+    print(f"Prompt tokens / question:   {report['prompt_tokens_per_question']:.0f}")
+    print(f"Output tokens / question:   {report['output_tokens_per_question']:.0f}")
+    print(f"LLM calls / question:       {report['llm_calls_per_question']:.2f}")
+    print(f"Execution-match accuracy:   {report['execution_match_accuracy']:.1%}")
+    for question_id, error in report["errors"].items():
+        print(f"  {question_id}: {error}")
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pipeline", choices=["baseline", "chase"], default="baseline")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--rows-per-day", type=int, default=100)
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        help="Load pre-generated Parquet billing exports from this directory.",
+    )
+    parser.add_argument(
+        "--simulate-latency",
+        action="store_true",
+        help="Sleep for the recorded model latency on every replayed call.",
+    )
+    parser.add_argument(
+        "--rollup",
+        action="store_true",
+        help="Roll up the tables daily and route covered queries to the rollup.",
+    )
+    parser.add_argument(
+        "--parallel-tables",
+        action="store_true",
+        help="Run aggregates over several tables as one query per table.",
+    )
+    parser.add_argument("--output", type=Path, help="Write the report as JSON.")
+    args = parser.parse_args(argv)
+
+    client = build_local_bigquery(args.rows_per_day, args.data_dir)
+    genai_client = RecordedGenaiClient()
+
+    # Point the tools at the recorded models and the local BigQuery stand-in.
+    bq_tools.llm_client = genai_client
+    bq_tools.bq_client = client
+    bq_tools.fetch_web_content = lambda url: ""
+    chase_db_tools.GeminiModel = RecordedGeminiModel
+    os.environ["TARGET_BILLING_TABLES"] = ",".join(TARGET_TABLES)
+    if args.rollup:
+        for table_id in TARGET_TABLES:
+            rollups.refresh_rollup(client, ROLLUP_TABLE, table_id)
+        os.environ["ROLLUP_TABLE"] = ROLLUP_TABLE
+    bq_tools.PARALLEL_TABLE_QUERIES = args.parallel_tables
+    # Every question must reach the recorded models; harvested SQL and
+    # examples would make the runs depend on the order of the questions.
+    harvest.HARVEST_ENABLED = False
+
+    database_settings = {
+        "prototype_billing_table": PROTOTYPE_TABLE,
+        "bq_project_id": PROJECT_ID,
+        "bq_dataset_id": DATASET_ID,
+        "bq_ddl_schema": render_ddl_schema(client, TARGET_TABLES[0]),
+        **chase_constants.chase_sql_constants_dict,
+    }
+
+    results = [
+        run_question(
+            entry,
+            pipeline=args.pipeline,
+            client=client,
+            genai_client=genai_client,
+            database_settings=database_settings,
+            simulate_latency=args.simulate_latency,
+        )
+        for entry in load_corpus(args.corpus)
+    ]
+    report = summarize(results)
+    report["pipeline"] = args.pipeline
+    report["results"] = [dataclasses.asdict(r) for r in results]
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -14,25 +14,31 @@
 
 """Data Science Agent V2: generate nl2py and use code interpreter to run the code."""
 import os
-from google.adk.code_executors import VertexAiCodeExecutor
 from google.adk.agents import Agent
+from billing_agent.utils import client_registry
 from .prompts import return_instructions_ds
-from google.adk.models.lite_llm import LiteLlm
+from .tools import (
+    describe_data,
+    detect_anomalies,
+    forecast,
+    period_over_period,
+    top_contributors,
+)
 
 
 
 root_agent = Agent(
-    model=LiteLlm(
-        model='litellm_proxy/gemini-2.5-pro',
-        api_base='https://litellm-cloudrun-668429440317.us-central1.run.app',
-        # Pass authentication headers if needed
-        # extra_headers=auth_headers
-        # Alternatively, if endpoint uses an API key:
-        api_key='sk-zQZEBtCjkNzFvxNFUtTDew'
-    ),
+    model=client_registry.litellm_model(),
     name="data_science_agent",
     instruction=return_instructions_ds(),
-    code_executor=VertexAiCodeExecutor(
+    tools=[
+        describe_data,
+        period_over_period,
+        top_contributors,
+        detect_anomalies,
+        forecast,
+    ],
+    code_executor=client_registry.code_executor(
         optimize_data_file=True,
         stateful=True,
     ),
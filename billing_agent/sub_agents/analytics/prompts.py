@@ -77,6 +77,16 @@ def return_instructions_ds() -> str:
 
   **Data in prompt:** Some queries contain the input data directly in the prompt. You have to parse that data into a pandas DataFrame. ALWAYS parse all the data. NEVER edit the data that are given to you.
 
+  **Data in `df`:** Some queries say that the data is already loaded in the pandas DataFrame `df`. Then use `df` directly and NEVER re-create it from the prompt; start with `explore_df(df)` to see its values.
+
+  **Statistics tools:** For common analyses of the last query result, call these tools instead of writing code; they return the numbers directly:
+    - `describe_data`: row count, totals and distributions of the columns.
+    - `period_over_period`: the value per day/week/month/quarter/year and its change from the previous period, optionally per group.
+    - `top_contributors`: the top values of a dimension by total and share, and the biggest changes between the last two periods.
+    - `detect_anomalies`: unusual values by z-score or interquartile range, optionally per period and group.
+    - `forecast`: a linear trend forecast of the next periods with a 95% interval.
+  If a tool returns an `error_message` (e.g. an unknown column), correct the call or write code. Write code for plots and for anything the tools do not cover.
+
   **Answerability:** Some queries may not be answerable with the available data. In those cases, inform the user why you cannot process their query and suggest what type of data would be needed to fulfill their request.
 
   **WHEN YOU DO PREDICTION / MODEL FITTING, ALWAYS PLOT FITTED LINE AS WELL **
@@ -0,0 +1,481 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Statistics tools of the analytics agent.
+
+Most analysis requests are totals, growth rates, top-N lists, anomaly flags or
+a short forecast of the last query result. Instead of generating code and
+running it in the code executor, the agent can call these tools, which compute
+the answer with vectorized pandas and NumPy operations in the agent process:
+
+    describe_data()
+    period_over_period("usage_month", "cost", period="month")
+    top_contributors("service", "cost", top_n=5, time_column="usage_month")
+    detect_anomalies("cost", method="iqr", time_column="usage_date")
+    forecast("usage_month", "cost", periods=3)
+
+The tools read the last query result from session state: the Arrow file of
+`arrow_results` if there is one, otherwise the rows that `call_ds_agent` put
+into `INPUT_ROWS_KEY`, or `query_result`. The agent runs in a session of its
+own, which cannot load the artifact `query_result` may have been offloaded to
+in the parent session, so `call_ds_agent` passes the loaded rows. They
+return JSON-serializable dicts, or a dict with an "error_message" that tells
+the agent what went wrong (e.g. an unknown column), so it can correct the call
+or fall back to code.
+"""
+
+import functools
+import json
+import logging
+from typing import Any, Optional
+
+import numpy as np
+import pandas as pd
+from billing_agent.utils import arrow_results, state_compaction, tracing
+from google.adk.tools import ToolContext
+
+logger = logging.getLogger(__name__)
+
+# State key of the query result rows passed in by `call_ds_agent`. The "temp:"
+# prefix keeps them out of the persisted session state.
+INPUT_ROWS_KEY = "temp:analysis_input_rows"
+
+# Rows returned by a tool at most; the most relevant rows are kept.
+MAX_OUTPUT_ROWS = 100
+
+_PERIODS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+
+class AnalysisError(ValueError):
+    """An error in the arguments of a tool or in the data it got."""
+
+
+async def _load_frame(tool_context: ToolContext) -> pd.DataFrame:
+    """Returns the last query result as a DataFrame."""
+    ref = tool_context.state.get(arrow_results.STATE_KEY)
+    if arrow_results.is_available(ref):
+        return arrow_results.read_frame(ref)
+    rows = tool_context.state.get(INPUT_ROWS_KEY)
+    if rows is None:
+        rows = await state_compaction.load_state_value(
+            tool_context, "query_result")
+    if not rows:
+        raise AnalysisError(
+            "No query result is available. Analyze the data in the prompt with"
+            " code instead."
+        )
+    return pd.DataFrame(rows)
+
+
+def _column(df: pd.DataFrame, name: str) -> str:
+    """Returns the column of a name, ignoring case."""
+    if name in df.columns:
+        return name
+    matches = [c for c in df.columns if str(c).lower() == name.lower()]
+    if len(matches) == 1:
+        return matches[0]
+    raise AnalysisError(
+        f"Unknown column {name!r}. Available columns: {list(df.columns)}"
+    )
+
+
+def _numeric(df: pd.DataFrame, name: str) -> pd.Series:
+    column = _column(df, name)
+    values = pd.to_numeric(df[column], errors="coerce")
+    if values.notna().sum() == 0:
+        raise AnalysisError(f"Column {column!r} has no numeric values.")
+    return values
+
+
+def _periods(df: pd.DataFrame, name: str, period: str) -> pd.Series:
+    """Returns the period of each row of a date, timestamp or month column."""
+    if period not in _PERIODS:
+        raise AnalysisError(
+            f"Unknown period {period!r}. Use one of {list(_PERIODS)}."
+        )
+    values = df[_column(df, name)]
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        text = values.astype(str)
+        # Billing months, e.g. invoice.month, are strings like "202501".
+        if text.str.fullmatch(r"\d{6}").all():
+            values = pd.to_datetime(text, format="%Y%m", errors="coerce")
+        else:
+            values = pd.to_datetime(text, errors="coerce", utc=True)
+    if values.isna().all():
+        raise AnalysisError(f"Column {name!r} has no dates.")
+    if getattr(values.dt, "tz", None) is not None:
+        values = values.dt.tz_localize(None)
+    return values.dt.to_period(_PERIODS[period])
+
+
+def _records(df: pd.DataFrame) -> list[dict[str, Any]]:
+    """Returns rows as JSON-serializable records."""
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.PeriodDtype):
+            df[column] = df[column].astype(str)
+    return json.loads(df.round(6).to_json(orient="records", date_format="iso"))
+
+
+def _number(value: Any) -> Optional[float]:
+    return None if pd.isna(value) else round(float(value), 6)
+
+
+def _reports_errors(func):
+    """Returns an `AnalysisError` of a tool to the agent as its result."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except AnalysisError as e:
+            return {"error_message": str(e)}
+
+    return wrapper
+
+
+@tracing.trace_tool
+@_reports_errors
+async def describe_data(
+    tool_context: ToolContext,
+    columns: Optional[list[str]] = None,
+) -> dict:
+    """Describes the columns of the last query result.
+
+    Args:
+        tool_context (ToolContext): The tool context.
+        columns (list[str]): The columns to describe; all columns if not set.
+
+    Returns:
+        dict: The number of rows; for numeric columns the count, sum, mean,
+        standard deviation, minimum, quartiles and maximum; for other
+        columns the number of distinct values and the most frequent ones.
+    """
+    df = await _load_frame(tool_context)
+    if columns:
+        df = df[[_column(df, c) for c in columns]]
+    numeric = df.select_dtypes(include="number")
+    numeric_stats = {}
+    if not numeric.columns.empty:
+        # describe() raises on a frame without columns.
+        stats = numeric.describe().T
+        stats.insert(1, "sum", numeric.sum())
+        numeric_stats = {
+            str(column): {key: _number(value) for key, value in row.items()}
+            for column, row in stats.iterrows()
+        }
+    other = df.drop(columns=numeric.columns)
+    categorical = {}
+    for column in other.columns:
+        values = other[column].astype(str)
+        categorical[str(column)] = {
+            "distinct": int(values.nunique()),
+            "top": {str(k): int(v) for k, v in values.value_counts().head(5).items()},
+        }
+    return {
+        "num_rows": len(df),
+        "numeric": numeric_stats,
+        "categorical": categorical,
+    }
+
+
+@tracing.trace_tool
+@_reports_errors
+async def period_over_period(
+    time_column: str,
+    value_column: str,
+    tool_context: ToolContext,
+    period: str = "month",
+    group_by: Optional[str] = None,
+) -> dict:
+    """Sums a value per period and compares each period with the one before.
+
+    Args:
+        time_column (str): The date, timestamp or month column.
+        value_column (str): The numeric column to sum, e.g. the cost.
+        tool_context (ToolContext): The tool context.
+        period (str): "day", "week", "month", "quarter" or "year".
+        group_by (str): An optional column to compare each of its values
+          separately, e.g. the service.
+
+    Returns:
+        dict: A row per period (and group) with the value, the value of the
+        previous period, the change and the change in percent, and the
+        total of the last period compared with the one before.
+    """
+    df = await _load_frame(tool_context)
+    frame = pd.DataFrame({
+        "period": _periods(df, time_column, period),
+        "value": _numeric(df, value_column),
+    })
+    keys = ["period"]
+    if group_by:
+        frame.insert(0, "group", df[_column(df, group_by)].astype(str))
+        keys = ["group", "period"]
+    totals = frame.groupby(keys, sort=True)["value"].sum().reset_index()
+    previous = (
+        totals.groupby("group")["value"].shift(1)
+        if group_by
+        else totals["value"].shift(1)
+    )
+    totals["previous"] = previous
+    totals["change"] = totals["value"] - previous
+    totals["change_pct"] = totals["change"] / previous.abs().replace(0, np.nan) * 100
+
+    overall = frame.groupby("period")["value"].sum().sort_index()
+    summary = {}
+    if len(overall) >= 2:
+        last, before = overall.iloc[-1], overall.iloc[-2]
+        summary = {
+            "last_period": str(overall.index[-1]),
+            "value": _number(last),
+            "previous_period": str(overall.index[-2]),
+            "previous": _number(before),
+            "change": _number(last - before),
+            "change_pct": _number((last - before) / abs(before) * 100)
+            if before
+            else None,
+        }
+    return {
+        "rows": _records(totals.tail(MAX_OUTPUT_ROWS)),
+        "truncated": len(totals) > MAX_OUTPUT_ROWS,
+        "summary": summary,
+    }
+
+
+@tracing.trace_tool
+@_reports_errors
+async def top_contributors(
+    dimension: str,
+    value_column: str,
+    tool_context: ToolContext,
+    top_n: int = 10,
+    time_column: Optional[str] = None,
+    period: str = "month",
+) -> dict:
+    """Ranks the values of a dimension by their total and share.
+
+    Args:
+        dimension (str): The column to rank, e.g. the service or project.
+        value_column (str): The numeric column to sum, e.g. the cost.
+        tool_context (ToolContext): The tool context.
+        top_n (int): The number of values to return.
+        time_column (str): An optional date or month column. If set, the
+          values are also ranked by their change between the last two
+          periods.
+        period (str): The period of `time_column`: "day", "week", "month",
+          "quarter" or "year".
+
+    Returns:
+        dict: The top values with their total, share and cumulative share of
+        the grand total, and, with a time column, the top changes with their
+        contribution to the total change.
+    """
+    df = await _load_frame(tool_context)
+    keys = df[_column(df, dimension)].astype(str)
+    values = _numeric(df, value_column)
+    totals = values.groupby(keys).sum().sort_values(ascending=False)
+    grand_total = totals.sum()
+    top = totals.head(top_n).rename("total").to_frame()
+    top["share"] = top["total"] / grand_total if grand_total else np.nan
+    top["cumulative_share"] = top["share"].cumsum()
+    result = {
+        "grand_total": _number(grand_total),
+        "distinct": len(totals),
+        "top": _records(top.rename_axis(dimension).reset_index()),
+    }
+    if time_column:
+        periods = _periods(df, time_column, period)
+        by_period = values.groupby([keys, periods]).sum().unstack(fill_value=0)
+        if by_period.shape[1] < 2:
+            raise AnalysisError(f"{time_column!r} has fewer than two periods.")
+        last, before = by_period.columns[-1], by_period.columns[-2]
+        change = (by_period[last] - by_period[before]).rename("change").to_frame()
+        change.insert(0, "previous", by_period[before])
+        change.insert(1, "value", by_period[last])
+        total_change = change["change"].sum()
+        change["contribution"] = (
+            change["change"] / total_change if total_change else np.nan
+        )
+        change = change.reindex(
+            change["change"].abs().sort_values(ascending=False).index
+        ).head(top_n)
+        result["change"] = {
+            "period": str(last),
+            "previous_period": str(before),
+            "total_change": _number(total_change),
+            "top": _records(change.rename_axis(dimension).reset_index()),
+        }
+    return result
+
+
+@tracing.trace_tool
+@_reports_errors
+async def detect_anomalies(
+    value_column: str,
+    tool_context: ToolContext,
+    method: str = "zscore",
+    threshold: Optional[float] = None,
+    time_column: Optional[str] = None,
+    period: str = "day",
+    group_by: Optional[str] = None,
+) -> dict:
+    """Flags unusual values with z-scores or the interquartile range.
+
+    Args:
+        value_column (str): The numeric column to check, e.g. the cost.
+        tool_context (ToolContext): The tool context.
+        method (str): "zscore" flags values more than `threshold` standard
+          deviations from the mean; "iqr" flags values more than `threshold`
+          interquartile ranges below the first or above the third quartile.
+        threshold (float): Defaults to 3 for "zscore" and 1.5 for "iqr".
+        time_column (str): An optional date column. If set, the value is
+          summed per period first and the periods are checked.
+        period (str): The period of `time_column`: "day", "week", "month",
+          "quarter" or "year".
+        group_by (str): An optional column to check each of its values
+          against its own distribution, e.g. the service.
+
+    Returns:
+        dict: The anomalies, most unusual first, with their score and the
+        expected range, and the number of values checked.
+    """
+    if method not in ("zscore", "iqr"):
+        raise AnalysisError(f"Unknown method {method!r}. Use 'zscore' or 'iqr'.")
+    if threshold is None:
+        threshold = 3.0 if method == "zscore" else 1.5
+    df = await _load_frame(tool_context)
+    frame = pd.DataFrame({"value": _numeric(df, value_column)})
+    keys = []
+    if group_by:
+        frame.insert(0, "group", df[_column(df, group_by)].astype(str))
+        keys.append("group")
+    if time_column:
+        frame.insert(len(keys), "period", _periods(df, time_column, period))
+        frame = frame.groupby(keys + ["period"], sort=True)["value"].sum().reset_index()
+    else:
+        frame = frame.reset_index(names="row")
+    frame = frame.dropna(subset=["value"])
+
+    grouped = frame.groupby(keys)["value"] if keys else None
+
+    def stat(name, *args):
+        if grouped is not None:
+            return grouped.transform(name, *args)
+        series = frame["value"]
+        return pd.Series(getattr(series, name)(*args), index=frame.index)
+
+    if method == "zscore":
+        mean, std = stat("mean"), stat("std").replace(0, np.nan)
+        frame["score"] = (frame["value"] - mean) / std
+        frame["expected_low"] = mean - threshold * std
+        frame["expected_high"] = mean + threshold * std
+        flagged = frame["score"].abs() > threshold
+    else:
+        q1, q3 = stat("quantile", 0.25), stat("quantile", 0.75)
+        iqr = (q3 - q1).replace(0, np.nan)
+        frame["expected_low"] = q1 - threshold * iqr
+        frame["expected_high"] = q3 + threshold * iqr
+        # Distance from the quartiles in interquartile ranges.
+        frame["score"] = np.where(
+            frame["value"] > q3, (frame["value"] - q3) / iqr, (frame["value"] - q1) / iqr
+        )
+        flagged = (frame["value"] < frame["expected_low"]) | (
+            frame["value"] > frame["expected_high"]
+        )
+    anomalies = frame[flagged.fillna(False)]
+    anomalies = anomalies.reindex(
+        anomalies["score"].abs().sort_values(ascending=False).index
+    )
+    return {
+        "method": method,
+        "threshold": threshold,
+        "checked": len(frame),
+        "num_anomalies": len(anomalies),
+        "anomalies": _records(anomalies.head(MAX_OUTPUT_ROWS)),
+    }
+
+
+@tracing.trace_tool
+@_reports_errors
+async def forecast(
+    time_column: str,
+    value_column: str,
+    tool_context: ToolContext,
+    periods: int = 3,
+    period: str = "month",
+) -> dict:
+    """Forecasts the total of the next periods with a linear trend.
+
+    Fits a least-squares line to the value summed per period and extends it,
+    with a 95% prediction interval. Good for a quick outlook; for seasonal
+    data or other models, write code instead.
+
+    Args:
+        time_column (str): The date, timestamp or month column.
+        value_column (str): The numeric column to sum, e.g. the cost.
+        tool_context (ToolContext): The tool context.
+        periods (int): The number of periods to forecast.
+        period (str): "day", "week", "month", "quarter" or "year".
+
+    Returns:
+        dict: The history with the fitted values, the forecast with its lower
+        and upper bound, the slope per period and the R² of the fit.
+    """
+    df = await _load_frame(tool_context)
+    history = (
+        _numeric(df, value_column)
+        .groupby(_periods(df, time_column, period))
+        .sum()
+        .sort_index()
+    )
+    # Periods without rows count as zero.
+    history = history.reindex(
+        pd.period_range(history.index[0], history.index[-1]), fill_value=0
+    )
+    n = len(history)
+    if n < 3:
+        raise AnalysisError(f"A forecast needs at least 3 periods, got {n}.")
+    x = np.arange(n, dtype=float)
+    y = history.to_numpy(dtype=float)
+    slope, intercept = np.polyfit(x, y, 1)
+    fitted = slope * x + intercept
+    residuals = y - fitted
+    total = ((y - y.mean()) ** 2).sum()
+    r_squared = 1 - (residuals**2).sum() / total if total else 1.0
+    sigma = np.sqrt((residuals**2).sum() / (n - 2))
+
+    future = np.arange(n, n + periods, dtype=float)
+    predicted = slope * future + intercept
+    # 95% prediction interval of a simple linear regression.
+    margin = 1.96 * sigma * np.sqrt(
+        1 + 1 / n + (future - x.mean()) ** 2 / ((x - x.mean()) ** 2).sum()
+    )
+    labels = [history.index[-1] + k for k in range(1, periods + 1)]
+    return {
+        "method": "linear trend",
+        "slope_per_period": _number(slope),
+        "r_squared": _number(r_squared),
+        "history": _records(pd.DataFrame({
+            "period": history.index,
+            "value": y,
+            "fitted": fitted,
+        })),
+        "forecast": _records(pd.DataFrame({
+            "period": pd.PeriodIndex(labels),
+            "value": predicted,
+            "lower": predicted - margin,
+            "upper": predicted + margin,
+        })),
+    }
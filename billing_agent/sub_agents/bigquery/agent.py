@@ -18,16 +18,23 @@ import os
 
 from google.adk.agents import Agent
 from google.adk.agents.callback_context import CallbackContext
-from google.adk.models.lite_llm import LiteLlm
-
 from google.genai import types
 
+from billing_agent.utils import client_registry, progress
+
 from . import tools
-from .chase_sql import chase_db_tools
 from .prompts import return_instructions_bigquery
 
 NL2SQL_METHOD = os.getenv("NL2SQL_METHOD", "BASELINE")
 
+# CHASE pulls in the Vertex AI SDK, sqlglot and regex; only import it if used.
+if NL2SQL_METHOD == "CHASE":
+    from .chase_sql import chase_db_tools
+
+    nl2sql_tool = chase_db_tools.initial_bq_nl2sql
+else:
+    nl2sql_tool = tools.initial_bq_nl2sql
+
 
 def setup_before_agent_call(callback_context: CallbackContext) -> None:
     """Setup the agent."""
@@ -38,24 +45,15 @@ def setup_before_agent_call(callback_context: CallbackContext) -> None:
 
 
 database_agent = Agent(
-    model=LiteLlm(
-        model='litellm_proxy/gemini-2.5-pro',
-        api_base='https://litellm-cloudrun-668429440317.us-central1.run.app',
-        # Pass authentication headers if needed
-        # extra_headers=auth_headers
-        # Alternatively, if endpoint uses an API key:
-        api_key='sk-zQZEBtCjkNzFvxNFUtTDew'
-    ),
+    model=client_registry.litellm_model(),
     name="database_agent",
     instruction=return_instructions_bigquery(),
+    # The tools make blocking model and BigQuery calls; run them in threads
+    # so the server keeps streaming while they work.
     tools=[
-        (
-            chase_db_tools.initial_bq_nl2sql
-            if NL2SQL_METHOD == "CHASE"
-            else tools.initial_bq_nl2sql
-        ),
-        tools.expand_to_actual_billing_tables,
-        tools.run_bigquery_validation,
+        progress.off_loop(nl2sql_tool),
+        progress.off_loop(tools.expand_to_actual_billing_tables),
+        progress.off_loop(tools.run_bigquery_validation),
     ],
     before_agent_callback=setup_before_agent_call,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
@@ -0,0 +1,309 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Answers a file of questions with SQL in bulk.
+
+Nightly reports ask hundreds of canned questions. Sending each through the
+root agent costs a conversation per question; this entry point runs the
+NL2SQL pipeline of the database agent (`initial_bq_nl2sql`, then
+`expand_to_actual_billing_tables`) directly:
+
+    python -m billing_agent.sub_agents.bigquery.batch questions.jsonl \
+        --output-dir reports/2025-06-01 --model-workers 16 --query-workers 4
+
+Each line of the input is a JSON object with a "question" and an optional
+"id" (the line number otherwise). Questions that are the same after
+normalization are answered once, and so are identical queries. SQL is
+generated by up to `--model-workers` threads; each finished SQL is queued for
+BigQuery, which runs at most `--query-workers` queries at a time, so
+throughput is bounded by the model and BigQuery quotas rather than by
+conversational turns. Queries routed to the daily rollup (see `rollups`) run
+on it.
+
+The rows of each question are written to `<output-dir>/<id>.parquet`, and
+`<output-dir>/results.jsonl` lists every question with its SQL, row count,
+latency and error, if any. Successful queries are harvested (see `harvest`)
+before the batch returns, so they become few-shot examples of the ChaseSQL
+prompts, which are kept across runs in `FEW_SHOT_STORE` if it is set. The
+question -> SQL cache of the harvest only lives in the memory of the process;
+a later run generates the SQL again.
+"""
+
+import argparse
+import concurrent.futures
+import dataclasses
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from billing_agent.utils import single_flight, tracing
+from billing_agent.utils.structured_logging import log_event
+
+from . import harvest
+from . import tools as bq_tools
+from .chase_sql import chase_db_tools
+
+logger = logging.getLogger(__name__)
+
+BATCH_MODEL_WORKERS = int(os.getenv("BATCH_MODEL_WORKERS", 8))
+BATCH_QUERY_WORKERS = int(os.getenv("BATCH_QUERY_WORKERS", 4))
+
+_UNSAFE_ID = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+@dataclasses.dataclass
+class BatchResult:
+    """The outcome of a question.
+
+    Attributes:
+        id: The ID of the question.
+        question: The question.
+        sql: The SQL that ran, or None if it could not be generated.
+        num_rows: The rows the query returned.
+        output: The Parquet file of the rows.
+        error: Why the question could not be answered, if it could not.
+        sql_seconds: The time to generate the SQL.
+        query_seconds: The time to run the query.
+    """
+
+    id: str
+    question: str
+    sql: Optional[str] = None
+    num_rows: int = 0
+    output: Optional[str] = None
+    error: Optional[str] = None
+    sql_seconds: float = 0.0
+    query_seconds: float = 0.0
+
+
+class _BatchContext:
+    """Stand-in for `ToolContext`; the NL2SQL tools only use `state`."""
+
+    def __init__(self, database_settings: dict[str, Any]):
+        self.state = {"database_settings": database_settings}
+
+
+def load_questions(path: Path) -> list[dict[str, str]]:
+    """Reads questions from a JSONL file.
+
+    Returns:
+        list[dict]: The "id" and "question" of each line.
+    """
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            questions.append({
+                "id": str(record.get("id") or number),
+                "question": record["question"],
+            })
+    return questions
+
+
+def _generate_sql(
+    question: str, pipeline: str, database_settings: dict
+) -> tuple[str, str]:
+    """Generates the SQL of a question on the billing tables.
+
+    Returns:
+        tuple: The SQL on the prototype table and on the billing tables.
+    """
+    tool_context = _BatchContext(database_settings)
+    if pipeline == "chase":
+        raw_sql = chase_db_tools.initial_bq_nl2sql(question, tool_context)
+    else:
+        raw_sql = bq_tools.initial_bq_nl2sql(question, tool_context)
+    final_sql = bq_tools.expand_to_actual_billing_tables(
+        question, raw_sql, tool_context
+    )
+    final_sql = final_sql.replace("```sql", "").replace("```", "").strip()
+    return raw_sql, final_sql
+
+
+def _run_query(sql: str, path: Path) -> tuple[int, Optional[int]]:
+    """Runs a query and writes its rows as Parquet.
+
+    Returns:
+        tuple: The number of rows and the bytes processed, if known.
+    """
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    if not bq_tools.is_read_only(sql):
+        raise ValueError("Contains disallowed DML/DDL operations.")
+    sql = bq_tools.route_to_rollup(sql) or sql
+    with tracing.trace_bigquery_job(sql) as span:
+        query_job = bq_tools.get_bq_client().query(sql)
+        table = query_job.result().to_arrow()
+        tracing.record_bigquery_job(span, query_job)
+    temp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, path)
+    return table.num_rows, getattr(query_job, "total_bytes_processed", None)
+
+
+def run_batch(
+    questions: list[dict[str, str]],
+    output_dir: Path,
+    pipeline: str = "baseline",
+    model_workers: int = BATCH_MODEL_WORKERS,
+    query_workers: int = BATCH_QUERY_WORKERS,
+    database_settings: Optional[dict[str, Any]] = None,
+) -> list[BatchResult]:
+    """Generates and runs the SQL of questions with bounded concurrency.
+
+    Args:
+        questions (list[dict]): The "id" and "question" of each question.
+        output_dir (Path): The directory of the Parquet files and results.
+        pipeline (str): "baseline" or "chase", the NL2SQL method.
+        model_workers (int): The SQL generations that run at a time.
+        query_workers (int): The queries that run at a time.
+        database_settings (dict): The database settings of the agents; read
+          from BigQuery if not given.
+
+    Returns:
+        list[BatchResult]: The results, in the order of the questions.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    database_settings = database_settings or bq_tools.get_database_settings()
+    target_tables = os.getenv(
+        "TARGET_BILLING_TABLES", database_settings.get("prototype_billing_table", "")
+    )
+
+    # One result per distinct question; duplicates share it.
+    unique: dict[str, BatchResult] = {}
+    for entry in questions:
+        key = single_flight.normalize_question(entry["question"])
+        if key not in unique:
+            file_id = _UNSAFE_ID.sub("_", entry["id"])
+            unique[key] = BatchResult(id=file_id, question=entry["question"])
+
+    lock = threading.Lock()
+    queries: dict[str, concurrent.futures.Future] = {}
+    pending: list[tuple[BatchResult, str, concurrent.futures.Future]] = []
+
+    with concurrent.futures.ThreadPoolExecutor(
+        query_workers, thread_name_prefix="batch-query"
+    ) as query_pool:
+
+        def generate(result: BatchResult) -> None:
+            start = time.monotonic()
+            try:
+                raw_sql, result.sql = _generate_sql(
+                    result.question, pipeline, database_settings
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                result.error = f"SQL generation failed: {e}"
+                return
+            finally:
+                result.sql_seconds = time.monotonic() - start
+            # The query is queued, so the worker moves on to the next
+            # question. Identical queries of different questions run once.
+            with lock:
+                key = single_flight.normalize_sql(result.sql)
+                if key not in queries:
+                    path = output_dir / f"{result.id}.parquet"
+                    queries[key] = query_pool.submit(_timed_query, result.sql, path)
+                pending.append((result, raw_sql, queries[key]))
+
+        with concurrent.futures.ThreadPoolExecutor(
+            model_workers, thread_name_prefix="batch-nl2sql"
+        ) as model_pool:
+            list(model_pool.map(generate, unique.values()))
+
+        for result, raw_sql, query in pending:
+            try:
+                num_rows, bytes_processed, seconds, path = query.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                result.error = f"Invalid SQL: {e}"
+                continue
+            result.num_rows, result.query_seconds = num_rows, seconds
+            result.output = str(path)
+            harvest.submit(
+                question=result.question,
+                raw_sql=raw_sql,
+                final_sql=result.sql,
+                target_tables=target_tables,
+                ddl_schema=database_settings.get("bq_ddl_schema"),
+                num_rows=num_rows,
+                bytes_processed=bytes_processed,
+                seconds=seconds,
+            )
+    # The harvester runs on a daemon thread, which would be stopped with the
+    # queries still queued when the process exits.
+    harvest.get_harvester().wait()
+
+    results = []
+    for entry in questions:
+        shared = unique[single_flight.normalize_question(entry["question"])]
+        results.append(dataclasses.replace(shared, id=entry["id"],
+                                           question=entry["question"]))
+    with open(output_dir / "results.jsonl", "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(dataclasses.asdict(result)) + "\n")
+
+    log_event(
+        logger,
+        "batch_finished",
+        "Batch NL2SQL finished",
+        questions=len(questions),
+        distinct_questions=len(unique),
+        queries=len(queries),
+        errors=sum(1 for r in unique.values() if r.error),
+    )
+    return results
+
+
+def _timed_query(sql: str, path: Path) -> tuple[int, Optional[int], float, Path]:
+    start = time.monotonic()
+    num_rows, bytes_processed = _run_query(sql, path)
+    return num_rows, bytes_processed, time.monotonic() - start, path
+
+
+def main(argv: Optional[list[str]] = None) -> list[BatchResult]:
+    """Answers the questions of a JSONL file."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", type=Path, help="A JSONL file of questions.")
+    parser.add_argument("--output-dir", type=Path, default=Path("batch_output"))
+    parser.add_argument(
+        "--pipeline", choices=["baseline", "chase"], default="baseline"
+    )
+    parser.add_argument("--model-workers", type=int, default=BATCH_MODEL_WORKERS)
+    parser.add_argument("--query-workers", type=int, default=BATCH_QUERY_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    results = run_batch(
+        load_questions(args.questions),
+        args.output_dir,
+        pipeline=args.pipeline,
+        model_workers=args.model_workers,
+        query_workers=args.query_workers,
+    )
+    failed = [r for r in results if r.error]
+    print(
+        f"Answered {len(results) - len(failed)} of {len(results)} questions;"
+        f" results in {args.output_dir / 'results.jsonl'}"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    main()
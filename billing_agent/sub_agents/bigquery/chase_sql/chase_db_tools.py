@@ -15,11 +15,16 @@
 """This code contains the implementation of the tools used for the CHASE-SQL agent."""
 
 import enum
+import logging
 import os
 
+from billing_agent.utils import progress, single_flight, tracing
 from google.adk.tools import ToolContext
 
+from .. import harvest
+
 # pylint: disable=g-importing-member
+from . import example_store
 from .dc_prompt_template import DC_PROMPT_TEMPLATE
 from .llm_utils import GeminiModel
 from .qp_prompt_template import QP_PROMPT_TEMPLATE
@@ -29,6 +34,11 @@ from .sql_postprocessor import sql_translator
 
 BQ_PROJECT_ID = os.getenv("BQ_PROJECT_ID")
 
+# Concurrent identical questions generate their SQL once.
+nl2sql_flight = single_flight.SingleFlight("chase_nl2sql")
+
+logger = logging.getLogger(__name__)
+
 
 class GenerateSQLType(enum.Enum):
     """Enum for the different types of SQL generation methods.
@@ -74,11 +84,12 @@ def parse_response(response: str) -> str:
         if "```sql" in response and "```" in response:
             query = response.split("```sql")[1].split("```")[0]
     except ValueError as e:
-        print(f"Error in parsing response: {e}")
+        logger.warning("Error in parsing response: %s", e)
         query = response
     return query.strip()
 
 
+@tracing.trace_tool
 def initial_bq_nl2sql(
     question: str,
     tool_context: ToolContext,
@@ -92,7 +103,7 @@ def initial_bq_nl2sql(
     Returns:
       str: An SQL statement to answer this question.
     """
-    print("****** Running agent with ChaseSQL algorithm.")
+    logger.debug("Running agent with ChaseSQL algorithm.")
     ddl_schema = tool_context.state["database_settings"]["bq_ddl_schema"]
     project = tool_context.state["database_settings"]["bq_project_id"]
     db = tool_context.state["database_settings"]["bq_dataset_id"]
@@ -111,37 +122,70 @@ def initial_bq_nl2sql(
     model = tool_context.state["database_settings"]["model"]
     temperature = tool_context.state["database_settings"]["temperature"]
     generate_sql_type = tool_context.state["database_settings"]["generate_sql_type"]
-
-    if generate_sql_type == GenerateSQLType.DC.value:
-        prompt = DC_PROMPT_TEMPLATE.format(
-            SCHEMA=ddl_schema, QUESTION=question, BQ_PROJECT_ID=BQ_PROJECT_ID
-        )
-    elif generate_sql_type == GenerateSQLType.QP.value:
-        prompt = QP_PROMPT_TEMPLATE.format(
-            SCHEMA=ddl_schema, QUESTION=question, BQ_PROJECT_ID=BQ_PROJECT_ID
+    billing_table = tool_context.state["database_settings"].get(
+        "prototype_billing_table", ""
+    )
+    if billing_table and "." not in billing_table:
+        billing_table = f"{project}.{db}.{billing_table}"
+
+    def generate() -> str:
+        if generate_sql_type == GenerateSQLType.DC.value:
+            template = DC_PROMPT_TEMPLATE
+        elif generate_sql_type == GenerateSQLType.QP.value:
+            template = QP_PROMPT_TEMPLATE
+        else:
+            raise ValueError(f"Unsupported generate_sql_type: {generate_sql_type}")
+        # The billing examples closest to the question replace the fixed ones.
+        examples = example_store.default_store().select(question)
+        prompt = example_store.build_prompt(
+            template,
+            examples,
+            billing_table=billing_table,
+            SCHEMA=ddl_schema,
+            QUESTION=question,
+            BQ_PROJECT_ID=BQ_PROJECT_ID,
         )
+
+        llm = GeminiModel(model_name=model, temperature=temperature)
+        requests = [prompt for _ in range(number_of_candidates)]
+        responses = llm.call_parallel(requests, parser_func=parse_response)
+        # Take just the first response.
+        responses = responses[0]
+
+        # If postprocessing of the SQL to transpile it to BigQuery is required,
+        # then do it here.
+        if transpile_to_bigquery:
+            translator = sql_translator.SqlTranslator(
+                model=llm,
+                temperature=temperature,
+                process_input_errors=process_input_errors,
+                process_tool_output_errors=process_tool_output_errors,
+            )
+            # pylint: disable=g-bad-todo
+            # pylint: enable=g-bad-todo
+            responses: str = translator.translate(
+                responses, ddl_schema=ddl_schema, db=db, catalog=project
+            )
+        return responses
+
+    cached = harvest.cached_sql(question, ddl_schema)
+    if cached is not None:
+        responses = cached.raw_sql
     else:
-        raise ValueError(f"Unsupported generate_sql_type: {generate_sql_type}")
-
-    model = GeminiModel(model_name=model, temperature=temperature)
-    requests = [prompt for _ in range(number_of_candidates)]
-    responses = model.call_parallel(requests, parser_func=parse_response)
-    # Take just the first response.
-    responses = responses[0]
-
-    # If postprocessing of the SQL to transpile it to BigQuery is required,
-    # then do it here.
-    if transpile_to_bigquery:
-        translator = sql_translator.SqlTranslator(
-            model=model,
-            temperature=temperature,
-            process_input_errors=process_input_errors,
-            process_tool_output_errors=process_tool_output_errors,
-        )
-        # pylint: disable=g-bad-todo
-        # pylint: enable=g-bad-todo
-        responses: str = translator.translate(
-            responses, ddl_schema=ddl_schema, db=db, catalog=project
+        responses = nl2sql_flight.do(
+            (
+                single_flight.normalize_question(question),
+                single_flight.schema_version(ddl_schema),
+                generate_sql_type,
+                model,
+                temperature,
+                number_of_candidates,
+                transpile_to_bigquery,
+            ),
+            generate,
         )
 
+    tool_context.state["raw_sql"] = responses
+    tool_context.state["question"] = question
+    progress.publish("sql_generated", sql=responses)
     return responses
@@ -0,0 +1,284 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Few-shot examples of the DC and QP prompts, picked per question.
+
+The DC and QP templates carry eight fixed examples on unrelated databases
+(restaurants, airlines, ...) in every prompt. With this store, the prompts
+keep the first of them, which shows the step-by-step answer format, and get
+the verified billing (question, SQL) pairs most similar to the question
+instead:
+
+    store = example_store.default_store()
+    examples = store.select(question)
+    prompt = example_store.build_prompt(DC_PROMPT_TEMPLATE, examples, ...)
+
+Examples are embedded like the reference guide (see `reference_index`) and
+kept in memory; `select` takes the nearest `FEW_SHOT_K` examples (default 4)
+that fit into `FEW_SHOT_TOKEN_BUDGET` tokens (default 2000, estimated as four
+characters per token). Only the content words of the questions are embedded,
+since words like "what", "cost" or month names appear in nearly every billing
+question, and examples less similar than `FEW_SHOT_MIN_SIMILARITY` (default
+0.15) are not used. If no example is similar enough, the prompts keep their
+fixed examples. The seed examples in `billing_examples.jsonl` use the
+placeholder `{BILLING_TABLE}` for the prototype billing table.
+
+The store grows with `add`; added examples are appended to the JSONL file
+`FEW_SHOT_STORE` if it is set, and loaded from it on start. Set `FEW_SHOT_K`
+to 0 to use the fixed examples.
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from billing_agent.utils import reference_index
+
+logger = logging.getLogger(__name__)
+
+SEED_EXAMPLES = Path(__file__).parent / "billing_examples.jsonl"
+FEW_SHOT_STORE = os.getenv("FEW_SHOT_STORE", "")
+FEW_SHOT_K = int(os.getenv("FEW_SHOT_K", 4))
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", 2000))
+FEW_SHOT_MIN_SIMILARITY = float(os.getenv("FEW_SHOT_MIN_SIMILARITY", 0.15))
+# Fixed examples of the templates kept in front of the selected ones.
+FIXED_EXAMPLES_KEPT = 1
+# Candidates more similar than this to an already selected example are
+# skipped, so the budget is not spent on near duplicates.
+DUPLICATE_SIMILARITY = 0.95
+
+TABLE_PLACEHOLDER = "{BILLING_TABLE}"
+_EXAMPLE_MARKER = re.compile(r"^===========\nExample \d+", re.MULTILINE)
+_QUESTION_MARKER = "Now is the real question"
+_WORD = re.compile(r"[a-z0-9_.]+")
+# Words that do not tell billing questions apart.
+_STOP_WORDS = frozenset(
+    "a an and are as at be between by cost did do does each for from give has"
+    " have how i in is it list many me much of on or our per show tell than"
+    " that the their there these this to us was we were what when where which"
+    " who whose why will with january february march april may june july"
+    " august september october november december".split()
+)
+
+
+@dataclasses.dataclass
+class Example:
+    """A verified question and the SQL that answers it.
+
+    Attributes:
+        question: The question.
+        sql: The SQL, with `TABLE_PLACEHOLDER` for the billing table or with
+          the table names it was run on.
+        metadata: Where the example comes from and how it ran, e.g. the
+          bytes processed.
+    """
+
+    question: str
+    sql: str
+    metadata: dict[str, Any] = dataclasses.field(default_factory=dict)
+
+    def render(self, number: int, billing_table: str = "") -> str:
+        """Returns the example in the format of the DC and QP templates."""
+        sql = self.sql
+        if billing_table:
+            sql = sql.replace(TABLE_PLACEHOLDER, billing_table)
+        return (
+            f"===========\nExample {number}\n\n"
+            "**************************\n"
+            f"【Question】\nQuestion:\n{self.question}\n\n"
+            "**************************\n"
+            "【Answer】\n"
+            f"**Final Optimized SQL Query:**\n```sql\n{sql.strip()}\n```\n\n"
+        )
+
+
+def content_words(question: str) -> str:
+    """Returns the words of a question that tell it apart from others.
+
+    Stop words and numbers are dropped, and plurals are made singular.
+    """
+    words = []
+    for word in _WORD.findall(question.lower()):
+        if word in _STOP_WORDS or not re.search(r"[a-z]", word):
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+def estimate_tokens(text: str) -> int:
+    """Returns a rough token count of a text."""
+    return len(text) // 4 + 1
+
+
+class ExampleStore:
+    """Examples with an in-memory embedding index."""
+
+    def __init__(self, examples: Optional[list[Example]] = None, path: str = ""):
+        """Creates a store.
+
+        Args:
+            examples (list[Example]): The initial examples.
+            path (str): A JSONL file that added examples are appended to.
+        """
+        self.path = path
+        self.embedder = reference_index.HashingEmbedder()
+        self._lock = threading.Lock()
+        self.examples: list[Example] = []
+        self._embeddings = np.zeros((0, self.embedder.dimension), dtype=np.float32)
+        self._extend(examples or [])
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def _extend(self, examples: list[Example]) -> None:
+        if not examples:
+            return
+        embeddings = self.embedder.embed(
+            [content_words(e.question) for e in examples]
+        )
+        with self._lock:
+            self.examples = self.examples + examples
+            self._embeddings = np.concatenate([self._embeddings, embeddings])
+
+    def add(self, example: Example) -> None:
+        """Adds an example and appends it to the file of the store."""
+        self._extend([example])
+        if self.path:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dataclasses.asdict(example)) + "\n")
+
+    def select(
+        self,
+        question: str,
+        k: int = FEW_SHOT_K,
+        token_budget: int = FEW_SHOT_TOKEN_BUDGET,
+        min_similarity: float = FEW_SHOT_MIN_SIMILARITY,
+    ) -> list[Example]:
+        """Returns the examples most similar to a question.
+
+        Args:
+            question (str): The question.
+            k (int): The number of examples to return at most.
+            token_budget (int): The tokens the rendered examples may use.
+            min_similarity (float): The cosine similarity an example needs to
+              be returned.
+
+        Returns:
+            list[Example]: The examples, most similar last, so the closest one
+            is next to the question in the prompt. Empty if none is similar
+            enough.
+        """
+        with self._lock:
+            examples, embeddings = self.examples, self._embeddings
+        if k <= 0 or not examples:
+            return []
+        similarities = embeddings @ self.embedder.embed([content_words(question)])[0]
+        selected: list[int] = []
+        tokens = 0
+        for i in np.argsort(-similarities, kind="stable"):
+            if len(selected) == k or similarities[i] < min_similarity:
+                break
+            if selected and np.max(
+                embeddings[selected] @ embeddings[i]
+            ) > DUPLICATE_SIMILARITY:
+                continue
+            cost = estimate_tokens(examples[i].render(0))
+            if tokens + cost > token_budget:
+                continue
+            selected.append(int(i))
+            tokens += cost
+        return [examples[i] for i in reversed(selected)]
+
+
+def load_examples(path: str) -> list[Example]:
+    """Returns the examples in a JSONL file."""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                examples.append(
+                    Example(record["question"], record["sql"], record.get("metadata", {}))
+                )
+    return examples
+
+
+_default_store: Optional[ExampleStore] = None
+_default_lock = threading.Lock()
+
+
+def default_store() -> ExampleStore:
+    """Returns the store of the seed and the stored examples, loaded once."""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            examples = load_examples(str(SEED_EXAMPLES))
+            if FEW_SHOT_STORE and os.path.exists(FEW_SHOT_STORE):
+                examples += load_examples(FEW_SHOT_STORE)
+            _default_store = ExampleStore(examples, path=FEW_SHOT_STORE)
+        return _default_store
+
+
+def split_template(template: str) -> tuple[str, list[str], str]:
+    """Splits a DC or QP template into its instructions, examples and question.
+
+    Returns:
+        tuple: The text before the first example, the examples and the text
+        from the real question on.
+    """
+    end = template.index(_QUESTION_MARKER)
+    starts = [m.start() for m in _EXAMPLE_MARKER.finditer(template, 0, end)]
+    examples = [template[a:b] for a, b in zip(starts, starts[1:] + [end])]
+    return template[: starts[0]], examples, template[end:]
+
+
+def build_prompt(
+    template: str,
+    examples: list[Example],
+    billing_table: str = "",
+    **kwargs: Any,
+) -> str:
+    """Formats a DC or QP template with selected examples.
+
+    Args:
+        template (str): `DC_PROMPT_TEMPLATE` or `QP_PROMPT_TEMPLATE`.
+        examples (list[Example]): The selected examples; without any, the
+          template is used with its fixed examples.
+        billing_table (str): The table that replaces `TABLE_PLACEHOLDER`.
+        **kwargs: The fields of the template, e.g. SCHEMA and QUESTION.
+
+    Returns:
+        str: The prompt.
+    """
+    if not examples:
+        return template.format(**kwargs)
+    head, fixed, tail = split_template(template)
+    kept = "".join(fixed[:FIXED_EXAMPLES_KEPT])
+    rendered = "".join(
+        example.render(FIXED_EXAMPLES_KEPT + number, billing_table)
+        for number, example in enumerate(examples, start=1)
+    )
+    # The rendered examples are inserted after formatting, so braces in their
+    # SQL are kept as they are.
+    return (head + kept + "{EXAMPLES}" + tail).format(EXAMPLES=rendered, **kwargs)
@@ -15,6 +15,7 @@
 """This code contains the LLM utils for the CHASE-SQL Agent."""
 
 import functools
+import logging
 import os
 import random
 import time
@@ -22,8 +23,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable, List, Optional
 
 import dotenv
-import vertexai
-from google.cloud import aiplatform
+from billing_agent.utils import client_registry, tracing
 from vertexai.generative_models import (GenerationConfig, HarmBlockThreshold,
                                         HarmCategory)
 from vertexai.preview import caching
@@ -31,6 +31,8 @@ from vertexai.preview.generative_models import GenerativeModel
 
 dotenv.load_dotenv(override=True)
 
+logger = logging.getLogger(__name__)
+
 SAFETY_FILTER_CONFIG = {
     HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_NONE,
     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
@@ -73,13 +75,6 @@ GEMINI_URL = (
     "projects/{GCP_PROJECT}/locations/{region}/publishers/google/models/{model_name}"
 )
 
-aiplatform.init(
-    project=GCP_PROJECT,
-    location=GCP_LOCATION,
-)
-vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
-
-
 def retry(max_attempts=8, base_delay=1, backoff_factor=2):
     """Decorator to add retry logic to a function.
 
@@ -101,7 +96,9 @@ def retry(max_attempts=8, base_delay=1, backoff_factor=2):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Attempt {attempts + 1} failed with error: {e}")
+                    logger.warning(
+                        "Attempt %d failed with error: %s", attempts + 1, e)
+                    tracing.record_retry(attempts + 1, e)
                     attempts += 1
                     if attempts >= max_attempts:
                         raise e
@@ -126,14 +123,18 @@ class GeminiModel:
         temperature: float = 0.01,
         **kwargs,
     ):
+        # The Vertex AI SDK is initialized by the first model, not at import.
+        client_registry.init_vertexai(project=GCP_PROJECT, location=GCP_LOCATION)
         self.model_name = model_name
         self.finetuned_model = finetuned_model
         self.arguments = kwargs
         self.distribute_requests = distribute_requests
         self.temperature = temperature
+        self.region = GCP_LOCATION
         model_name = self.model_name
         if not self.finetuned_model and self.distribute_requests:
             random_region = random.choice(GEMINI_AVAILABLE_REGIONS)
+            self.region = random_region
             model_name = GEMINI_URL.format(
                 GCP_PROJECT=GCP_PROJECT,
                 region=random_region,
@@ -160,14 +161,18 @@ class GeminiModel:
         Returns:
             str: The processed response from the model.
         """
-        response = self.model.generate_content(
-            prompt,
-            generation_config=GenerationConfig(
-                temperature=self.temperature,
-                **self.arguments,
-            ),
-            safety_settings=SAFETY_FILTER_CONFIG,
-        ).text
+        with tracing.trace_llm_call(self.model_name, region=self.region) as span:
+            response = self.model.generate_content(
+                prompt,
+                generation_config=GenerationConfig(
+                    temperature=self.temperature,
+                    **self.arguments,
+                ),
+                safety_settings=SAFETY_FILTER_CONFIG,
+            )
+            tracing.record_llm_usage(
+                span, getattr(response, "usage_metadata", None))
+        response = response.text
         if parser_func:
             return parser_func(response)
         return response
@@ -200,10 +205,11 @@ class GeminiModel:
                 try:
                     return self.call(prompt, parser_func)
                 except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Error for prompt {index}: {str(e)}")
+                    logger.warning("Error for prompt %d: %s", index, e)
                     retries += 1
                     if retries <= max_retries:
-                        print(f"Retrying ({retries}/{max_retries}) for prompt {index}")
+                        logger.info("Retrying (%d/%d) for prompt %d",
+                                    retries, max_retries, index)
                         time.sleep(1)  # Small delay before retrying
                     else:
                         return f"Error after retries: {str(e)}"
@@ -211,7 +217,7 @@ class GeminiModel:
         # Create and start one thread for each prompt
         with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
             future_to_index = {
-                executor.submit(worker, i, prompt): i
+                executor.submit(tracing.run_in_current_context(worker), i, prompt): i
                 for i, prompt in enumerate(prompts)
             }
 
@@ -220,14 +226,14 @@ class GeminiModel:
                 try:
                     results[index] = future.result()
                 except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Unhandled error for prompt {index}: {e}")
+                    logger.error("Unhandled error for prompt %d: %s", index, e)
                     results[index] = "Unhandled Error"
 
         # Handle remaining unfinished tasks after the timeout
         for future in future_to_index:
             index = future_to_index[future]
             if not future.done():
-                print(f"Timeout occurred for prompt {index}")
+                logger.warning("Timeout occurred for prompt %d", index)
                 results[index] = "Timeout"
 
         return results
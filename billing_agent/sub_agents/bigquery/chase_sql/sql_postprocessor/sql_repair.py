@@ -0,0 +1,419 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rule-based repair of common SQL errors.
+
+The repair engine runs before the LLM correction prompt in `SqlTranslator`. It
+covers the failures that show up most often in generated BigQuery SQL and that
+can be fixed deterministically:
+
+1. Lexical rules, applied to every query before the SQLGlot error check:
+   - Unquoted or partially quoted table references (e.g. hyphenated project
+     IDs) are enclosed in backticks.
+   - SQLite date and time functions are rewritten to their GoogleSQL
+     equivalents.
+2. Error-driven rules, applied only when SQLGlot reports an error:
+   - Unqualified columns that only one table of the query has are qualified
+     with that table. Columns that several tables have are left to the LLM,
+     since picking one of them could change the result.
+   - Unknown columns are replaced by the closest column name in the schema
+     (by edit distance).
+
+Only errors that remain after these rules are sent to the LLM. Every rule
+application and every outcome is counted in `REPAIR_STATS` so that the rules
+can be tuned against real traffic.
+"""
+
+import collections
+import re
+from typing import Any, Callable
+
+import sqlglot
+
+ErrorCheckType = Callable[[str], tuple[str | None, str]]
+ReplacementType = Callable[[re.Match[str]], str]
+
+# Counts of rule applications and repair outcomes, keyed by
+# `<rule_name>.applied`, `resolved` and `unresolved`.
+REPAIR_STATS: collections.Counter = collections.Counter()
+
+_UNRESOLVED_COLUMN_PATTERN = re.compile(
+    r"Column '(?P<column_name>[^']+)' could not be resolved"
+    r"|Unknown column: (?P<qualified_column_name>\w+)"
+)
+
+# FROM or JOIN followed by a dotted table reference that is not fully enclosed
+# in backticks, e.g. `my-project.dataset.table`, `my-project`.dataset.table.
+# FROM also appears in function arguments, e.g. EXTRACT(MONTH FROM t.col);
+# `_is_table_position` tells the two apart.
+_TABLE_REFERENCE_PATTERN = re.compile(
+    r"(?P<keyword>\b(?:FROM|JOIN)\s+)"
+    r"(?P<table>`?[A-Za-z][\w\-]*`?(?:\.`?[\w\-]+`?){1,2})"
+    r"(?![\w`\-])",
+    flags=re.IGNORECASE,
+)
+
+# String literals and comments, whose text must not be rewritten, e.g.
+# WHERE note = 'moved from x.y to z'.
+_LITERAL_PATTERN = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|--[^\n]*|#[^\n]*|/\*.*?\*/",
+    flags=re.DOTALL,
+)
+
+# The first argument of a subquery or a table expression, as opposed to the
+# arguments of a function such as EXTRACT, TRIM or SUBSTRING.
+_SUBQUERY_START_PATTERN = re.compile(r"\s*(?:SELECT|WITH)\b", flags=re.IGNORECASE)
+
+# Expressions of type DATE or DATETIME, by the function that produces them.
+# Anything else passed to strftime is taken to be a TIMESTAMP.
+_DATE_EXPRESSION_PATTERN = re.compile(
+    r"^(?:(?:CURRENT_DATE|DATE|DATE_ADD|DATE_SUB|DATE_TRUNC|PARSE_DATE|LAST_DAY)"
+    r"\s*\(|DATE\s*'|'\d{4}-\d{2}-\d{2}'$)",
+    flags=re.IGNORECASE,
+)
+_DATETIME_EXPRESSION_PATTERN = re.compile(
+    r"^(?:CURRENT_DATETIME|DATETIME|DATETIME_ADD|DATETIME_SUB|DATETIME_TRUNC"
+    r"|PARSE_DATETIME)\s*\(|^DATETIME\s*'",
+    flags=re.IGNORECASE,
+)
+
+
+def _date_interval(match: re.Match[str]) -> str:
+    function = "DATE_SUB" if match.group("sign") == "-" else "DATE_ADD"
+    count, unit = match.group("count"), match.group("unit").upper()
+    return f"{function}(CURRENT_DATE(), INTERVAL {count} {unit})"
+
+
+def _format_time(match: re.Match[str]) -> str:
+    value, time_format = match.group("value"), match.group("format")
+    if value.lower() == "'now'":
+        return f"FORMAT_TIMESTAMP('{time_format}', CURRENT_TIMESTAMP())"
+    if _DATE_EXPRESSION_PATTERN.match(value):
+        function = "FORMAT_DATE"
+    elif _DATETIME_EXPRESSION_PATTERN.match(value):
+        function = "FORMAT_DATETIME"
+    else:
+        function = "FORMAT_TIMESTAMP"
+    return f"{function}('{time_format}', {value})"
+
+
+# SQLite date and time functions and their GoogleSQL replacements.
+_SQLITE_DATE_FUNCTIONS: list[tuple[re.Pattern[str], ReplacementType]] = [
+    (
+        re.compile(
+            r"\bdate\(\s*'now'\s*,\s*'(?P<sign>[+-])?\s*(?P<count>\d+)\s+"
+            r"(?P<unit>day|month|year)s?'\s*\)",
+            flags=re.IGNORECASE,
+        ),
+        _date_interval,
+    ),
+    (
+        re.compile(r"\bdate\(\s*'now'\s*\)", flags=re.IGNORECASE),
+        lambda _: "CURRENT_DATE()",
+    ),
+    (
+        re.compile(r"\bdatetime\(\s*'now'\s*\)", flags=re.IGNORECASE),
+        lambda _: "CURRENT_DATETIME()",
+    ),
+    (
+        re.compile(
+            r"\bstrftime\(\s*'(?P<format>[^']*)'\s*,\s*"
+            r"(?P<value>(?:[^()]|\((?:[^()]|\([^()]*\))*\))+?)\s*\)",
+            flags=re.IGNORECASE,
+        ),
+        _format_time,
+    ),
+    (
+        re.compile(
+            r"\bjulianday\(\s*(?P<end>[^()]+?)\s*\)\s*-\s*"
+            r"julianday\(\s*(?P<start>[^()]+?)\s*\)",
+            flags=re.IGNORECASE,
+        ),
+        lambda m: f"DATE_DIFF(DATE({m.group('end')}), DATE({m.group('start')}), DAY)",
+    ),
+]
+
+
+def get_repair_stats() -> dict[str, int]:
+    """Returns a snapshot of the repair counters."""
+    return dict(REPAIR_STATS)
+
+
+def _edit_distance(a: str, b: str) -> int:
+    """Returns the edit distance between two strings.
+
+    Insertions, deletions, substitutions and transpositions of adjacent
+    characters each cost one edit.
+    """
+    distances = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) + 1):
+        distances[i][0] = i
+    for j in range(len(b) + 1):
+        distances[0][j] = j
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = int(a[i - 1] != b[j - 1])
+            distances[i][j] = min(
+                distances[i - 1][j] + 1,
+                distances[i][j - 1] + 1,
+                distances[i - 1][j - 1] + cost,
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distances[i][j] = min(distances[i][j], distances[i - 2][j - 2] + 1)
+    return distances[-1][-1]
+
+
+def _flatten_schema(schema_dict: dict[str, Any] | None) -> dict[str, set[str]]:
+    """Returns a mapping of table name to lower-cased column names.
+
+    The SQLGlot schema can be nested under a catalog and a database; only the
+    innermost `{table: {column: type}}` level is kept.
+    """
+    tables: dict[str, set[str]] = {}
+
+    def _walk(node: dict[str, Any]) -> None:
+        for name, value in node.items():
+            if not isinstance(value, dict):
+                continue
+            if value and all(isinstance(v, str) for v in value.values()):
+                tables[name.lower()] = {c.lower() for c in value}
+            else:
+                _walk(value)
+
+    if schema_dict:
+        _walk(schema_dict)
+    return tables
+
+
+def _is_table_position(sql_query: str, position: int) -> bool:
+    """Returns whether a FROM at `position` is followed by a table.
+
+    A FROM inside parentheses is a table position only if the parentheses
+    hold a subquery; otherwise it belongs to a function such as
+    EXTRACT(MONTH FROM t.col).
+    """
+    openings: list[int] = []
+    quote = None
+    for i, char in enumerate(sql_query[:position]):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char == "(":
+            openings.append(i)
+        elif char == ")" and openings:
+            openings.pop()
+    if not openings:
+        return True
+    return bool(_SUBQUERY_START_PATTERN.match(sql_query, openings[-1] + 1))
+
+
+def _literal_spans(sql_query: str) -> list[tuple[int, int]]:
+    """Returns the start and end of every string literal and comment."""
+    return [m.span() for m in _LITERAL_PATTERN.finditer(sql_query)]
+
+
+def _quote_table_references(sql_query: str) -> str:
+    """Encloses dotted table references in backticks."""
+    literals = _literal_spans(sql_query)
+
+    def _quote(match: re.Match[str]) -> str:
+        if any(start <= match.start() < end for start, end in literals):
+            return match.group(0)
+        table = match.group("table")
+        keyword = match.group("keyword").strip().upper()
+        if keyword == "FROM" and not _is_table_position(sql_query, match.start()):
+            return match.group(0)
+        if table.startswith("`") and table.endswith("`") and table.count("`") == 2:
+            return match.group(0)
+        return f"{match.group('keyword')}`{table.replace('`', '')}`"
+
+    return _TABLE_REFERENCE_PATTERN.sub(_quote, sql_query)
+
+
+def _rewrite_sqlite_date_functions(sql_query: str) -> str:
+    """Rewrites SQLite date and time functions to GoogleSQL."""
+    for pattern, replacement in _SQLITE_DATE_FUNCTIONS:
+        sql_query = pattern.sub(replacement, sql_query)
+    return sql_query
+
+
+def _query_tables(sql_query_ast: sqlglot.exp.Expression) -> list[tuple[str, str]]:
+    """Returns (table name, alias or name) for every table in the query."""
+    return [
+        (table.name.lower(), table.alias_or_name)
+        for table in sql_query_ast.find_all(sqlglot.exp.Table)
+    ]
+
+
+def _unqualified_columns(
+    sql_query_ast: sqlglot.exp.Expression, column_name: str
+) -> list[sqlglot.exp.Column]:
+    return [
+        column
+        for column in sql_query_ast.find_all(sqlglot.exp.Column)
+        if not column.table and column.name.lower() == column_name.lower()
+    ]
+
+
+def _qualify_ambiguous_column(
+    sql_query_ast: sqlglot.exp.Expression,
+    column_name: str,
+    schema: dict[str, set[str]],
+) -> bool:
+    """Qualifies a column with the only table of the query that has it.
+
+    If several tables have the column, it is ambiguous and left unchanged, so
+    the error goes to the LLM rather than a table being guessed.
+    """
+    owners = {
+        alias
+        for table, alias in _query_tables(sql_query_ast)
+        if column_name.lower() in schema.get(table, set())
+    }
+    if len(owners) != 1 or len(_query_tables(sql_query_ast)) < 2:
+        return False
+    (owner,) = owners
+    columns = _unqualified_columns(sql_query_ast, column_name)
+    for column in columns:
+        column.set("table", sqlglot.exp.to_identifier(owner))
+    return bool(columns)
+
+
+def _replace_unknown_column(
+    sql_query_ast: sqlglot.exp.Expression,
+    column_name: str,
+    schema: dict[str, set[str]],
+) -> bool:
+    """Replaces an unknown column with the closest schema column."""
+    candidates = set()
+    for table, _ in _query_tables(sql_query_ast):
+        candidates |= schema.get(table, set())
+    if not candidates:
+        candidates = set().union(*schema.values()) if schema else set()
+    if column_name.lower() in candidates:
+        return False
+    # Allow roughly one edit for every three characters, e.g. typos and
+    # singular/plural mix-ups, but not unrelated names.
+    max_distance = max(1, len(column_name) // 3)
+    scored = sorted(
+        (_edit_distance(column_name.lower(), c), c) for c in candidates
+    )
+    if not scored or scored[0][0] > max_distance:
+        return False
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        # Ties are left to the LLM rather than guessed.
+        return False
+    replacement = scored[0][1]
+    columns = [
+        column
+        for column in sql_query_ast.find_all(sqlglot.exp.Column)
+        if column.name.lower() == column_name.lower()
+    ]
+    for column in columns:
+        column.set("this", sqlglot.exp.to_identifier(replacement))
+    return bool(columns)
+
+
+def _repair_unresolved_column(
+    sql_query: str, errors: str, schema: dict[str, set[str]], sql_dialect: str
+) -> str:
+    """Fixes the column named in an unresolved or unknown column error."""
+    match = _UNRESOLVED_COLUMN_PATTERN.search(errors)
+    if not match or not schema:
+        return sql_query
+    try:
+        sql_query_ast = sqlglot.parse_one(
+            sql=sql_query,
+            read=sql_dialect,
+            error_level=sqlglot.ErrorLevel.IMMEDIATE,
+        )
+    except sqlglot.errors.SqlglotError:
+        return sql_query
+    column_name = match.group("column_name") or match.group(
+        "qualified_column_name"
+    )
+    if _qualify_ambiguous_column(sql_query_ast, column_name, schema):
+        REPAIR_STATS["qualify_ambiguous_column.applied"] += 1
+    elif _replace_unknown_column(sql_query_ast, column_name, schema):
+        REPAIR_STATS["closest_column_match.applied"] += 1
+    else:
+        return sql_query
+    return sql_query_ast.sql(sql_dialect)
+
+
+LEXICAL_RULES: list[tuple[str, Callable[[str], str]]] = [
+    ("quote_table_references", _quote_table_references),
+    ("sqlite_date_functions", _rewrite_sqlite_date_functions),
+]
+
+
+def apply_lexical_rules(sql_query: str) -> str:
+    """Applies the lexical repair rules to the SQL query.
+
+    Args:
+      sql_query: The SQL query to repair.
+
+    Returns:
+      The SQL query after all lexical rules have been applied.
+    """
+    for rule_name, rule in LEXICAL_RULES:
+        repaired = rule(sql_query)
+        if repaired != sql_query:
+            REPAIR_STATS[f"{rule_name}.applied"] += 1
+            sql_query = repaired
+    return sql_query
+
+
+def repair_errors(
+    sql_query: str,
+    errors: str,
+    check_for_errors: ErrorCheckType,
+    schema_dict: dict[str, Any] | None,
+    sql_dialect: str,
+    max_passes: int = 3,
+) -> tuple[str | None, str]:
+    """Tries to resolve SQLGlot errors without calling the LLM.
+
+    SQLGlot reports one error at a time, so the error-driven rules are applied
+    repeatedly until the query checks cleanly, no rule makes progress or
+    `max_passes` is reached.
+
+    Args:
+      sql_query: The SQL query that failed the error check.
+      errors: The errors reported for `sql_query`.
+      check_for_errors: A callable that takes a SQL query and returns a tuple of
+        the remaining errors (or None) and the SQL query after optimization.
+      schema_dict: The schema in the SQLGlot format. This field is optional.
+      sql_dialect: The SQL dialect of the SQL query.
+      max_passes: The maximum number of repair passes.
+
+    Returns:
+      tuple of the remaining errors, or None if all errors were resolved, and
+      the repaired SQL query.
+    """
+    schema = _flatten_schema(schema_dict)
+    for _ in range(max_passes):
+        repaired = _repair_unresolved_column(
+            sql_query, errors, schema, sql_dialect.lower()
+        )
+        if repaired == sql_query:
+            break
+        errors, sql_query = check_for_errors(repaired)
+        if not errors:
+            REPAIR_STATS["resolved"] += 1
+            return None, sql_query
+    REPAIR_STATS["unresolved"] += 1
+    return errors, sql_query
@@ -14,18 +14,22 @@
 
 """Translator from SQLite to BigQuery."""
 
+import logging
 import re
 from typing import Any, Final
 
 import regex
 import sqlglot
 import sqlglot.optimizer
+from billing_agent.utils import tracing
 
 from ..llm_utils import GeminiModel  # pylint: disable=g-importing-member
 from .correction_prompt_template import (
     CORRECTION_PROMPT_TEMPLATE_V1_0,
 )  # pylint: disable=g-importing-member
+from . import sql_repair
 
+logger = logging.getLogger(__name__)
 
 ColumnSchemaType = tuple[str, str]
 AllColumnsSchemaType = list[ColumnSchemaType]
@@ -102,6 +106,9 @@ class SqlTranslator:
     3. (Optional) If there are errors in the tool output SQL query, the tool
        output SQL query is modified by the LLM to address the errors.
 
+    Before any errors are sent to the LLM, the rule-based repairs in
+    `sql_repair` are tried first, and only unresolved errors reach the LLM.
+
     Class Attributes:
       INPUT_DIALECT: The input SQL dialect.
       OUTPUT_DIALECT: The output SQL dialect.
@@ -374,6 +381,7 @@ class SqlTranslator:
         """
         if apply_heuristics:
             sql_query = self._apply_heuristics(sql_query)
+            sql_query = sql_repair.apply_lexical_rules(sql_query)
         # Reformat the schema if provided. This will remove any comments and
         # `INSERT INTO` statements.
         schema_dict = self.rewrite_schema_for_sqlglot(ddl_schema)
@@ -385,9 +393,24 @@ class SqlTranslator:
             schema_dict=schema_dict,
         )
         errors, sql_query = errors_and_sql
+        if errors:
+            # Try the deterministic repairs before falling back to the LLM.
+            errors, sql_query = sql_repair.repair_errors(
+                sql_query=sql_query,
+                errors=errors,
+                check_for_errors=lambda sql: self._check_for_errors(
+                    sql_query=sql,
+                    sql_dialect=self.OUTPUT_DIALECT,
+                    db=db,
+                    catalog=catalog,
+                    schema_dict=schema_dict,
+                ),
+                schema_dict=schema_dict,
+                sql_dialect=self.OUTPUT_DIALECT,
+            )
         responses = sql_query  # Default to the input SQL query after error check.
         if errors:
-            print("Processing input errors")
+            logger.debug("Processing input errors")
             if schema_dict:
                 # If the schema is provided, then insert it into the prompt.
                 schema_insert = f"\nThe database schema is:\n{schema_dict}\n"
@@ -435,7 +458,18 @@ class SqlTranslator:
         Returns:
           The translated SQL query.
         """
-        print("****** sql_query at translator entry:", sql_query)
+        with tracing.tracer.start_as_current_span("sql_translator.translate"):
+            return self._translate(sql_query, db, catalog, ddl_schema)
+
+    def _translate(
+        self,
+        sql_query: str,
+        db: str | None,
+        catalog: str | None,
+        ddl_schema: str | SQLGlotSchemaType | BirdSampleType | None,
+    ) -> str:
+        """Translates the SQL query; see `translate`."""
+        logger.debug("sql_query at translator entry: %s", sql_query)
         if self._process_input_errors:
             sql_query = self._fix_errors(
                 sql_query,
@@ -445,7 +479,7 @@ class SqlTranslator:
                 ddl_schema=ddl_schema,
                 apply_heuristics=True,
             )
-        print("****** sql_query after fix_errors:", sql_query)
+        logger.debug("sql_query after fix_errors: %s", sql_query)
         sql_query = sqlglot.transpile(
             sql=sql_query,
             read=self.INPUT_DIALECT,
@@ -454,7 +488,7 @@ class SqlTranslator:
         )[
             0
         ]  # Transpile returns a list of strings.
-        print("****** sql_query after transpile:", sql_query)
+        logger.debug("sql_query after transpile: %s", sql_query)
         if self._tool_output_errors:
             sql_query = self._fix_errors(
                 sql_query,
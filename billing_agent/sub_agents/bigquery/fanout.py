@@ -0,0 +1,631 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs an aggregate over several billing tables as one job per table.
+
+`expand_to_actual_billing_tables` combines the customer tables with UNION ALL
+and aggregates the result in one query, so the slowest or largest table holds
+up the whole answer and one failing table fails it. `plan_query` splits such
+a query:
+
+    WITH billing AS (SELECT ... FROM t1 WHERE ... UNION ALL SELECT ... FROM t2)
+    SELECT service.description, ROUND(SUM(cost), 2) AS cost FROM billing
+    GROUP BY 1 ORDER BY cost DESC LIMIT 10
+
+into one query per table that computes the partial aggregates of its groups:
+
+    SELECT service.description AS _k0, SUM(cost) AS _a0
+    FROM (SELECT ... FROM t1 WHERE ...) AS billing GROUP BY 1
+
+`run_plan` runs them concurrently with a per-table timeout and merges the
+partial aggregates locally (SUM, COUNT and COUNTIF add up, MIN and MAX take
+the extreme, AVG is merged from a sum and a count), then applies the select
+list, HAVING, ORDER BY and LIMIT of the original query. Tables that fail or
+time out are left out and reported, so the other tables still answer.
+
+Queries that cannot be merged this way, e.g. with COUNT(DISTINCT ...), window
+functions or a single table, are not planned.
+"""
+
+import concurrent.futures
+import dataclasses
+import decimal
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from billing_agent.utils import tracing
+
+logger = logging.getLogger(__name__)
+
+_MERGEABLE = (exp.Sum, exp.Count, exp.CountIf, exp.Min, exp.Max, exp.Avg)
+
+# Expressions that `_evaluate` can compute on merged rows.
+_SCALARS = (
+    exp.Column, exp.Literal, exp.Null, exp.Boolean, exp.Paren, exp.Neg,
+    exp.Add, exp.Sub, exp.Mul, exp.Div, exp.SafeDivide, exp.Round, exp.Abs,
+    exp.Coalesce, exp.If, exp.Case, exp.Cast, exp.DataType, exp.Identifier,
+    exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.And, exp.Or,
+    exp.Not, exp.Is,
+)
+
+_COMPARISONS = {
+    exp.EQ: lambda a, b: a == b,
+    exp.NEQ: lambda a, b: a != b,
+    exp.GT: lambda a, b: a > b,
+    exp.GTE: lambda a, b: a >= b,
+    exp.LT: lambda a, b: a < b,
+    exp.LTE: lambda a, b: a <= b,
+}
+_ARITHMETIC = {
+    exp.Add: lambda a, b: a + b,
+    exp.Sub: lambda a, b: a - b,
+    exp.Mul: lambda a, b: a * b,
+}
+
+_executor_lock = threading.Lock()
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+class _NotMergeable(Exception):
+    """The query cannot be computed from per-table partial aggregates."""
+
+
+class _TableTimeout(Exception):
+    """The job of a table did not finish within the timeout."""
+
+
+@dataclasses.dataclass
+class MergedAggregate:
+    """An aggregate of the query, merged from partial columns of the tables.
+
+    Attributes:
+        name: The column of the merged value, e.g. "_a0".
+        kind: How the partial values are merged: "sum", "count", "min",
+          "max" or "avg" (from a sum and a count column).
+        width: The number of partial columns.
+    """
+
+    name: str
+    kind: str
+    width: int = 1
+
+
+@dataclasses.dataclass
+class FanoutPlan:
+    """A query split into one partial aggregate query per table.
+
+    Attributes:
+        sql: The original query.
+        table_queries: The partial aggregate query of every table, by table.
+          Each returns the group keys, then the partial aggregate columns.
+        num_keys: The number of group keys.
+        aggregates: The merged aggregates, in the order of their columns.
+        projections: The result columns, as (name, expression over the keys
+          `_k<i>` and merged aggregates `_a<i>`).
+        having: The HAVING condition over the keys and merged aggregates.
+        order: The sort keys, as (projection index or expression, descending,
+          nulls first).
+        limit: The maximum number of result rows.
+        offset: The number of result rows to skip.
+    """
+
+    sql: str
+    table_queries: dict[str, str]
+    num_keys: int
+    aggregates: list[MergedAggregate]
+    projections: list[tuple[str, exp.Expression]]
+    having: Optional[exp.Expression] = None
+    order: list[tuple[Any, bool, bool]] = dataclasses.field(default_factory=list)
+    limit: Optional[int] = None
+    offset: int = 0
+
+
+@dataclasses.dataclass
+class FanoutResult:
+    """The merged result of a fanned out query.
+
+    Attributes:
+        rows: The result rows, as dicts.
+        missing_tables: The tables that failed or timed out, with the reason.
+        table_seconds: The run time of every table that answered.
+    """
+
+    rows: list[dict[str, Any]]
+    missing_tables: dict[str, str]
+    table_seconds: dict[str, float]
+
+
+def _from(select: exp.Select) -> Optional[exp.From]:
+    # The key was renamed from "from" to "from_" in newer SQLGlot versions.
+    return select.args.get("from_") or select.args.get("from")
+
+
+def _table_id(table: exp.Table) -> str:
+    return ".".join(part.name for part in table.parts)
+
+
+def _members(query: exp.Expression) -> list[exp.Select]:
+    """Returns the per-table selects of a UNION ALL of tables."""
+    if isinstance(query, exp.Subquery):
+        return _members(query.this)
+    if isinstance(query, exp.Union):
+        if query.args.get("distinct") or any(
+            query.args.get(key) for key in ("order", "limit", "offset", "with", "with_")
+        ):
+            raise _NotMergeable("not a plain UNION ALL")
+        return _members(query.this) + _members(query.expression)
+    if not isinstance(query, exp.Select):
+        raise _NotMergeable(f"unsupported relation {query.key}")
+    relation = _from(query)
+    if relation is None or not isinstance(relation.this, exp.Table):
+        raise _NotMergeable("member does not read a table")
+    for key in ("joins", "group", "having", "order", "limit", "offset", "with", "with_"):
+        if query.args.get(key):
+            raise _NotMergeable(f"member with {key}")
+    if query.find(exp.AggFunc, exp.Window):
+        raise _NotMergeable("member aggregates")
+    return [query]
+
+
+def _literal_int(node: Optional[exp.Expression]) -> Optional[int]:
+    if node is None:
+        return None
+    value = node.args.get("expression")
+    if not isinstance(value, exp.Literal) or value.is_string:
+        raise _NotMergeable("limit is not a number")
+    return int(value.this)
+
+
+def plan_query(sql: str) -> Optional[FanoutPlan]:
+    """Splits an aggregate over a UNION ALL of tables into per-table queries.
+
+    Args:
+        sql (str): The BigQuery query.
+
+    Returns:
+        FanoutPlan: The plan, or None if the query cannot be split.
+    """
+    try:
+        select = sqlglot.parse_one(sql, read="bigquery")
+        return _plan(sql, select)
+    except (sqlglot.errors.SqlglotError, _NotMergeable) as e:
+        logger.debug("Query cannot be fanned out: %s", e)
+        return None
+
+
+def _plan(sql: str, select: exp.Expression) -> FanoutPlan:
+    if not isinstance(select, exp.Select):
+        raise _NotMergeable("not a select")
+    relation = _from(select).this if _from(select) else None
+    ctes = {cte.alias_or_name.lower(): cte.this for cte in select.ctes}
+    if isinstance(relation, exp.Table) and not relation.args.get("db"):
+        if relation.name.lower() not in ctes:
+            raise _NotMergeable("does not read a CTE")
+        members = _members(ctes.pop(relation.name.lower()))
+    elif isinstance(relation, exp.Subquery):
+        members = _members(relation.this)
+    else:
+        raise _NotMergeable("does not read a UNION ALL")
+    if ctes:
+        # The per-table queries only carry the rows of their table.
+        raise _NotMergeable("reads other CTEs")
+    if len(members) < 2:
+        raise _NotMergeable("reads a single table")
+    for join in select.args.get("joins") or []:
+        # Unnesting arrays of the rows works per table.
+        if not isinstance(join.this, exp.Unnest) or join.args.get("on"):
+            raise _NotMergeable("join")
+    for key in ("laterals", "qualify", "windows", "distinct", "kind", "into"):
+        if select.args.get(key):
+            raise _NotMergeable(f"select with {key}")
+    if any(node.find(exp.Window) for node in select.expressions):
+        raise _NotMergeable("window function")
+    if not select.args.get("group") and not any(
+        node.find(exp.AggFunc) for node in select.expressions
+    ):
+        raise _NotMergeable("rows are not aggregated")
+
+    projections = [
+        node.this if isinstance(node, exp.Alias) else node
+        for node in select.expressions
+    ]
+    aliases = {
+        node.alias.lower(): node.this
+        for node in select.expressions
+        if isinstance(node, exp.Alias)
+    }
+
+    def resolve(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Literal) and not node.is_string:
+            return projections[int(node.this) - 1]
+        if isinstance(node, exp.Column) and not node.table and node.name.lower() in aliases:
+            return aliases[node.name.lower()]
+        return node
+
+    group = select.args.get("group")
+    if group and any(group.args.get(k) for k in ("rollup", "cube", "grouping_sets")):
+        raise _NotMergeable("grouping sets")
+    keys = [resolve(node) for node in (group.expressions if group else [])]
+    if any(key.find(exp.AggFunc) for key in keys):
+        raise _NotMergeable("grouping by an aggregate")
+
+    # Partial aggregates, shared by identical aggregates of the query.
+    partials: list[exp.Expression] = []
+    aggregates: list[MergedAggregate] = []
+    aggregate_columns: dict[str, str] = {}
+
+    def add_aggregate(node: exp.AggFunc) -> str:
+        key = node.sql(dialect="bigquery")
+        if key in aggregate_columns:
+            return aggregate_columns[key]
+        if not isinstance(node, _MERGEABLE) or node.find(exp.Distinct):
+            raise _NotMergeable(f"aggregate {node.key} cannot be merged")
+        name = f"_a{len(aggregates)}"
+        if isinstance(node, exp.Avg):
+            partials.append(exp.alias_(exp.Sum(this=node.this.copy()), f"{name}_sum"))
+            partials.append(
+                exp.alias_(exp.Count(this=node.this.copy()), f"{name}_count"))
+            aggregates.append(MergedAggregate(name, "avg", width=2))
+        else:
+            partials.append(exp.alias_(node.copy(), name))
+            kind = {
+                exp.Min: "min",
+                exp.Max: "max",
+                exp.Count: "count",
+                exp.CountIf: "count",
+            }.get(type(node), "sum")
+            aggregates.append(MergedAggregate(name, kind))
+        aggregate_columns[key] = name
+        return name
+
+    def final(node: exp.Expression) -> exp.Expression:
+        """Rewrites an expression of the query over the merged columns."""
+        for i, key in enumerate(keys):
+            if node == key:
+                return exp.column(f"_k{i}")
+        if isinstance(node, exp.AggFunc):
+            return exp.column(add_aggregate(node))
+        if isinstance(node, exp.Column):
+            raise _NotMergeable(f"{node.sql()} is neither grouped nor aggregated")
+        if not isinstance(node, _SCALARS):
+            raise _NotMergeable(f"{node.key} cannot be computed locally")
+        args = {}
+        for name, value in node.args.items():
+            if isinstance(value, exp.Expression):
+                value = final(value)
+            elif isinstance(value, list):
+                value = [final(v) if isinstance(v, exp.Expression) else v for v in value]
+            args[name] = value
+        return node.__class__(**args)
+
+    named = []
+    unnamed = 0
+    for node, projection in zip(select.expressions, projections):
+        if isinstance(node, exp.Alias):
+            name = node.alias
+        elif isinstance(node, exp.Column):
+            name = node.name
+        else:
+            # BigQuery names the columns without a name f0_, f1_, ...
+            name = f"f{unnamed}_"
+            unnamed += 1
+        named.append((name, final(projection)))
+
+    having = select.args.get("having")
+    having = final(having.this.transform(resolve)) if having else None
+    order = []
+    for ordered in (select.args.get("order") or exp.Order()).expressions:
+        node = ordered.this
+        if isinstance(node, exp.Literal) and not node.is_string:
+            target: Any = int(node.this) - 1
+        elif isinstance(node, exp.Column) and not node.table and node.name.lower() in aliases:
+            target = [n.lower() for n, _ in named].index(node.name.lower())
+        else:
+            target = final(node)
+        order.append((target, bool(ordered.args.get("desc")), bool(ordered.args.get("nulls_first"))))
+
+    # One partial aggregate query per table.
+    relation_alias = relation.alias_or_name
+    table_queries = {}
+    for member in members:
+        query = exp.Select(
+            expressions=[
+                *(exp.alias_(key.copy(), f"_k{i}") for i, key in enumerate(keys)),
+                *(partial.copy() for partial in partials),
+            ]
+        ).from_(exp.Subquery(
+            this=member.copy(),
+            alias=(
+                exp.TableAlias(this=exp.to_identifier(relation_alias))
+                if relation_alias else None
+            ),
+        ))
+        for join in select.args.get("joins") or []:
+            query = query.join(join.copy())
+        if select.args.get("where"):
+            query = query.where(select.args["where"].this.copy())
+        if keys:
+            query = query.group_by(*(str(i + 1) for i in range(len(keys))))
+        table = _table_id(_from(member).this)
+        if table in table_queries:
+            raise _NotMergeable(f"{table} is read twice")
+        table_queries[table] = query.sql(dialect="bigquery")
+
+    return FanoutPlan(
+        sql=sql,
+        table_queries=table_queries,
+        num_keys=len(keys),
+        aggregates=aggregates,
+        projections=named,
+        having=having,
+        order=order,
+        limit=_literal_int(select.args.get("limit")),
+        offset=_literal_int(select.args.get("offset")) or 0,
+    )
+
+
+def _round(value: float, digits: int) -> float:
+    # BigQuery rounds halfway cases away from zero.
+    quantum = decimal.Decimal(1).scaleb(-digits)
+    return float(
+        decimal.Decimal(str(value)).quantize(quantum, rounding=decimal.ROUND_HALF_UP))
+
+
+def _evaluate(node: exp.Expression, row: dict[str, Any]) -> Any:
+    """Evaluates an expression of `_SCALARS` on a merged row."""
+    if isinstance(node, exp.Column):
+        return row[node.name]
+    if isinstance(node, exp.Literal):
+        if node.is_string:
+            return node.this
+        return float(node.this) if "." in node.this or "e" in node.this.lower() else int(node.this)
+    if isinstance(node, exp.Null):
+        return None
+    if isinstance(node, exp.Boolean):
+        return node.this
+    if isinstance(node, exp.Paren):
+        return _evaluate(node.this, row)
+    if isinstance(node, exp.Coalesce):
+        for arg in [node.this, *node.expressions]:
+            value = _evaluate(arg, row)
+            if value is not None:
+                return value
+        return None
+    if isinstance(node, exp.If):
+        false = node.args.get("false")
+        if _evaluate(node.this, row):
+            return _evaluate(node.args["true"], row)
+        return _evaluate(false, row) if false is not None else None
+    if isinstance(node, exp.Case):
+        subject = _evaluate(node.this, row) if node.this else None
+        for case in node.args["ifs"]:
+            condition = _evaluate(case.this, row)
+            if (condition == subject) if node.this else condition:
+                return _evaluate(case.args["true"], row)
+        default = node.args.get("default")
+        return _evaluate(default, row) if default is not None else None
+    if isinstance(node, exp.And):
+        return bool(_evaluate(node.this, row)) and bool(_evaluate(node.expression, row))
+    if isinstance(node, exp.Or):
+        return bool(_evaluate(node.this, row)) or bool(_evaluate(node.expression, row))
+    if isinstance(node, exp.Not):
+        value = _evaluate(node.this, row)
+        return None if value is None else not value
+    if isinstance(node, exp.Is):
+        return _evaluate(node.this, row) is None
+
+    value = _evaluate(node.this, row)
+    if isinstance(node, exp.Neg):
+        return None if value is None else -value
+    if isinstance(node, exp.Abs):
+        return None if value is None else abs(value)
+    if isinstance(node, exp.Round):
+        decimals = node.args.get("decimals")
+        digits = _evaluate(decimals, row) if decimals is not None else 0
+        return None if value is None else _round(value, digits)
+    if isinstance(node, exp.Cast):
+        if value is None:
+            return None
+        if node.to.is_type(*exp.DataType.INTEGER_TYPES):
+            return int(_round(value, 0))
+        if node.to.is_type(*exp.DataType.REAL_TYPES):
+            return float(value)
+        if node.to.is_type(*exp.DataType.TEXT_TYPES):
+            return str(value)
+        raise _NotMergeable(f"cast to {node.to.sql()}")
+
+    other = _evaluate(node.expression, row)
+    if value is None or other is None:
+        return None
+    if type(node) in _COMPARISONS:
+        return _COMPARISONS[type(node)](value, other)
+    if type(node) in _ARITHMETIC:
+        return _ARITHMETIC[type(node)](value, other)
+    if isinstance(node, exp.SafeDivide):
+        return None if other == 0 else value / other
+    if isinstance(node, exp.Div):
+        if other == 0:
+            raise _NotMergeable("division by zero")
+        return value / other
+    raise _NotMergeable(f"{node.key} cannot be computed locally")
+
+
+def _merge(aggregate: MergedAggregate, current: Any, values: list[Any]) -> Any:
+    if aggregate.kind == "avg":
+        current = current or [None, 0]
+        total, count = values
+        if total is not None:
+            current[0] = total if current[0] is None else current[0] + total
+        current[1] += count or 0
+        return current
+    (value,) = values
+    if value is None:
+        return current
+    if current is None:
+        return value
+    if aggregate.kind == "min":
+        return min(current, value)
+    if aggregate.kind == "max":
+        return max(current, value)
+    return current + value
+
+
+def merge_results(plan: FanoutPlan, table_rows: list[list[list[Any]]]) -> list[dict]:
+    """Merges the partial aggregates of the tables into the query result.
+
+    Args:
+        plan (FanoutPlan): The plan of the query.
+        table_rows: The rows of every table that answered, each a list of the
+          group keys followed by the partial aggregate columns.
+
+    Returns:
+        list[dict]: The result rows of the query.
+    """
+    groups: dict[tuple, list[Any]] = {}
+    for rows in table_rows:
+        for row in rows:
+            key = tuple(row[: plan.num_keys])
+            merged = groups.setdefault(key, [None] * len(plan.aggregates))
+            position = plan.num_keys
+            for i, aggregate in enumerate(plan.aggregates):
+                values = row[position: position + aggregate.width]
+                merged[i] = _merge(aggregate, merged[i], values)
+                position += aggregate.width
+    if not groups and not plan.num_keys:
+        # A global aggregate has one row even without input rows.
+        groups[()] = [None] * len(plan.aggregates)
+
+    results = []
+    for key, merged in groups.items():
+        values = {f"_k{i}": value for i, value in enumerate(key)}
+        for aggregate, value in zip(plan.aggregates, merged):
+            if aggregate.kind == "avg":
+                total, count = value or (None, 0)
+                value = total / count if count else None
+            elif aggregate.kind == "count" and value is None:
+                value = 0
+            values[aggregate.name] = value
+        if plan.having is not None and not _evaluate(plan.having, values):
+            continue
+        output = [_evaluate(node, values) for _, node in plan.projections]
+        sort_keys = [
+            output[target] if isinstance(target, int) else _evaluate(target, values)
+            for target, _, _ in plan.order
+        ]
+        results.append((sort_keys, output))
+
+    # Sort by the last key first; the sort is stable. NULLs sort before or
+    # after the values by a flag in front of the value.
+    for i, (_, desc, nulls_first) in reversed(list(enumerate(plan.order))):
+        nulls_high = nulls_first == desc
+        results.sort(
+            key=lambda item: (
+                (item[0][i] is None) == nulls_high,
+                item[0][i] if item[0][i] is not None else 0,
+            ),
+            reverse=desc,
+        )
+    results = results[plan.offset:]
+    if plan.limit is not None:
+        results = results[: plan.limit]
+    names = [name for name, _ in plan.projections]
+    return [dict(zip(names, output)) for _, output in results]
+
+
+def _get_executor(max_workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="bq-fanout")
+        return _executor
+
+
+def run_plan(
+    plan: FanoutPlan,
+    client: Any,
+    timeout: float,
+    max_workers: int = 16,
+) -> FanoutResult:
+    """Runs the per-table queries of a plan concurrently and merges them.
+
+    Args:
+        plan (FanoutPlan): The plan from `plan_query`.
+        client (bigquery.Client): The BigQuery client.
+        timeout (float): The seconds each table's job may take from its
+          start; jobs that take longer are cancelled and their tables left
+          out.
+        max_workers (int): The maximum number of concurrent table queries of
+          the process.
+
+    Returns:
+        FanoutResult: The merged rows and the tables that are missing.
+
+    Raises:
+        Exception: The error of the first table if no table answered.
+    """
+    def run_table(table: str, sql: str) -> tuple[list[list[Any]], float]:
+        # The timeout starts with the job, not when the table was queued
+        # behind the jobs of other tables or requests.
+        start = time.perf_counter()
+        with tracing.trace_bigquery_job(sql) as span:
+            span.set_attribute("bigquery.table", table)
+            job = client.query(sql)
+            remaining = max(timeout - (time.perf_counter() - start), 0)
+            try:
+                rows = [list(row.values()) for row in job.result(timeout=remaining)]
+            except concurrent.futures.TimeoutError:
+                try:
+                    job.cancel()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.debug("Could not cancel the job of %s", table)
+                raise _TableTimeout(f"timed out after {timeout:g}s") from None
+            tracing.record_bigquery_job(span, job)
+        return rows, time.perf_counter() - start
+
+    executor = _get_executor(max_workers)
+    futures = {
+        executor.submit(
+            tracing.run_in_current_context(run_table), table, sql
+        ): table
+        for table, sql in plan.table_queries.items()
+    }
+    concurrent.futures.wait(futures)
+
+    table_rows, missing, seconds, errors = [], {}, {}, []
+    for future, table in futures.items():
+        try:
+            rows, seconds[table] = future.result()
+            table_rows.append(rows)
+        except _TableTimeout as e:
+            missing[table] = str(e)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            missing[table] = str(e)[:500]
+            errors.append(e)
+    if not table_rows:
+        if errors:
+            raise errors[0]
+        raise TimeoutError(f"All tables timed out after {timeout:g}s")
+    if missing:
+        logger.warning("Partial result, missing tables: %s", missing)
+    return FanoutResult(
+        rows=merge_results(plan, table_rows),
+        missing_tables=missing,
+        table_seconds=seconds,
+    )
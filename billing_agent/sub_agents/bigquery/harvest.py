@@ -0,0 +1,272 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Harvests the queries that answered questions for reuse.
+
+When `run_bigquery_validation` runs a query that returns rows, the question,
+the SQL generated for the prototype table (`raw_sql`) and the expanded SQL
+(`final_sql`) were validated by BigQuery. The tool hands them to `submit`,
+which only queues them; a background thread then
+
+* fingerprints the final SQL by its syntax tree (so formatting, comments and
+  keyword case do not matter) and merges repeated queries, keeping their
+  execution count, bytes processed and latency in `HarvestedQuery`;
+* puts the SQL into a question -> SQL cache, which `initial_bq_nl2sql` and
+  `expand_to_actual_billing_tables` check before calling a model;
+* adds new questions to the few-shot example store of the ChaseSQL prompts
+  (`chase_sql.example_store`), which keeps them in `FEW_SHOT_STORE` if set.
+
+Cached SQL is keyed by the normalized question, the schema and the current
+date, since questions like "cost of last week" depend on it. Harvesting is
+per process and turned off with `QUERY_HARVEST=false`.
+"""
+
+import collections
+import dataclasses
+import datetime
+import hashlib
+import logging
+import os
+import queue
+import threading
+from typing import Optional
+
+from billing_agent.utils import single_flight
+
+logger = logging.getLogger(__name__)
+
+HARVEST_ENABLED = os.getenv("QUERY_HARVEST", "true").lower() in ("1", "true", "yes")
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", 1024))
+# Queries waiting for the harvester; more are dropped.
+MAX_PENDING = 1000
+
+# Harvester events, e.g. "submitted", "new", "duplicate" or "cache_hit".
+HARVEST_STATS: collections.Counter = collections.Counter()
+
+
+@dataclasses.dataclass
+class HarvestedQuery:
+    """A query that answered a question, with its execution statistics.
+
+    Attributes:
+        question: The question.
+        raw_sql: The SQL generated for the prototype billing table.
+        final_sql: The SQL that ran on the billing tables.
+        target_tables: The tables `raw_sql` was expanded to.
+        schema_version: The version of the schema the SQL was generated for.
+        fingerprint: The fingerprint of the syntax tree of `final_sql`.
+        executions: How often the query ran.
+        total_bytes_processed: The bytes processed by all runs, where known.
+        total_seconds: The latency of all runs.
+        num_rows: The rows of the last run.
+    """
+
+    question: str
+    raw_sql: str
+    final_sql: str
+    target_tables: str = ""
+    schema_version: str = ""
+    fingerprint: str = ""
+    executions: int = 0
+    total_bytes_processed: int = 0
+    total_seconds: float = 0.0
+    num_rows: int = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        """The mean latency of a run."""
+        return self.total_seconds / self.executions if self.executions else 0.0
+
+
+def fingerprint_sql(sql: str) -> str:
+    """Returns a fingerprint of the syntax tree of a query.
+
+    Queries that differ only in whitespace, comments, keyword case or quoting
+    get the same fingerprint. If the query cannot be parsed, its normalized
+    text is fingerprinted instead.
+    """
+    try:
+        import sqlglot  # pylint: disable=import-outside-toplevel
+
+        canonical = sqlglot.parse_one(sql, read="bigquery").sql(
+            dialect="bigquery", comments=False
+        )
+    except Exception:  # pylint: disable=broad-exception-caught
+        canonical = single_flight.normalize_sql(sql)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _cache_key(question: str, schema_version: str) -> tuple:
+    return (
+        single_flight.normalize_question(question),
+        schema_version,
+        datetime.date.today().isoformat(),
+    )
+
+
+class Harvester:
+    """Collects validated queries on a background thread."""
+
+    def __init__(self, cache_size: int = SQL_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.queries: dict[str, HarvestedQuery] = {}
+        self._cache: collections.OrderedDict[tuple, HarvestedQuery] = (
+            collections.OrderedDict()
+        )
+        self._pending: queue.Queue = queue.Queue(MAX_PENDING)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._known_questions: Optional[set[str]] = None
+
+    def submit(self, query: HarvestedQuery, bytes_processed: Optional[int],
+               seconds: float) -> None:
+        """Queues a query that ran successfully; never blocks."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="query-harvest", daemon=True)
+                self._thread.start()
+        try:
+            self._pending.put_nowait((query, bytes_processed, seconds))
+            HARVEST_STATS["submitted"] += 1
+        except queue.Full:
+            HARVEST_STATS["dropped"] += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._pending.get()
+            try:
+                self.add(*item)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Harvesting a query failed")
+            finally:
+                self._pending.task_done()
+
+    def wait(self) -> None:
+        """Waits until the queued queries are harvested."""
+        self._pending.join()
+
+    def add(self, query: HarvestedQuery, bytes_processed: Optional[int],
+            seconds: float) -> HarvestedQuery:
+        """Merges a query into the harvest and feeds the cache and examples.
+
+        Returns:
+            HarvestedQuery: The entry of the query's fingerprint.
+        """
+        fingerprint = fingerprint_sql(query.final_sql)
+        with self._lock:
+            entry = self.queries.get(fingerprint)
+            if entry is None:
+                entry = dataclasses.replace(query, fingerprint=fingerprint)
+                self.queries[fingerprint] = entry
+                HARVEST_STATS["new"] += 1
+            else:
+                HARVEST_STATS["duplicate"] += 1
+            entry.executions += 1
+            entry.total_bytes_processed += bytes_processed or 0
+            entry.total_seconds += seconds
+            entry.num_rows = query.num_rows
+
+            key = _cache_key(query.question, query.schema_version)
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        self._add_example(query, entry)
+        return entry
+
+    def _add_example(self, query: HarvestedQuery, entry: HarvestedQuery) -> None:
+        from .chase_sql import example_store  # pylint: disable=import-outside-toplevel
+
+        store = example_store.default_store()
+        question = single_flight.normalize_question(query.question)
+        if self._known_questions is None:
+            self._known_questions = {
+                single_flight.normalize_question(e.question) for e in store.examples
+            }
+        if question in self._known_questions:
+            return
+        self._known_questions.add(question)
+        store.add(example_store.Example(
+            query.question,
+            query.raw_sql,
+            metadata={
+                "source": "harvest",
+                "fingerprint": entry.fingerprint,
+                "bytes_processed": entry.total_bytes_processed,
+                "seconds": round(entry.total_seconds, 3),
+                "date": datetime.date.today().isoformat(),
+            },
+        ))
+        HARVEST_STATS["example_added"] += 1
+
+    def lookup(self, question: str, schema_version: str) -> Optional[HarvestedQuery]:
+        """Returns the harvested query of a question, or None."""
+        with self._lock:
+            entry = self._cache.get(_cache_key(question, schema_version))
+        HARVEST_STATS["cache_hit" if entry else "cache_miss"] += 1
+        return entry
+
+
+_harvester = Harvester()
+
+
+def get_harvester() -> Harvester:
+    """Returns the harvester of the process."""
+    return _harvester
+
+
+def submit(
+    question: Optional[str],
+    raw_sql: Optional[str],
+    final_sql: str,
+    target_tables: str,
+    ddl_schema: Optional[str],
+    num_rows: int,
+    bytes_processed: Optional[int] = None,
+    seconds: float = 0.0,
+) -> None:
+    """Queues a query that answered a question, if harvesting is enabled.
+
+    Args:
+        question (str): The question of the session.
+        raw_sql (str): The SQL generated for the prototype table.
+        final_sql (str): The SQL that ran.
+        target_tables (str): The tables `raw_sql` was expanded to.
+        ddl_schema (str): The schema the SQL was generated for.
+        num_rows (int): The rows the query returned.
+        bytes_processed (int): The bytes the query processed, if known.
+        seconds (float): The latency of the query.
+    """
+    if not HARVEST_ENABLED or not question or not raw_sql or not num_rows:
+        return
+    _harvester.submit(
+        HarvestedQuery(
+            question=question,
+            raw_sql=raw_sql,
+            final_sql=final_sql,
+            target_tables=target_tables,
+            schema_version=single_flight.schema_version(ddl_schema),
+            num_rows=num_rows,
+        ),
+        bytes_processed,
+        seconds,
+    )
+
+
+def cached_sql(question: str, ddl_schema: Optional[str]) -> Optional[HarvestedQuery]:
+    """Returns the harvested query that answered a question today, or None."""
+    if not HARVEST_ENABLED:
+        return None
+    return _harvester.lookup(question, single_flight.schema_version(ddl_schema))
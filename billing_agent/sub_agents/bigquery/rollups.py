@@ -0,0 +1,1019 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Daily rollups of the billing export tables and routing of queries to them.
+
+Most billing questions aggregate cost by service, project, SKU, location or
+month, yet every query scans the detailed export, gigabytes per month. The
+rollup table holds one row per export partition (`_PARTITIONTIME` day), usage
+day and combination of:
+
+    billing account, project, service, SKU, location, invoice month,
+    currency, cost type
+
+with the summed `cost`, `credit_amount` (so the net cost after credits is
+`cost + credit_amount`), `cost_at_list`, usage amounts and the number of
+export rows (`row_count`). It is partitioned by `partition_date`, so queries
+on it scan megabytes.
+
+`refresh_rollup` updates it incrementally: the partitions of a source table
+from the last rolled up day, minus `lookback_days` for late billing data, are
+deleted and aggregated again in one transaction. Run it on a schedule:
+
+    python -m billing_agent.sub_agents.bigquery.rollups \
+        --rollup-table my-project.billing.billing_daily_rollup \
+        --source-tables my-project.billing.gcp_billing_export_resource_v1_01
+
+`RollupRouter.route` rewrites a query over the source tables, e.g. from
+`initial_bq_nl2sql` or `expand_to_actual_billing_tables`, to read the rollup
+instead. It only does so when the rollup holds the exact answer: the query
+aggregates the billing rows (`SUM`, `COUNT`, `AVG`, `COUNT(DISTINCT ...)`,
+...) and groups and filters on rolled up columns only, with time filters on
+whole days. Otherwise, e.g. for labels, resources or hourly filters, it
+returns None and the query runs on the source tables.
+
+The rollup only holds the partitions up to its watermark, the last rolled up
+partition of each source table, so a query is also only routed when its
+filters end at or before the watermark: `_PARTITIONTIME` filters at the
+watermark, `usage_start_time` filters `lookback_days` before it, since usage
+is exported late. Queries over recent or unbounded periods run on the source
+tables.
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import sqlglot
+from sqlglot import exp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOKBACK_DAYS = 3
+# Seconds for which the watermarks of the rollup table are reused.
+WATERMARK_TTL = 300
+
+# (export column, rollup column, type) of the grouping columns.
+DIMENSIONS = [
+    ("billing_account_id", "billing_account_id", "STRING"),
+    ("project.id", "project_id", "STRING"),
+    ("project.number", "project_number", "STRING"),
+    ("project.name", "project_name", "STRING"),
+    ("service.id", "service_id", "STRING"),
+    ("service.description", "service_description", "STRING"),
+    ("sku.id", "sku_id", "STRING"),
+    ("sku.description", "sku_description", "STRING"),
+    ("location.location", "location_name", "STRING"),
+    ("location.country", "location_country", "STRING"),
+    ("location.region", "location_region", "STRING"),
+    ("location.zone", "location_zone", "STRING"),
+    ("invoice.month", "invoice_month", "STRING"),
+    ("currency", "currency", "STRING"),
+    ("cost_type", "cost_type", "STRING"),
+]
+
+# (export column, rollup column, type) of the summed columns.
+MEASURES = [
+    ("cost", "cost", "FLOAT64"),
+    ("cost_at_list", "cost_at_list", "FLOAT64"),
+    ("usage.amount", "usage_amount", "FLOAT64"),
+    ("usage.amount_in_pricing_units", "usage_amount_in_pricing_units", "FLOAT64"),
+]
+
+CREDITS_SQL = "IFNULL((SELECT SUM(c.amount) FROM UNNEST(credits) AS c), 0)"
+
+_DIMENSION_COLUMNS = {path: column for path, column, _ in DIMENSIONS}
+_MEASURE_COLUMNS = {path: column for path, column, _ in MEASURES}
+
+# Units for which truncating or extracting from `usage_start_time` only
+# depends on the usage day.
+_DAY_UNITS = {
+    "DAY", "WEEK", "ISOWEEK", "MONTH", "QUARTER", "YEAR", "ISOYEAR",
+    "DAYOFWEEK", "DAYOFYEAR", "DATE",
+}
+_DATE_LITERAL_RE = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})(?:[ T]00:00(?::00(?:\.0+)?)?)?$")
+_MIRRORED = {
+    exp.EQ: exp.EQ,
+    exp.NEQ: exp.NEQ,
+    exp.GT: exp.LT,
+    exp.GTE: exp.LTE,
+    exp.LT: exp.GT,
+    exp.LTE: exp.GTE,
+}
+
+
+def create_rollup_table_sql(rollup_table: str) -> str:
+    """Returns the DDL of the rollup table."""
+    columns = [
+        "source_table STRING NOT NULL",
+        "partition_date DATE NOT NULL",
+        "usage_date DATE",
+        *(f"{column} {column_type}" for _, column, column_type in DIMENSIONS),
+        *(f"{column} {column_type}" for _, column, column_type in MEASURES),
+        "credit_amount FLOAT64",
+        "row_count INT64",
+    ]
+    return (
+        f"CREATE TABLE IF NOT EXISTS `{rollup_table}` (\n  "
+        + ",\n  ".join(columns)
+        + "\n)\nPARTITION BY partition_date\n"
+        "CLUSTER BY source_table, service_description, project_id"
+    )
+
+
+def refresh_rollup_sql(
+    rollup_table: str,
+    source_table: str,
+    start_date: Optional[datetime.date] = None,
+) -> str:
+    """Returns the script that rolls up the partitions of a source table.
+
+    Args:
+        rollup_table (str): The fully qualified rollup table.
+        source_table (str): The fully qualified billing export table.
+        start_date (datetime.date): The first partition to roll up again; all
+          partitions if None.
+
+    Returns:
+        str: A transaction that replaces the rolled up partitions.
+    """
+    dimensions = [
+        "DATE(_PARTITIONTIME)",
+        "DATE(usage_start_time)",
+        *(path for path, _, _ in DIMENSIONS),
+    ]
+    columns = [
+        "source_table",
+        "partition_date",
+        "usage_date",
+        *(column for _, column, _ in DIMENSIONS),
+        *(column for _, column, _ in MEASURES),
+        "credit_amount",
+        "row_count",
+    ]
+    select = [
+        f"'{source_table}'",
+        *dimensions,
+        *(f"SUM({path})" for path, _, _ in MEASURES),
+        f"SUM({CREDITS_SQL})",
+        "COUNT(*)",
+    ]
+    delete_filter = f"source_table = '{source_table}'"
+    source_filter = "_PARTITIONTIME IS NOT NULL"
+    if start_date:
+        delete_filter += f" AND partition_date >= DATE '{start_date.isoformat()}'"
+        source_filter = f"_PARTITIONTIME >= TIMESTAMP('{start_date.isoformat()}')"
+    # Item 1 is the constant source table, which BigQuery cannot group by.
+    group_by = ", ".join(str(i) for i in range(2, len(dimensions) + 2))
+    select_list = ",\n  ".join(select)
+    return f"""BEGIN TRANSACTION;
+DELETE FROM `{rollup_table}` WHERE {delete_filter};
+INSERT INTO `{rollup_table}` ({", ".join(columns)})
+SELECT
+  {select_list}
+FROM `{source_table}`
+WHERE {source_filter}
+GROUP BY {group_by};
+COMMIT TRANSACTION;"""
+
+
+def refresh_rollup(
+    client: Any,
+    rollup_table: str,
+    source_table: str,
+    lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+    full: bool = False,
+) -> Optional[datetime.date]:
+    """Rolls up the new and recent partitions of a billing export table.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+        rollup_table (str): The fully qualified rollup table; it is created
+          if it does not exist.
+        source_table (str): The fully qualified billing export table.
+        lookback_days (int): The number of days before the last rolled up
+          partition to roll up again, since the export keeps updating recent
+          partitions.
+        full (bool): True to roll up all partitions again.
+
+    Returns:
+        datetime.date: The first partition that was rolled up, or None if all
+        partitions were.
+    """
+    client.query(create_rollup_table_sql(rollup_table)).result()
+    start_date = None
+    if not full:
+        watermark = read_watermarks(client, rollup_table).get(source_table)
+        if watermark:
+            start_date = watermark - datetime.timedelta(days=lookback_days)
+    logger.info(
+        "Rolling up %s into %s from %s",
+        source_table,
+        rollup_table,
+        start_date or "the first partition",
+    )
+    client.query(refresh_rollup_sql(rollup_table, source_table, start_date)).result()
+    return start_date
+
+
+def read_watermarks(client: Any, rollup_table: str) -> dict[str, datetime.date]:
+    """Returns the last rolled up partition of each source table.
+
+    Args:
+        client (bigquery.Client): The BigQuery client.
+        rollup_table (str): The fully qualified rollup table.
+
+    Returns:
+        dict: The watermark of each source table in the rollup.
+    """
+    rows = client.query(
+        "SELECT source_table, MAX(partition_date) AS watermark "
+        f"FROM `{rollup_table}` GROUP BY source_table"
+    ).result()
+    return {row["source_table"]: row["watermark"] for row in rows}
+
+
+class _NotCovered(Exception):
+    """The rollup cannot answer (part of) a query."""
+
+
+def _from(select: exp.Select) -> Optional[exp.From]:
+    # The key was renamed from "from" to "from_" in newer SQLGlot versions.
+    return select.args.get("from_") or select.args.get("from")
+
+
+def _rebuild(node: exp.Expression, func: Callable) -> exp.Expression:
+    """Returns a new node of the same type with `func` applied to its children."""
+    args = {}
+    for key, value in node.args.items():
+        if isinstance(value, exp.Expression):
+            value = func(value)
+        elif isinstance(value, list):
+            value = [func(v) if isinstance(v, exp.Expression) else v for v in value]
+        args[key] = value
+    return node.__class__(**args)
+
+
+def _date_literal(node: exp.Expression) -> Optional[str]:
+    """Returns the day of a literal that is midnight of a day, e.g. '2025-01-01'."""
+    if isinstance(node, (exp.Cast, exp.Timestamp, exp.Date)) and not any(
+        value for key, value in node.args.items() if key not in ("this", "to", "with_tz")
+    ):
+        node = node.this
+    if isinstance(node, exp.Literal) and node.is_string:
+        match = _DATE_LITERAL_RE.match(node.this)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _day(node: exp.Expression) -> Optional[datetime.date]:
+    """Returns the day of a `CAST('2025-01-01' AS DATE)` made by `_Mapper`."""
+    if isinstance(node, exp.Cast) and isinstance(node.this, exp.Literal):
+        return datetime.date.fromisoformat(node.this.this)
+    return None
+
+
+def _last_days(
+    conditions: list[Optional[exp.Expression]],
+) -> dict[str, datetime.date]:
+    """Returns the last partition and usage day that mapped filters allow.
+
+    Only the comparisons of `partition_date` and `usage_date` with a day that
+    all rows must satisfy, i.e. that are not under an OR or NOT, bound the
+    days.
+
+    Args:
+        conditions: The mapped WHERE conditions that apply to the rows.
+
+    Returns:
+        dict: The last day of "partition_date" and "usage_date", if bounded.
+    """
+    last = {}
+    conjuncts = [condition for condition in conditions if condition is not None]
+    while conjuncts:
+        node = conjuncts.pop()
+        if isinstance(node, (exp.Paren, exp.Where)):
+            conjuncts.append(node.this)
+            continue
+        if isinstance(node, exp.And):
+            conjuncts.extend((node.this, node.expression))
+            continue
+        if not isinstance(node.this, exp.Column) or node.this.name not in (
+            "partition_date",
+            "usage_date",
+        ):
+            continue
+        if isinstance(node, exp.Between):
+            day = _day(node.args["high"])
+        elif isinstance(node, (exp.EQ, exp.LTE)):
+            day = _day(node.expression)
+        elif isinstance(node, exp.LT):
+            day = _day(node.expression)
+            day = day - datetime.timedelta(days=1) if day else None
+        else:
+            continue
+        if day:
+            column = node.this.name
+            last[column] = min(day, last.get(column, day))
+    return last
+
+
+def _unit(node: exp.Expression) -> str:
+    unit = node.args.get("unit")
+    return unit.name.upper() if isinstance(unit, (exp.Var, exp.Identifier)) else ""
+
+
+class RollupRouter:
+    """Rewrites queries over billing export tables to read the rollup table.
+
+    Attributes:
+        rollup_table: The fully qualified rollup table.
+        source_tables: The fully qualified billing export tables that are
+          rolled up.
+        lookback_days: The number of days after a usage day in which its
+          usage may still be exported.
+    """
+
+    def __init__(
+        self,
+        rollup_table: str,
+        source_tables: list[str],
+        lookback_days: int = DEFAULT_LOOKBACK_DAYS,
+    ):
+        self.rollup_table = rollup_table
+        self.source_tables = source_tables
+        self.lookback_days = lookback_days
+        self._watermarks: dict[str, datetime.date] = {}
+        self._watermarks_time = None
+        self._watermarks_lock = threading.Lock()
+        self._by_id = {table.lower(): table for table in source_tables}
+        self._by_name = {}
+        for table in source_tables:
+            self._by_name.setdefault(table.split(".")[-1].lower(), []).append(table)
+
+    def watermarks(self, client: Any) -> dict[str, datetime.date]:
+        """Returns the watermarks of the rollup, read at most every TTL.
+
+        Args:
+            client (bigquery.Client): The BigQuery client.
+
+        Returns:
+            dict: The last rolled up partition of each source table; empty if
+            they cannot be read, e.g. before the first refresh.
+        """
+        with self._watermarks_lock:
+            if (
+                self._watermarks_time is None
+                or time.monotonic() - self._watermarks_time >= WATERMARK_TTL
+            ):
+                try:
+                    self._watermarks = read_watermarks(client, self.rollup_table)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.exception("Reading the rollup watermarks failed")
+                    self._watermarks = {}
+                self._watermarks_time = time.monotonic()
+            return self._watermarks
+
+    def route(
+        self, sql: str, watermarks: dict[str, datetime.date]
+    ) -> Optional[str]:
+        """Returns the query rewritten to read the rollup table.
+
+        Args:
+            sql (str): A BigQuery query over the billing export tables.
+            watermarks (dict): The last rolled up partition of each source
+              table, e.g. from `watermarks`.
+
+        Returns:
+            str: An equivalent query over the rollup table, or None if the
+            rollup cannot answer the query.
+        """
+        try:
+            tree = sqlglot.parse_one(sql, read="bigquery")
+        except sqlglot.errors.SqlglotError:
+            return None
+        if not isinstance(tree, exp.Query):
+            return None
+        try:
+            self._rewrite(tree, watermarks)
+        except _NotCovered as e:
+            logger.debug("Query not covered by the rollup: %s", e)
+            return None
+        return tree.sql(dialect="bigquery")
+
+    def _source(self, table: exp.Table) -> Optional[str]:
+        """Returns the rolled up source table a table reference names."""
+        parts = [part.name for part in table.parts]
+        if len(parts) > 1:
+            return self._by_id.get(".".join(parts).lower())
+        matches = self._by_name.get(parts[0].lower(), [])
+        return matches[0] if len(matches) == 1 else None
+
+    def _members(self, query: exp.Expression) -> list[exp.Select]:
+        """Returns the selects of a query that only pass source rows through."""
+        if isinstance(query, exp.Subquery):
+            return self._members(query.this)
+        if isinstance(query, exp.Union) and not query.args.get("distinct"):
+            if any(query.args.get(key) for key in ("order", "limit", "offset", "with")):
+                raise _NotCovered("union with order, limit or with")
+            return self._members(query.this) + self._members(query.expression)
+        if not isinstance(query, exp.Select):
+            raise _NotCovered(f"unsupported relation {query.key}")
+        relation = _from(query)
+        if relation is None or not isinstance(relation.this, exp.Table):
+            raise _NotCovered("member does not read a table")
+        if self._source(relation.this) is None:
+            raise _NotCovered(f"unknown table {relation.this.sql()}")
+        for key, value in query.args.items():
+            if value and key not in ("expressions", "from", "from_", "where"):
+                raise _NotCovered(f"member with {key}")
+        for projection in query.expressions:
+            if not isinstance(projection, (exp.Star, exp.Column)):
+                raise _NotCovered("member computes columns")
+        return [query]
+
+    def _rollup_select(self, source: str, where: Optional[exp.Expression]) -> exp.Select:
+        select = sqlglot.parse_one(
+            f"SELECT * FROM `{self.rollup_table}` WHERE source_table = '{source}'",
+            read="bigquery",
+        )
+        if where is not None:
+            select = select.where(exp.paren(where, copy=False), copy=False)
+        return select
+
+    def _check_watermark(
+        self,
+        source: str,
+        conditions: list[Optional[exp.Expression]],
+        watermarks: dict[str, datetime.date],
+    ) -> None:
+        """Checks that the rows a query reads from a source are rolled up.
+
+        Args:
+            source: The source table the rows are read from.
+            conditions: The mapped WHERE conditions that apply to the rows.
+            watermarks: The last rolled up partition of each source table.
+        """
+        watermark = watermarks.get(source)
+        if watermark is None:
+            raise _NotCovered(f"{source} is not rolled up")
+        last = _last_days(conditions)
+        if "partition_date" in last and last["partition_date"] <= watermark:
+            return
+        if "usage_date" in last and last["usage_date"] <= watermark - (
+            datetime.timedelta(days=self.lookback_days)
+        ):
+            return
+        raise _NotCovered(f"rows of {source} after the watermark {watermark}")
+
+    def _rewrite(
+        self, tree: exp.Expression, watermarks: dict[str, datetime.date]
+    ) -> None:
+        """Rewrites the selects over billing rows of a query in place."""
+        ctes = {cte.alias_or_name.lower(): cte for cte in tree.find_all(exp.CTE)}
+        billing_ctes = {}
+        for name, cte in ctes.items():
+            try:
+                billing_ctes[name] = self._members(cte.this)
+            except _NotCovered:
+                # Not a CTE of billing rows; its selects are checked below.
+                pass
+        members = [member for selects in billing_ctes.values() for member in selects]
+
+        # The selects that aggregate billing rows, from a source table, a CTE
+        # of billing rows or a subquery of billing rows.
+        consumers = []
+        for select in tree.find_all(exp.Select):
+            if any(select is member for member in members):
+                continue
+            relation = _from(select)
+            if relation is None:
+                continue
+            node = relation.this
+            if isinstance(node, exp.Table) and not node.args.get("db") and (
+                node.name.lower() in billing_ctes
+            ):
+                consumers.append((select, node, None))
+            elif isinstance(node, exp.Table) and self._source(node):
+                consumers.append((select, node, self._source(node)))
+            elif isinstance(node, exp.Subquery):
+                try:
+                    sub_members = self._members(node.this)
+                except _NotCovered:
+                    continue
+                members.extend(sub_members)
+                consumers.append((select, node, None))
+
+        # Billing rows must not be read in any other way, e.g. in a join.
+        consumer_relations = {id(node) for _, node, _ in consumers}
+        member_ids = {id(member) for member in members}
+        for table in tree.find_all(exp.Table):
+            if id(table) in consumer_relations:
+                continue
+            if not table.args.get("db") and table.name.lower() in ctes:
+                if table.name.lower() in billing_ctes:
+                    raise _NotCovered(f"{table.name} is not aggregated")
+                continue
+            if self._source(table) is None:
+                raise _NotCovered(f"unknown table {table.sql()}")
+            if id(table.find_ancestor(exp.Select)) not in member_ids:
+                raise _NotCovered(f"{table.sql()} is not aggregated")
+
+        # Every read of billing rows must end at the watermark; the rows of a
+        # CTE or subquery are filtered by its members and by the consumer.
+        def where_of(select: exp.Select) -> Optional[exp.Expression]:
+            where = select.args.get("where")
+            return _Mapper(_relation_names(select)).row(where.this) if where else None
+
+        for select, node, source in consumers:
+            if source is not None:
+                self._check_watermark(source, [where_of(select)], watermarks)
+                continue
+            if isinstance(node, exp.Subquery):
+                read = self._members(node.this)
+            else:
+                read = billing_ctes[node.name.lower()]
+            for member in read:
+                self._check_watermark(
+                    self._source(_from(member).this),
+                    [where_of(member), where_of(select)],
+                    watermarks,
+                )
+
+        # Map everything first, so that nothing changes if a part is not
+        # covered.
+        updates = [
+            self._consumer(select, node, source) for select, node, source in consumers
+        ]
+        for member in members:
+            where = member.args.get("where")
+            mapped = _Mapper(_relation_names(member)).row(where.this) if where else None
+            rollup_select = self._rollup_select(self._source(_from(member).this), mapped)
+            updates.append(lambda member=member, new=rollup_select: member.replace(new))
+        for update in updates:
+            update()
+
+    def _consumer(
+        self,
+        select: exp.Select,
+        relation: exp.Expression,
+        source: Optional[str],
+    ) -> Callable[[], None]:
+        """Maps a select that aggregates billing rows to the rollup columns.
+
+        Args:
+            select: The select.
+            relation: The source table, CTE or subquery the select reads.
+            source: The source table if the select reads it directly.
+
+        Returns:
+            A function that applies the mapping to the select.
+        """
+        for key in ("joins", "laterals", "qualify", "windows", "kind", "into"):
+            if select.args.get(key):
+                raise _NotCovered(f"select with {key}")
+        has_aggregates = any(node.find(exp.AggFunc) for node in select.expressions)
+        if not (
+            select.args.get("group") or has_aggregates or select.args.get("distinct")
+        ):
+            raise _NotCovered("rows are not aggregated")
+
+        mapper = _Mapper(_relation_names(select))
+        aliases = {
+            projection.alias.lower(): projection.this
+            for projection in select.expressions
+            if isinstance(projection, exp.Alias)
+        }
+
+        def is_alias(node: exp.Expression) -> bool:
+            return (
+                isinstance(node, exp.Column)
+                and not node.table
+                and node.name.lower() in aliases
+            )
+
+        def resolve(node: exp.Expression) -> exp.Expression:
+            # Select aliases take precedence over columns of the same name.
+            return aliases[node.name.lower()] if is_alias(node) else node
+
+        expressions = []
+        for projection in select.expressions:
+            if isinstance(projection, exp.Alias):
+                mapped = exp.alias_(mapper.group(projection.this), projection.alias)
+            else:
+                mapped = mapper.group(projection)
+                if isinstance(projection, exp.Column) and mapped.name != projection.name:
+                    # Keep the name of the result column.
+                    mapped = exp.alias_(mapped, projection.name)
+            expressions.append(mapped)
+        where = select.args.get("where")
+        where = exp.Where(this=mapper.row(where.this)) if where else None
+        group = select.args.get("group")
+        if group:
+            if any(group.args.get(key) for key in ("rollup", "cube", "grouping_sets")):
+                raise _NotCovered("grouping sets")
+            group = exp.Group(
+                expressions=[
+                    node.copy() if isinstance(node, exp.Literal)
+                    else mapper.row(resolve(node))
+                    for node in group.expressions
+                ]
+            )
+        having = select.args.get("having")
+        if having:
+            having = exp.Having(this=mapper.group(having.this.transform(resolve)))
+        order = select.args.get("order")
+        if order:
+            order = exp.Order(
+                expressions=[
+                    exp.Ordered(
+                        this=(
+                            ordered.this.copy()
+                            if isinstance(ordered.this, exp.Literal) or is_alias(ordered.this)
+                            else mapper.group(ordered.this)
+                        ),
+                        desc=ordered.args.get("desc"),
+                        nulls_first=ordered.args.get("nulls_first"),
+                    )
+                    for ordered in order.expressions
+                ]
+            )
+        rollup_relation = None
+        if source is not None:
+            rollup_relation = exp.Subquery(
+                this=self._rollup_select(source, None),
+                alias=exp.TableAlias(this=exp.to_identifier(relation.alias_or_name)),
+            )
+
+        def apply():
+            select.set("expressions", expressions)
+            select.set("where", where)
+            select.set("group", group)
+            select.set("having", having)
+            select.set("order", order)
+            if rollup_relation is not None:
+                relation.replace(rollup_relation)
+
+        return apply
+
+
+def _relation_names(select: exp.Select) -> set[str]:
+    relation = _from(select).this
+    names = {relation.alias_or_name.lower()}
+    if isinstance(relation, exp.Table):
+        names.add(relation.name.lower())
+    return names
+
+
+class _Mapper:
+    """Maps expressions over billing export rows to the rollup columns."""
+
+    def __init__(self, relation_names: set[str]):
+        self._relation_names = relation_names
+
+    def _path(self, column: exp.Column) -> str:
+        parts = [part.name.lower() for part in column.parts]
+        if len(parts) > 1 and parts[0] in self._relation_names:
+            parts = parts[1:]
+        return ".".join(parts)
+
+    def _time_column(self, node: exp.Expression) -> Optional[str]:
+        """Returns "partition" or "usage" for the time columns of the export."""
+        if isinstance(node, (exp.TimestampTrunc, exp.Date)):
+            if (
+                (isinstance(node, exp.Date) or _unit(node) == "DAY")
+                and not node.args.get("zone")
+                and self._time_column(node.this) == "partition"
+            ):
+                return "partition"
+        if isinstance(node, exp.Column):
+            path = self._path(node)
+            if path in ("_partitiontime", "_partitiondate"):
+                return "partition"
+            if path == "usage_start_time":
+                return "usage"
+        return None
+
+    def _compare(self, node: exp.Expression) -> Optional[exp.Expression]:
+        """Maps comparisons of the time columns with whole days."""
+        if isinstance(node, exp.Between):
+            low = _date_literal(node.args["low"])
+            high = _date_literal(node.args["high"])
+            if self._time_column(node.this) == "partition" and low and high:
+                return exp.Between(
+                    this=exp.column("partition_date"),
+                    low=exp.cast(exp.Literal.string(low), "DATE"),
+                    high=exp.cast(exp.Literal.string(high), "DATE"),
+                )
+            return None
+        if type(node) not in _MIRRORED:
+            return None
+        for column, value, comparison in (
+            (node.this, node.expression, type(node)),
+            (node.expression, node.this, _MIRRORED[type(node)]),
+        ):
+            kind = self._time_column(column)
+            day = _date_literal(value)
+            if not kind or not day:
+                continue
+            # Partitions start at midnight, so any comparison holds for the
+            # day; usage rows only fall on the same side of midnight for
+            # >= and <.
+            if kind == "usage" and comparison not in (exp.GTE, exp.LT):
+                return None
+            return comparison(
+                this=exp.column("partition_date" if kind == "partition" else "usage_date"),
+                expression=exp.cast(exp.Literal.string(day), "DATE"),
+            )
+        return None
+
+    def row(self, node: exp.Expression) -> exp.Expression:
+        """Maps an expression of the grouping columns of a row."""
+        return self._map(node, aggregates=False)
+
+    def group(self, node: exp.Expression) -> exp.Expression:
+        """Maps an expression of grouping columns and aggregates."""
+        return self._map(node, aggregates=True)
+
+    def _map(self, node: exp.Expression, aggregates: bool) -> exp.Expression:
+        if isinstance(node, exp.AggFunc):
+            if not aggregates:
+                raise _NotCovered(f"nested aggregate {node.key}")
+            return self._aggregate(node)
+        if isinstance(node, exp.Window):
+            if not aggregates:
+                raise _NotCovered("window function")
+            # The window function runs over the aggregated rows, so its
+            # arguments are mapped like the select list.
+            def argument(arg):
+                return arg.copy() if isinstance(arg, exp.Star) else self._map(arg, True)
+
+            return _rebuild(
+                node,
+                lambda child: (
+                    _rebuild(child, argument)
+                    if child is node.this
+                    else self._map(child, True)
+                ),
+            )
+        if isinstance(node, (exp.Subquery, exp.Select, exp.Unnest, exp.Star, exp.Dot)):
+            raise _NotCovered(f"unsupported {node.key}")
+        compared = self._compare(node)
+        if compared is not None:
+            return compared
+        if isinstance(node, exp.Column):
+            return self._dimension(node)
+        if (
+            isinstance(node, exp.Date)
+            and self._time_column(node.this) == "usage"
+            and not node.args.get("zone")
+            and not node.expressions
+        ):
+            return exp.column("usage_date")
+        if isinstance(node, exp.TimestampTrunc) and self._time_column(node.this) == "usage":
+            if _unit(node) not in _DAY_UNITS or node.args.get("zone"):
+                raise _NotCovered("truncation below a day")
+            return exp.TimestampTrunc(
+                this=exp.Timestamp(this=exp.column("usage_date")),
+                unit=node.args["unit"].copy(),
+            )
+        if isinstance(node, exp.Extract) and self._time_column(node.expression) == "usage":
+            if node.name.upper() not in _DAY_UNITS:
+                raise _NotCovered("time part below a day")
+            return exp.Extract(this=node.this.copy(), expression=exp.column("usage_date"))
+        return _rebuild(node, lambda child: self._map(child, aggregates))
+
+    def _dimension(self, column: exp.Column) -> exp.Expression:
+        path = self._path(column)
+        if path in _DIMENSION_COLUMNS:
+            return exp.column(_DIMENSION_COLUMNS[path])
+        if path == "_partitiontime":
+            return exp.Timestamp(this=exp.column("partition_date"))
+        if path == "_partitiondate":
+            return exp.column("partition_date")
+        raise _NotCovered(f"column {path} is not rolled up")
+
+    def _aggregate(self, node: exp.AggFunc) -> exp.Expression:
+        row_count = exp.column("row_count")
+        if isinstance(node, exp.Sum):
+            return exp.Sum(this=self._linear(node.this))
+        if isinstance(node, exp.Avg):
+            # The export columns are never NULL, so the row count is the
+            # count of summed values.
+            return exp.Div(
+                this=exp.Sum(this=self._linear(node.this)),
+                expression=exp.Sum(this=row_count),
+            )
+        if isinstance(node, exp.Count):
+            value = node.this
+            if isinstance(value, exp.Distinct):
+                return exp.Count(
+                    this=exp.Distinct(
+                        expressions=[self.row(e) for e in value.expressions]))
+            if isinstance(value, (exp.Star, exp.Literal)):
+                counted = row_count
+            else:
+                counted = exp.If(
+                    this=exp.Is(this=self.row(value), expression=exp.Null()).not_(),
+                    true=row_count,
+                    false=exp.Literal.number(0),
+                )
+            return exp.Coalesce(
+                this=exp.Sum(this=counted), expressions=[exp.Literal.number(0)])
+        if isinstance(node, exp.CountIf):
+            return exp.Coalesce(
+                this=exp.Sum(
+                    this=exp.If(
+                        this=self.row(node.this),
+                        true=row_count,
+                        false=exp.Literal.number(0),
+                    )
+                ),
+                expressions=[exp.Literal.number(0)],
+            )
+        if isinstance(node, (exp.Min, exp.Max, exp.ApproxDistinct, exp.AnyValue)):
+            return _rebuild(node, self.row)
+        raise _NotCovered(f"aggregate {node.key}")
+
+    def _is_credits(self, node: exp.Expression) -> bool:
+        """Returns True for `(SELECT SUM(c.amount) FROM UNNEST(credits) c)`."""
+        if not isinstance(node, exp.Subquery) or not isinstance(node.this, exp.Select):
+            return False
+        select = node.this
+        relation = _from(select)
+        if (
+            relation is None
+            or not isinstance(relation.this, exp.Unnest)
+            or len(select.expressions) != 1
+            or any(
+                value for key, value in select.args.items()
+                if key not in ("expressions", "from", "from_")
+            )
+        ):
+            return False
+        unnest = relation.this
+        if len(unnest.expressions) != 1 or not isinstance(
+            unnest.expressions[0], exp.Column
+        ) or self._path(unnest.expressions[0]) != "credits":
+            return False
+        total = select.expressions[0]
+        if isinstance(total, exp.Alias):
+            total = total.this
+        return (
+            isinstance(total, exp.Sum)
+            and isinstance(total.this, exp.Column)
+            and total.this.name.lower() == "amount"
+        )
+
+    def _linear(self, node: exp.Expression) -> exp.Expression:
+        """Maps a summed row expression to the sum over the rolled up rows.
+
+        The rollup can only sum expressions that are linear in the measures,
+        with coefficients that depend on the grouping columns only.
+        """
+        try:
+            constant = self.row(node)
+        except _NotCovered:
+            pass
+        else:
+            return exp.Mul(this=exp.paren(constant, copy=False), expression=exp.column("row_count"))
+        if isinstance(node, exp.Paren):
+            return exp.paren(self._linear(node.this), copy=False)
+        if isinstance(node, exp.Column):
+            path = self._path(node)
+            if path in _MEASURE_COLUMNS:
+                return exp.column(_MEASURE_COLUMNS[path])
+            raise _NotCovered(f"column {path} is not summed")
+        if self._is_credits(node):
+            return exp.column("credit_amount")
+        if isinstance(node, (exp.Add, exp.Sub)):
+            return node.__class__(
+                this=self._linear(node.this), expression=self._linear(node.expression))
+        if isinstance(node, exp.Neg):
+            return exp.Neg(this=self._linear(node.this))
+        if isinstance(node, exp.Mul):
+            try:
+                return exp.Mul(this=self.row(node.this), expression=self._linear(node.expression))
+            except _NotCovered:
+                return exp.Mul(this=self._linear(node.this), expression=self.row(node.expression))
+        if isinstance(node, exp.Div):
+            return exp.Div(this=self._linear(node.this), expression=self.row(node.expression))
+        if isinstance(node, exp.Coalesce) and len(node.expressions) == 1:
+            default = node.expressions[0]
+            if (
+                isinstance(default, exp.Literal)
+                and not default.is_string
+                and float(default.this) == 0
+            ):
+                return exp.Coalesce(
+                    this=self._linear(node.this), expressions=[default.copy()])
+        if isinstance(node, exp.If):
+            false = node.args.get("false")
+            return exp.If(
+                this=self.row(node.this),
+                true=self._linear(node.args["true"]),
+                false=self._linear(false) if false is not None else None,
+            )
+        if isinstance(node, exp.Case):
+            default = node.args.get("default")
+            return exp.Case(
+                this=self.row(node.this) if node.this else None,
+                ifs=[
+                    exp.If(this=self.row(case.this), true=self._linear(case.args["true"]))
+                    for case in node.args["ifs"]
+                ],
+                default=self._linear(default) if default is not None else None,
+            )
+        raise _NotCovered(f"{node.key} is not linear")
+
+
+_router: Optional[RollupRouter] = None
+
+
+def get_router() -> Optional[RollupRouter]:
+    """Returns the router configured by the environment, if any.
+
+    The rollup table is set with `ROLLUP_TABLE`; the rolled up tables with
+    `ROLLUP_SOURCE_TABLES` (comma separated), by default
+    `TARGET_BILLING_TABLES`.
+    """
+    global _router
+    rollup_table = os.getenv("ROLLUP_TABLE")
+    if not rollup_table:
+        return None
+    source_tables = [
+        table.strip()
+        for table in (
+            os.getenv("ROLLUP_SOURCE_TABLES")
+            or os.getenv("TARGET_BILLING_TABLES", "")
+        ).split(",")
+        if table.strip()
+    ]
+    if not source_tables:
+        return None
+    if (
+        _router is None
+        or _router.rollup_table != rollup_table
+        or _router.source_tables != source_tables
+    ):
+        _router = RollupRouter(rollup_table, source_tables)
+    return _router
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rollup-table",
+        default=os.getenv("ROLLUP_TABLE"),
+        help="Fully qualified rollup table (default: $ROLLUP_TABLE).",
+    )
+    parser.add_argument(
+        "--source-tables",
+        default=os.getenv("ROLLUP_SOURCE_TABLES")
+        or os.getenv("TARGET_BILLING_TABLES"),
+        help="Comma separated billing export tables (default: "
+        "$ROLLUP_SOURCE_TABLES or $TARGET_BILLING_TABLES).",
+    )
+    parser.add_argument(
+        "--lookback-days", type=int, default=DEFAULT_LOOKBACK_DAYS)
+    parser.add_argument(
+        "--full", action="store_true", help="Roll up all partitions again.")
+    parser.add_argument("--project", help="Project to run the queries in.")
+    args = parser.parse_args(argv)
+    if not args.rollup_table or not args.source_tables:
+        parser.error("--rollup-table and --source-tables are required")
+
+    from billing_agent.utils import client_registry
+
+    logging.basicConfig(level=logging.INFO)
+    client = client_registry.bigquery_client(args.project)
+    for source_table in args.source_tables.split(","):
+        refresh_rollup(
+            client,
+            args.rollup_table,
+            source_table.strip(),
+            lookback_days=args.lookback_days,
+            full=args.full,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -18,33 +18,49 @@ import datetime
 import logging
 import os
 import re
-import requests
-
+import time
+
+from billing_agent.utils import (
+    arrow_results,
+    client_registry,
+    http_clients,
+    progress,
+    single_flight,
+    tracing,
+)
+from billing_agent.utils.structured_logging import log_event
 from billing_agent.utils.utils import get_env_var
 from google.adk.tools import ToolContext
 from google.cloud import bigquery
-from google.genai import Client
 
+from . import harvest
 from .chase_sql import chase_constants
-from google.adk.models.lite_llm import LiteLlm
+
+logger = logging.getLogger(__name__)
 
 # Assume that `BQ_PROJECT_ID` is set in the environment. See the
 # `data_agent` README for more details.
 project = os.getenv("BQ_PROJECT_ID", None)
 location = os.getenv("GOOGLE_CLOUD_LOCATION", "us-central1")
-llm_client = Client(
-    vertexai=True, project='sunivy-for-example', location=location)
-litellm_model = LiteLlm(
-    model='litellm_proxy/gemini-2.5-pro',
-    api_base='https://litellm-cloudrun-668429440317.us-central1.run.app',
-    # Pass authentication headers if needed
-    # extra_headers=auth_headers
-    # Alternatively, if endpoint uses an API key:
-    api_key='sk-zQZEBtCjkNzFvxNFUtTDew'
-)
+LLM_PROJECT = 'sunivy-for-example'
+
+# Clients are created on first use by `client_registry`; set these to use
+# other clients, e.g. in the benchmark.
+llm_client = None
 
 MAX_NUM_ROWS = 80
 
+# Aggregates over several billing tables can run as one job per table (see
+# `fanout`), each job limited to TABLE_QUERY_TIMEOUT seconds from its start.
+PARALLEL_TABLE_QUERIES = os.getenv("PARALLEL_TABLE_QUERIES", "false").lower() == "true"
+TABLE_QUERY_TIMEOUT = float(os.getenv("TABLE_QUERY_TIMEOUT", "120"))
+TABLE_QUERY_WORKERS = int(os.getenv("TABLE_QUERY_WORKERS", "16"))
+
+# Concurrent identical NL2SQL, expansion and query work runs once per process.
+nl2sql_flight = single_flight.SingleFlight("nl2sql")
+expansion_flight = single_flight.SingleFlight("expansion")
+query_flight = single_flight.SingleFlight("bigquery")
+
 
 database_settings = None
 bq_client = None
@@ -55,7 +71,7 @@ billing_sample_uri = "https://cloud.google.com/billing/docs/how-to/bq-examples"
 
 def fetch_web_content(url):
     """
-    Fetch content from a web URL.
+    Fetch content from a web URL over the shared, keep-alive HTTP client.
 
     Args:
         url (str): The URL to fetch content from
@@ -64,14 +80,24 @@ def fetch_web_content(url):
         str: The HTML content of the webpage
     """
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for HTTP errors
+        with tracing.tracer.start_as_current_span("http.fetch_web_content") as span:
+            span.set_attribute("http.url", url)
+            response = http_clients.get_client().get(url)
+            response.raise_for_status()  # Raise an exception for HTTP errors
+            span.set_attribute("http.response_size", len(response.content))
         return response.text
     except Exception as e:
-        print(f"Error fetching content from {url}: {e}")
+        logging.warning("Error fetching content from %s: %s", url, e)
         return None
 
 
+def get_llm_client():
+    """Get the Gemini client used for NL2SQL and SQL repair."""
+    if llm_client is not None:
+        return llm_client
+    return client_registry.genai_client(project=LLM_PROJECT, location=location)
+
+
 def get_bq_client():
     """Get BigQuery client."""
     global bq_client
@@ -80,9 +106,7 @@ def get_bq_client():
         # Remove quotes if they exist in the project ID
         if project_id.startswith("'") and project_id.endswith("'"):
             project_id = project_id[1:-1]
-        logging.info(
-            f"Initializing BigQuery client with project ID: {project_id}")
-        bq_client = bigquery.Client(project=project_id)
+        bq_client = client_registry.bigquery_client(project_id)
     return bq_client
 
 
@@ -140,7 +164,7 @@ def get_bigquery_schema(dataset_id, client=None, project_id=None):
     """
 
     if client is None:
-        client = bigquery.Client(project=project_id)
+        client = client_registry.bigquery_client(project_id)
 
     # dataset_ref = client.dataset(dataset_id)
     dataset_ref = bigquery.DatasetReference(project_id, dataset_id)
@@ -195,6 +219,7 @@ def get_bigquery_schema(dataset_id, client=None, project_id=None):
     return ddl_statements, table_id
 
 
+@tracing.trace_tool
 def initial_bq_nl2sql(
     question: str,
     tool_context: ToolContext,
@@ -209,6 +234,29 @@ def initial_bq_nl2sql(
     Returns:
         str: An SQL statement to answer this question.
     """
+    ddl_schema = tool_context.state["database_settings"]["bq_ddl_schema"]
+    cached = harvest.cached_sql(question, ddl_schema)
+    if cached is not None:
+        sql = cached.raw_sql
+    else:
+        sql = nl2sql_flight.do(
+            (
+                "baseline",
+                single_flight.normalize_question(question),
+                single_flight.schema_version(ddl_schema),
+            ),
+            lambda: _generate_sql(question, ddl_schema),
+        )
+
+    tool_context.state["raw_sql"] = sql
+    tool_context.state["question"] = question
+    progress.publish("sql_generated", sql=sql)
+
+    return sql
+
+
+def _generate_sql(question: str, ddl_schema: str) -> str:
+    """Generates SQL for a question with the baseline NL2SQL prompt."""
 
     prompt_template = """
 You are a BigQuery SQL expert tasked with answering user's questions about BigQuery tables by generating SQL queries in the GoogleSql dialect.  Your task is to write a Bigquery SQL query that answers the following question while using the provided context.
@@ -241,8 +289,6 @@ The database structure is defined by the following table schemas (possibly with
 
    """
 
-    ddl_schema = tool_context.state["database_settings"]["bq_ddl_schema"]
-
     prompt = prompt_template.format(
         MAX_NUM_ROWS=MAX_NUM_ROWS, SCHEMA=ddl_schema, QUESTION=question
     )
@@ -257,13 +303,18 @@ The database structure is defined by the following table schemas (possibly with
         types.Part.from_text(text=fetch_web_content(billing_sample_uri)),
     ]
 
+    model = os.getenv("BASELINE_NL2SQL_MODEL", "gemini-2.5-pro-preview-05-06")
     try:
-        response = llm_client.models.generate_content(
-            model=os.getenv("BASELINE_NL2SQL_MODEL",
-                            "gemini-2.5-pro-preview-05-06"),
-            contents=content_parts,
-            config={"temperature": 0.1},
-        )
+        with tracing.trace_llm_call(
+            model, region=location, stage="initial_bq_nl2sql"
+        ) as span:
+            response = get_llm_client().models.generate_content(
+                model=model,
+                contents=content_parts,
+                config={"temperature": 0.1},
+            )
+            tracing.record_llm_usage(
+                span, getattr(response, "usage_metadata", None))
         sql = response.text
     except Exception as e:
         logging.error(f"Error using Vertex AI model: {e}")
@@ -278,16 +329,40 @@ The database structure is defined by the following table schemas (possibly with
         # # Extract text from LiteLLM response which has a different format
         # sql = litellm_response.choices[0].message.content
 
-    logging.info(prompt)
+    log_event(
+        logger,
+        "llm_prompt",
+        "initial_bq_nl2sql prompt",
+        prompt=prompt,
+        sql=sql,
+    )
     if sql:
         sql = sql.replace("```sql", "").replace("```", "").strip()
+    return sql
 
-    tool_context.state["raw_sql"] = sql
-    tool_context.state["question"] = question
 
-    return sql
+def estimate_query_bytes(sql_string):
+    """Returns the bytes a query would scan, from a BigQuery dry run.
 
+    Args:
+        sql_string (str): The SQL query.
+
+    Returns:
+        int: The estimated bytes processed, or None if the dry run failed.
+    """
+    try:
+        job = get_bq_client().query(
+            sql_string,
+            job_config=bigquery.QueryJobConfig(
+                dry_run=True, use_query_cache=False),
+        )
+        return job.total_bytes_processed
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.debug("Dry run failed: %s", e)
+        return None
 
+
+@tracing.trace_tool
 def run_bigquery_validation(
     sql_string: str,
     tool_context: ToolContext,
@@ -336,49 +411,259 @@ def run_bigquery_validation(
         # 4. Replace escaped newlines (those not preceded by a backslash)
         sql_string = sql_string.replace("\\n", "\n")
 
-        # 5. Add limit clause if not present
+        # 5. Add limit clause if not present. Results shared with the code
+        # kernels may hold more rows than the prompt.
         if "limit" not in sql_string.lower():
-            sql_string = sql_string + " limit " + str(MAX_NUM_ROWS)
+            limit = (
+                arrow_results.MAX_DATA_ROWS
+                if arrow_results.is_enabled()
+                else MAX_NUM_ROWS
+            )
+            sql_string = sql_string + " limit " + str(limit)
 
         return sql_string
 
-    logging.info("Validating SQL: %s", sql_string)
     sql_string = cleanup_sql(sql_string)
-    logging.info("Validating SQL (after cleanup): %s", sql_string)
+    logging.debug("Validating SQL (after cleanup): %s", sql_string)
 
     final_result = {"query_result": None, "error_message": None}
 
     # More restrictive check for BigQuery - disallow DML and DDL
-    if re.search(
-        r"(?i)(update|delete|drop|insert|create|alter|truncate|merge)", sql_string
-    ):
+    if not is_read_only(sql_string):
         final_result["error_message"] = (
             "Invalid SQL: Contains disallowed DML/DDL operations."
         )
         return final_result
 
+    # Shared with concurrent callers of the same query; copy before use.
+    final_result = dict(query_flight.do(
+        single_flight.normalize_sql(sql_string),
+        lambda: _execute_query(sql_string),
+    ))
+    data = final_result.pop("data", None)
+    stats = final_result.pop("stats", None) or {}
+    if final_result["query_result"] is not None:
+        rows = final_result["query_result"]
+        tool_context.state["query_result"] = rows
+        tool_context.state[arrow_results.STATE_KEY] = data
+        if data and data["num_rows"] > len(rows):
+            final_result["total_rows"] = data["num_rows"]
+        # Keep the SQL that answered the session's question, unless the
+        # agent ran some other query.
+        expected_sql = (
+            tool_context.state.get("final_sql")
+            or tool_context.state.get("raw_sql")
+            or ""
+        ).replace("```sql", "").replace("```", "").strip()
+        if not final_result.get("partial") and expected_sql and (
+            single_flight.normalize_sql(cleanup_sql(expected_sql))
+            == single_flight.normalize_sql(sql_string)
+        ):
+            settings = tool_context.state.get("database_settings") or {}
+            harvest.submit(
+                question=tool_context.state.get("question"),
+                raw_sql=tool_context.state.get("raw_sql"),
+                final_sql=sql_string,
+                target_tables=os.getenv(
+                    "TARGET_BILLING_TABLES",
+                    settings.get("prototype_billing_table", ""),
+                ),
+                ddl_schema=settings.get("bq_ddl_schema"),
+                num_rows=data["num_rows"] if data else len(rows),
+                bytes_processed=stats.get("bytes_processed"),
+                seconds=stats.get("seconds", 0.0),
+            )
+        progress.publish(
+            "rows_ready",
+            rows=len(rows),
+            columns=list(rows[0].keys()) if rows else [],
+        )
+    elif final_result["error_message"].startswith("Invalid SQL"):
+        progress.publish("query_failed", error=final_result["error_message"][:500])
+
+    log_event(
+        logger,
+        "query_result",
+        "run_bigquery_validation finished",
+        sql=sql_string,
+        error_message=final_result["error_message"],
+        num_rows=len(final_result["query_result"] or []),
+        query_result=final_result["query_result"],
+    )
+
+    return final_result
+
+
+def is_read_only(sql_string: str) -> bool:
+    """Returns False if a query may contain DML or DDL statements."""
+    return not re.search(
+        r"(?i)(update|delete|drop|insert|create|alter|truncate|merge)", sql_string
+    )
+
+
+def route_to_rollup(sql_string):
+    """Returns the query rewritten to read the daily billing rollup.
+
+    Routing is enabled by setting `ROLLUP_TABLE` (see `rollups`). Only
+    queries whose time filters end at or before the rollup's watermark are
+    routed.
+
+    Args:
+        sql_string (str): The SQL query over the billing export tables.
+
+    Returns:
+        str: The query over the rollup table, or None if it is not enabled or
+        cannot answer the query.
+    """
+    if not os.getenv("ROLLUP_TABLE"):
+        return None
+    from . import rollups
+
+    router = rollups.get_router()
+    if router is None:
+        return None
+    try:
+        return router.route(sql_string, router.watermarks(get_bq_client()))
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Routing to the rollup failed")
+        return None
+
+
+def _execute_query(sql_string: str) -> dict:
+    """Runs a validated query and returns its rows or error message.
+
+    Queries that the daily rollup can answer for its rolled up days run on
+    it; if that fails, they run on the billing tables.
+    Aggregates over several billing tables run as one job per table if
+    `PARALLEL_TABLE_QUERIES` is set.
+    """
+    rollup_sql = route_to_rollup(sql_string)
+    if rollup_sql:
+        progress.publish("query_routed", table=os.getenv("ROLLUP_TABLE"))
+        final_result = _run_query(rollup_sql, rollup=True)
+        if not (final_result["error_message"] or "").startswith("Invalid SQL"):
+            return final_result
+        logger.warning(
+            "Query on the rollup failed, using the billing tables: %s",
+            final_result["error_message"],
+        )
+    if PARALLEL_TABLE_QUERIES:
+        from . import fanout
+
+        plan = fanout.plan_query(sql_string)
+        if plan is not None:
+            final_result = _run_fanout(plan)
+            if final_result is not None:
+                return final_result
+    return _run_query(sql_string)
+
+
+def _format_rows(rows) -> list[dict]:
+    """Converts result rows to JSON friendly dicts, up to MAX_NUM_ROWS."""
+    return [
+        {
+            key: (
+                value
+                if not isinstance(value, datetime.date)
+                else value.strftime("%Y-%m-%d")
+            )
+            for (key, value) in row.items()
+        }
+        for row in rows
+    ][:MAX_NUM_ROWS]
+
+
+def _write_data(get_table):
+    """Writes a query result for the code kernels; returns its reference."""
+    try:
+        return arrow_results.write_table(get_table())
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Writing the query result as Arrow failed")
+        return None
+
+
+def _run_fanout(plan) -> dict:
+    """Runs a query as one job per billing table and merges the results.
+
+    Tables that fail or time out are left out; the result is then flagged as
+    partial and lists them in `missing_tables`.
+
+    Returns:
+        dict: The result, or None if the query should run as a single job
+        instead, e.g. because every table failed.
+    """
+    from . import fanout
+
+    final_result = {"query_result": None, "error_message": None}
+    tables = list(plan.table_queries)
+    if progress.is_streaming():
+        progress.publish(
+            "query_running",
+            bytes_estimate=estimate_query_bytes(plan.sql),
+            tables=len(tables),
+        )
+    progress.publish("query_fanout", tables=tables)
+    start = time.monotonic()
+    try:
+        result = fanout.run_plan(
+            plan, get_bq_client(), TABLE_QUERY_TIMEOUT, TABLE_QUERY_WORKERS)
+    except TimeoutError as e:
+        final_result["error_message"] = f"Query timed out: {e}"
+        return final_result
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.warning(
+            "Per-table queries failed, running a single query", exc_info=True)
+        return None
+
+    log_event(
+        logger,
+        "bigquery_fanout",
+        "Per-table queries finished",
+        tables=len(tables),
+        missing_tables=len(result.missing_tables),
+        slowest_table_seconds=max(result.table_seconds.values()),
+    )
+    final_result["query_result"] = _format_rows(result.rows)
+    final_result["stats"] = {"seconds": time.monotonic() - start}
+    if arrow_results.is_enabled():
+        final_result["data"] = _write_data(
+            lambda: arrow_results.rows_to_table(result.rows))
+    if result.missing_tables:
+        final_result["partial"] = True
+        final_result["missing_tables"] = result.missing_tables
+        progress.publish("query_partial", missing_tables=result.missing_tables)
+    return final_result
+
+
+def _run_query(sql_string: str, rollup: bool = False) -> dict:
+    """Runs a query and returns its rows or error message."""
+    final_result = {"query_result": None, "error_message": None}
+
+    if progress.is_streaming():
+        progress.publish(
+            "query_running", bytes_estimate=estimate_query_bytes(sql_string))
+
     try:
-        query_job = get_bq_client().query(sql_string)
-        results = query_job.result()  # Get the query results
+        start = time.monotonic()
+        with tracing.trace_bigquery_job(sql_string) as span:
+            span.set_attribute("bigquery.rollup", rollup)
+            query_job = get_bq_client().query(sql_string)
+            results = query_job.result()  # Get the query results
+            tracing.record_bigquery_job(span, query_job)
+        final_result["stats"] = {
+            "bytes_processed": getattr(query_job, "total_bytes_processed", None),
+            "seconds": time.monotonic() - start,
+        }
 
         if results.schema:  # Check if query returned data
-            rows = [
-                {
-                    key: (
-                        value
-                        if not isinstance(value, datetime.date)
-                        else value.strftime("%Y-%m-%d")
-                    )
-                    for (key, value) in row.items()
-                }
-                for row in results
-            ][
-                :MAX_NUM_ROWS
-            ]  # Convert BigQuery RowIterator to list of dicts
-            # return f"Valid SQL. Results: {rows}"
-            final_result["query_result"] = rows
-
-            tool_context.state["query_result"] = rows
+            if arrow_results.is_enabled():
+                # The whole result for the code kernels, the first rows for
+                # the prompt.
+                table = results.to_arrow()
+                final_result["data"] = _write_data(lambda: table)
+                results = table.slice(0, MAX_NUM_ROWS).to_pylist()
+            # Convert BigQuery RowIterator to list of dicts
+            final_result["query_result"] = _format_rows(results)
 
         else:
             final_result["error_message"] = (
@@ -390,12 +675,44 @@ def run_bigquery_validation(
     ) as e:  # Catch generic exceptions from BigQuery  # pylint: disable=broad-exception-caught
         final_result["error_message"] = f"Invalid SQL: {e}"
 
-    print("\n run_bigquery_validation final_result: \n", final_result)
-
     return final_result
 
 
+@tracing.trace_tool
 def expand_to_actual_billing_tables(question: str, raw_sql: str, tool_context: ToolContext):
+    prototype_billing_table = tool_context.state["database_settings"]["prototype_billing_table"]
+    target_tables = os.getenv('TARGET_BILLING_TABLES', prototype_billing_table)
+    cached = harvest.cached_sql(
+        question, tool_context.state["database_settings"].get("bq_ddl_schema"))
+    if (
+        cached is not None
+        and cached.target_tables == target_tables
+        and single_flight.normalize_sql(cached.raw_sql)
+        == single_flight.normalize_sql(raw_sql)
+    ):
+        tool_context.state["final_sql"] = cached.final_sql
+        progress.publish("sql_expanded", sql=cached.final_sql)
+        return cached.final_sql
+
+    sql = expansion_flight.do(
+        (
+            single_flight.normalize_question(question),
+            single_flight.normalize_sql(raw_sql),
+            prototype_billing_table,
+            target_tables,
+        ),
+        lambda: _expand_sql(
+            question, raw_sql, prototype_billing_table, target_tables),
+    )
+
+    tool_context.state["final_sql"] = sql
+    progress.publish("sql_expanded", sql=sql)
+
+    return sql
+
+
+def _expand_sql(question, raw_sql, prototype_billing_table, target_tables):
+    """Rewrites SQL on the prototype table to run on the customer tables."""
 
     prompt_template = """
 You will be given an input SQL statement that operates on a single Google Cloud Platform (GCP) billing export table: `{prototype_table}`.
@@ -425,10 +742,7 @@ input SQL:
 output SQL:
     
     """
-    prototype_billing_table = tool_context.state["database_settings"]["prototype_billing_table"]
-
-    project_list = os.getenv('TARGET_BILLING_TABLES',
-                             prototype_billing_table).split(',')
+    project_list = target_tables.split(',')
     prompt = prompt_template.format(
         prototype_table=prototype_billing_table,
         target_tables='/n'.join(project_list),
@@ -443,19 +757,22 @@ output SQL:
         types.Part.from_text(text=prompt),
     ]
 
+    model = os.getenv("BASELINE_NL2SQL_MODEL", "gemini-2.5-pro-preview-05-06")
     try:
-        response = llm_client.models.generate_content(
-            model=os.getenv("BASELINE_NL2SQL_MODEL",
-                            "gemini-2.5-pro-preview-05-06"),
-            contents=content_parts,
-            config={"temperature": 0.1},
-        )
+        with tracing.trace_llm_call(
+            model, region=location, stage="expand_to_actual_billing_tables"
+        ) as span:
+            response = get_llm_client().models.generate_content(
+                model=model,
+                contents=content_parts,
+                config={"temperature": 0.1},
+            )
+            tracing.record_llm_usage(
+                span, getattr(response, "usage_metadata", None))
         sql = response.text
     except Exception as e:
         logging.error(f"Error using Vertex AI model: {e}")
         logging.info("Falling back to LiteLLM")
         raise
 
-    tool_context.state["final_sql"] = sql
-
     return sql
@@ -17,32 +17,53 @@
 -- it get data from database (e.g., BQ) using NL2SQL
 -- then, it use NL2Py to do further data analysis as needed
 """
+import logging
 
 from google.adk.tools import ToolContext
 from google.adk.tools.agent_tool import AgentTool
+from google.genai import types
 
 from .sub_agents import ds_agent, db_agent
+from .sub_agents.analytics.tools import INPUT_ROWS_KEY
+from .utils import analysis_cache, arrow_results, progress, state_compaction
+from .utils.tracing import trace_tool
 
+logger = logging.getLogger(__name__)
 
+
+@trace_tool
 async def call_db_agent(
     question: str,
     tool_context: ToolContext,
 ):
     """Tool to call database (nl2sql) agent."""
-    print(
-        "\n call_db_agent.use_database:"
-        f' {tool_context.state["all_db_settings"]["use_database"]}'
+    logger.debug(
+        "call_db_agent.use_database: %s",
+        tool_context.state["all_db_settings"]["use_database"],
     )
 
+    progress.publish("database_agent", question=question)
     agent_tool = AgentTool(agent=db_agent)
 
     db_agent_output = await agent_tool.run_async(
         args={"request": question}, tool_context=tool_context
     )
     tool_context.state["db_agent_output"] = db_agent_output
+
+    # Keep only references to the large results in session state.
+    await state_compaction.offload_state_value(tool_context, "query_result")
+    await state_compaction.offload_state_value(tool_context, "db_agent_output")
+    state_compaction.record_turn(
+        tool_context,
+        question=question,
+        sql=tool_context.state.get("final_sql")
+        or tool_context.state.get("raw_sql"),
+        query_result=tool_context.state.get("query_result"),
+    )
     return db_agent_output
 
 
+@trace_tool
 async def call_ds_agent(
     question: str,
     tool_context: ToolContext,
@@ -50,11 +71,30 @@ async def call_ds_agent(
     """Tool to call data science (nl2py) agent."""
 
     if question == "N/A":
-        return tool_context.state["db_agent_output"]
+        return await state_compaction.load_state_value(
+            tool_context, "db_agent_output")
+
+    data = tool_context.state.get(arrow_results.STATE_KEY)
+    if arrow_results.is_available(data):
+        fingerprint = data["fingerprint"]
+        # The code kernel loads the whole result from its Arrow file.
+        question_with_data = f"""
+  Question to answer: {question}
 
-    input_data = tool_context.state["query_result"]
+  The data to analyze from the previous question is already loaded in the
+  pandas DataFrame `df` ({data["num_rows"]} rows) with the columns:
+{arrow_results.describe(data)}
 
-    question_with_data = f"""
+  """
+    else:
+        input_data = await state_compaction.load_state_value(
+            tool_context, "query_result")
+        fingerprint = analysis_cache.fingerprint_rows(input_data)
+        # The agent runs in a session of its own, which cannot load the
+        # artifact of an offloaded query_result; its tools read the rows here.
+        tool_context.state[INPUT_ROWS_KEY] = input_data
+
+        question_with_data = f"""
   Question to answer: {question}
 
   Actual data to analyze prevoius quesiton is already in the following:
@@ -62,10 +102,46 @@ async def call_ds_agent(
 
   """
 
-    agent_tool = AgentTool(agent=ds_agent)
-
-    ds_agent_output = await agent_tool.run_async(
-        args={"request": question_with_data}, tool_context=tool_context
-    )
+    cache_key = analysis_cache.cache_key(question, fingerprint)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        progress.publish(
+            "analysis_cached", question=question, artifacts=len(cached.artifacts))
+        for artifact in cached.artifacts:
+            await tool_context.save_artifact(
+                artifact.name,
+                types.Part.from_bytes(data=artifact.data, mime_type=artifact.mime_type),
+            )
+        ds_agent_output = cached.output
+    else:
+        progress.publish("analytics_agent", question=question)
+        agent_tool = AgentTool(agent=ds_agent)
+
+        # AgentTool forwards the artifacts of the run with save_artifact, which
+        # records their versions in the artifact delta of this call; a name is
+        # also saved again when it already existed, e.g. plot.png.
+        saved_before = dict(tool_context.actions.artifact_delta)
+        with analysis_cache.recording() as runs:
+            ds_agent_output = await agent_tool.run_async(
+                args={"request": question_with_data}, tool_context=tool_context
+            )
+        artifacts = []
+        for name, version in tool_context.actions.artifact_delta.items():
+            if saved_before.get(name) == version:
+                continue
+            part = await tool_context.load_artifact(name, version=version)
+            if part is not None and part.inline_data is not None:
+                artifacts.append(analysis_cache.CachedArtifact(
+                    name=name,
+                    mime_type=part.inline_data.mime_type,
+                    data=part.inline_data.data,
+                ))
+        analysis_cache.put(
+            cache_key,
+            analysis_cache.AnalysisEntry(
+                output=ds_agent_output, runs=runs, artifacts=artifacts),
+        )
     tool_context.state["ds_agent_output"] = ds_agent_output
+    await state_compaction.offload_state_value(tool_context, "ds_agent_output")
     return ds_agent_output
+
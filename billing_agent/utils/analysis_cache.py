@@ -0,0 +1,177 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Replays analyses of the analytics agent for repeated requests.
+
+Dashboards and returning users ask for the same analysis ("plot the monthly
+trend") of the same query result again and again, and every time the
+analytics agent generates the code, runs it and summarizes the output.
+`call_ds_agent` caches the outcome of an analysis under the normalized request
+and a fingerprint of its data:
+
+    key = analysis_cache.cache_key(question, fingerprint)
+    entry = analysis_cache.get(key)
+
+An entry holds the answer of the agent, the code it ran with its output
+(recorded by the code executors with `record_execution` while `recording` is
+active) and the artifacts it saved, e.g. charts, which are saved again when the
+entry is replayed. Analyses whose last code block failed are not cached.
+
+The cache is per process and bounded by `ANALYSIS_CACHE_SIZE` entries (default
+256) and `ANALYSIS_CACHE_TTL_SECONDS` (default one hour); set the size to 0 to
+turn it off.
+"""
+
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from .single_flight import normalize_question
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", 256))
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", 3600))
+# Entries with more artifact bytes than this are not cached.
+MAX_ARTIFACT_BYTES = 10 * 1024 * 1024
+
+# Lookups and stores, e.g. "hit", "miss", "stored" or "skipped_error".
+ANALYSIS_CACHE_STATS: collections.Counter = collections.Counter()
+
+
+@dataclasses.dataclass
+class CodeRun:
+    """A code block the agent ran and its output."""
+
+    code: str
+    stdout: str
+    stderr: str
+
+
+@dataclasses.dataclass
+class CachedArtifact:
+    """An artifact the agent saved, e.g. a chart."""
+
+    name: str
+    mime_type: str
+    data: bytes
+
+
+@dataclasses.dataclass
+class AnalysisEntry:
+    """The outcome of an analysis.
+
+    Attributes:
+        output: The answer of the analytics agent.
+        runs: The code the agent ran, in order.
+        artifacts: The artifacts the agent saved.
+        created: When the entry was stored, in `time.monotonic()` seconds.
+    """
+
+    output: Any
+    runs: list[CodeRun] = dataclasses.field(default_factory=list)
+    artifacts: list[CachedArtifact] = dataclasses.field(default_factory=list)
+    created: float = dataclasses.field(default_factory=time.monotonic)
+
+
+_lock = threading.Lock()
+_entries: collections.OrderedDict[tuple, AnalysisEntry] = collections.OrderedDict()
+_recording: contextvars.ContextVar[Optional[list[CodeRun]]] = (
+    contextvars.ContextVar("analysis_recording", default=None)
+)
+
+
+def fingerprint_rows(rows: Any) -> str:
+    """Returns a fingerprint of query result rows without an Arrow file."""
+    serialized = json.dumps(rows, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:32]
+
+
+def cache_key(question: str, fingerprint: str) -> tuple:
+    """Returns the key of an analysis request on some data."""
+    return (normalize_question(question), fingerprint)
+
+
+def get(key: tuple) -> Optional[AnalysisEntry]:
+    """Returns the cached analysis of a key, or None."""
+    if ANALYSIS_CACHE_SIZE <= 0:
+        return None
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and (
+            time.monotonic() - entry.created > ANALYSIS_CACHE_TTL_SECONDS
+        ):
+            del _entries[key]
+            entry = None
+        if entry is None:
+            ANALYSIS_CACHE_STATS["miss"] += 1
+            return None
+        _entries.move_to_end(key)
+        ANALYSIS_CACHE_STATS["hit"] += 1
+        return entry
+
+
+def put(key: tuple, entry: AnalysisEntry) -> bool:
+    """Caches an analysis unless it failed or is too large.
+
+    Returns:
+        bool: Whether the entry was stored.
+    """
+    if ANALYSIS_CACHE_SIZE <= 0:
+        return False
+    if not entry.output or (entry.runs and entry.runs[-1].stderr):
+        ANALYSIS_CACHE_STATS["skipped_error"] += 1
+        return False
+    if sum(len(a.data) for a in entry.artifacts) > MAX_ARTIFACT_BYTES:
+        ANALYSIS_CACHE_STATS["skipped_size"] += 1
+        return False
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > ANALYSIS_CACHE_SIZE:
+            _entries.popitem(last=False)
+    ANALYSIS_CACHE_STATS["stored"] += 1
+    return True
+
+
+@contextlib.contextmanager
+def recording() -> Iterator[list[CodeRun]]:
+    """Collects the code blocks run in the current context."""
+    runs: list[CodeRun] = []
+    token = _recording.set(runs)
+    try:
+        yield runs
+    finally:
+        _recording.reset(token)
+
+
+def record_execution(code: str, stdout: str, stderr: str) -> None:
+    """Records a code block run by a code executor, if `recording` is active."""
+    runs = _recording.get()
+    if runs is not None:
+        runs.append(CodeRun(code=code, stdout=stdout, stderr=stderr))
+
+
+def clear() -> None:
+    """Removes all entries."""
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,159 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hands query results to the local code kernels as Arrow files.
+
+`call_ds_agent` used to paste the rows of the last query into the prompt of
+the analytics agent, which then parsed them back into a DataFrame, so a
+result was capped at `MAX_NUM_ROWS` rows and every row cost tokens. With the
+local code executor, `run_bigquery_validation` writes the whole result once
+as an Arrow IPC file instead:
+
+    ref = arrow_results.write_table(query_job.result().to_arrow())
+    # {"path": ".../3f2a....arrow", "fingerprint": "3f2a...",
+    #  "num_rows": 5120, "columns": {"service": "string", "cost": "double"}}
+
+and keeps the small reference in session state (`query_result_data`). The
+kernel memory-maps the file and loads it as the DataFrame `df` (see
+`code_kernel`), and the prompt only describes its columns.
+
+Files go to `RESULT_DATA_DIR`, by default a directory in shared memory
+(`/dev/shm`) where available, and are named by the hash of their content, so
+identical results are stored once. Files older than `RESULT_DATA_TTL_SECONDS`
+(default one day) are deleted as new results are written.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_SHARED_MEMORY_DIR = "/dev/shm"
+RESULT_DATA_DIR = os.getenv(
+    "RESULT_DATA_DIR",
+    os.path.join(
+        _SHARED_MEMORY_DIR
+        if os.path.isdir(_SHARED_MEMORY_DIR)
+        else tempfile.gettempdir(),
+        "billing_agent_results",
+    ),
+)
+RESULT_DATA_TTL_SECONDS = float(os.getenv("RESULT_DATA_TTL_SECONDS", 24 * 3600))
+# The rows a query may return for analysis; the prompt still gets at most
+# `MAX_NUM_ROWS` of them.
+MAX_DATA_ROWS = int(os.getenv("MAX_DATA_ROWS", 100000))
+
+# The session state key of the reference to the last query result.
+STATE_KEY = "query_result_data"
+
+_PRUNE_INTERVAL_SECONDS = 600
+_last_prune = 0.0
+
+
+def is_enabled() -> bool:
+    """Returns True if query results are shared with local code kernels.
+
+    Only the local code executor can read the files; with the Vertex AI code
+    executor the rows are still sent in the prompt.
+    """
+    if os.getenv("CODE_EXECUTOR", "vertex").lower() != "local":
+        return False
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def rows_to_table(rows: list[dict[str, Any]]):
+    """Returns rows as a `pyarrow.Table`."""
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    return pa.Table.from_pylist(rows)
+
+
+def write_table(table) -> dict[str, Any]:
+    """Writes a table as an Arrow IPC file in `RESULT_DATA_DIR`.
+
+    Args:
+        table (pyarrow.Table): The query result.
+
+    Returns:
+        dict: A reference to the file: its path, the fingerprint of its
+        content, the number of rows and the type of each column.
+    """
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(RESULT_DATA_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=RESULT_DATA_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(temp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        digest = hashlib.sha256()
+        with pa.memory_map(temp_path) as source:
+            digest.update(source.read_buffer())
+        fingerprint = digest.hexdigest()[:32]
+        path = os.path.join(RESULT_DATA_DIR, f"{fingerprint}.arrow")
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _maybe_prune()
+    return {
+        "path": path,
+        "fingerprint": fingerprint,
+        "num_rows": table.num_rows,
+        "columns": {field.name: str(field.type) for field in table.schema},
+    }
+
+
+def is_available(ref: Optional[dict[str, Any]]) -> bool:
+    """Returns True if a reference points to an existing file."""
+    return bool(ref) and os.path.exists(ref.get("path", ""))
+
+
+def read_frame(ref: dict[str, Any]):
+    """Returns a referenced table as a `pandas.DataFrame`."""
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    with pa.memory_map(ref["path"]) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def describe(ref: dict[str, Any]) -> str:
+    """Describes the columns of a referenced table for a prompt."""
+    return "\n".join(
+        f"  - {name}: {column_type}" for name, column_type in ref["columns"].items()
+    )
+
+
+def _maybe_prune() -> None:
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < _PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = now
+    for entry in os.scandir(RESULT_DATA_DIR):
+        try:
+            if now - entry.stat().st_mtime > RESULT_DATA_TTL_SECONDS:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,285 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lazily created, shared model and BigQuery clients.
+
+Importing the agents used to build every client up front: a `genai.Client`,
+one `LiteLlm` per agent (importing LiteLLM takes seconds), `aiplatform.init`
+/ `vertexai.init` and a Vertex code interpreter extension, which is created
+over the network. The registry builds each client on first use instead, and
+returns the same instance for the same configuration:
+
+- `litellm_model()`: the LiteLLM proxy model of the agents. LiteLLM is only
+  imported when the model is first called.
+- `genai_client()`, `bigquery_client()`: Gemini and BigQuery clients.
+- `init_vertexai()`: initializes the Vertex AI SDK once per project/location.
+- `vertex_code_executor()`: a code executor that creates its Vertex code
+  interpreter extension when it first runs code.
+- `code_executor()`: the code executor selected by `CODE_EXECUTOR`, "vertex"
+  (the default) or "local" (see `local_code_executor`).
+
+The LiteLLM proxy is set with `LITELLM_PROXY_MODEL`, `LITELLM_PROXY_URL` and
+`LITELLM_API_KEY`; the key is required, and the models fail on first use
+without it.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+from typing import Any, AsyncGenerator, Optional
+
+from google.adk.code_executors import BaseCodeExecutor
+from google.adk.code_executors.code_execution_utils import (
+    CodeExecutionInput,
+    CodeExecutionResult,
+)
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from pydantic import PrivateAttr
+
+from . import analysis_cache
+
+logger = logging.getLogger(__name__)
+
+LITELLM_PROXY_MODEL = os.getenv(
+    "LITELLM_PROXY_MODEL", "litellm_proxy/gemini-2.5-pro")
+LITELLM_PROXY_URL = os.getenv(
+    "LITELLM_PROXY_URL",
+    "https://litellm-cloudrun-668429440317.us-central1.run.app",
+)
+# Required by the LiteLLM proxy models; there is no default.
+LITELLM_API_KEY = os.getenv("LITELLM_API_KEY")
+
+_lock = threading.RLock()
+_clients: dict[tuple, Any] = {}
+
+
+def _get_or_create(key: tuple, factory) -> Any:
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.debug("Creating client %s", key[0])
+            client = _clients[key] = factory()
+        return client
+
+
+class LazyLiteLlm(BaseLlm):
+    """`LiteLlm` that imports LiteLLM and builds the model on first use."""
+
+    _options: dict = PrivateAttr(default_factory=dict)
+    _llm: Optional[BaseLlm] = PrivateAttr(default=None)
+
+    def __init__(self, model: str, **options: Any):
+        super().__init__(model=model)
+        self._options = options
+
+    @property
+    def llm(self) -> BaseLlm:
+        """The wrapped `LiteLlm`, created on first access."""
+        with _lock:
+            if self._llm is None:
+                from google.adk.models.lite_llm import LiteLlm
+
+                if "api_key" in self._options and not self._options["api_key"]:
+                    raise ValueError(
+                        f"No API key for the LiteLLM model {self.model}; set"
+                        " LITELLM_API_KEY."
+                    )
+                self._llm = LiteLlm(model=self.model, **self._options)
+            return self._llm
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        if stream:
+            async for response in self._stream_in_thread(llm_request):
+                yield response
+            return
+        async for response in self.llm.generate_content_async(
+            llm_request, stream=False
+        ):
+            yield response
+
+    async def _stream_in_thread(
+        self, llm_request: LlmRequest
+    ) -> AsyncGenerator[LlmResponse, None]:
+        # LiteLlm streams with the synchronous LiteLLM client, which blocks
+        # the event loop until the whole response has arrived. Run it on a
+        # loop of its own in a thread and hand each chunk over as it arrives.
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        async def drain():
+            async for response in self.llm.generate_content_async(
+                llm_request, stream=True
+            ):
+                loop.call_soon_threadsafe(queue.put_nowait, response)
+
+        def run():
+            try:
+                asyncio.run(drain())
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        thread = loop.run_in_executor(None, contextvars.copy_context().run, run)
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await thread
+
+    def connect(self, llm_request: LlmRequest):
+        return self.llm.connect(llm_request)
+
+
+def litellm_model(
+    model: str = LITELLM_PROXY_MODEL,
+    api_base: str = LITELLM_PROXY_URL,
+    api_key: Optional[str] = LITELLM_API_KEY,
+    **options: Any,
+) -> LazyLiteLlm:
+    """Returns the shared LiteLLM model for a configuration.
+
+    Args:
+        model (str): The LiteLLM model name.
+        api_base (str): The base URL of the LiteLLM proxy.
+        api_key (str): The API key of the proxy. The model raises a
+          `ValueError` on first use if it is not set.
+        **options: Other `LiteLlm` options, e.g. `extra_headers`.
+
+    Returns:
+        LazyLiteLlm: The model, shared by every agent with the same
+        configuration.
+    """
+    key = ("litellm", model, api_base, api_key, repr(sorted(options.items())))
+    return _get_or_create(
+        key,
+        lambda: LazyLiteLlm(
+            model=model, api_base=api_base, api_key=api_key, **options
+        ),
+    )
+
+
+def genai_client(
+    project: Optional[str] = None,
+    location: Optional[str] = None,
+    vertexai: bool = True,
+):
+    """Returns the shared `google.genai.Client` for a project and location."""
+
+    def create():
+        from google import genai
+
+        return genai.Client(vertexai=vertexai, project=project, location=location)
+
+    return _get_or_create(("genai", project, location, vertexai), create)
+
+
+def bigquery_client(project: Optional[str] = None):
+    """Returns the shared `bigquery.Client` of a project."""
+
+    def create():
+        from google.cloud import bigquery
+
+        logger.info("Initializing BigQuery client with project ID: %s", project)
+        return bigquery.Client(project=project)
+
+    return _get_or_create(("bigquery", project), create)
+
+
+def init_vertexai(
+    project: Optional[str] = None, location: Optional[str] = None
+) -> None:
+    """Initializes the Vertex AI SDK once per project and location."""
+
+    def create():
+        import vertexai
+        from google.cloud import aiplatform
+
+        aiplatform.init(project=project, location=location)
+        vertexai.init(project=project, location=location)
+        return True
+
+    _get_or_create(("vertexai", project, location), create)
+
+
+class LazyVertexAiCodeExecutor(BaseCodeExecutor):
+    """`VertexAiCodeExecutor` that creates its extension on first use.
+
+    Attributes:
+        resource_name: The code interpreter extension to use; a new one is
+          created if not set (see `VertexAiCodeExecutor`).
+    """
+
+    resource_name: Optional[str] = None
+
+    _executor: Optional[BaseCodeExecutor] = PrivateAttr(default=None)
+
+    @property
+    def executor(self) -> BaseCodeExecutor:
+        """The wrapped `VertexAiCodeExecutor`, created on first access."""
+        with _lock:
+            if self._executor is None:
+                from google.adk.code_executors import VertexAiCodeExecutor
+
+                self._executor = VertexAiCodeExecutor(
+                    resource_name=self.resource_name,
+                    **self.model_dump(exclude={"resource_name"}),
+                )
+            return self._executor
+
+    def execute_code(
+        self,
+        invocation_context,
+        code_execution_input: CodeExecutionInput,
+    ) -> CodeExecutionResult:
+        result = self.executor.execute_code(invocation_context, code_execution_input)
+        analysis_cache.record_execution(
+            code_execution_input.code, result.stdout, result.stderr)
+        return result
+
+
+def vertex_code_executor(**options: Any) -> LazyVertexAiCodeExecutor:
+    """Returns a Vertex AI code executor that is created on first use.
+
+    Args:
+        **options: `VertexAiCodeExecutor` options, e.g. `stateful`.
+
+    Returns:
+        LazyVertexAiCodeExecutor: The code executor.
+    """
+    return LazyVertexAiCodeExecutor(**options)
+
+
+def code_executor(**options: Any) -> BaseCodeExecutor:
+    """Returns the code executor selected by `CODE_EXECUTOR`.
+
+    Args:
+        **options: Code executor options, e.g. `stateful`.
+
+    Returns:
+        BaseCodeExecutor: A `LocalCodeExecutor` if `CODE_EXECUTOR` is "local",
+        otherwise a Vertex AI code executor.
+    """
+    if os.getenv("CODE_EXECUTOR", "vertex").lower() == "local":
+        from .local_code_executor import LocalCodeExecutor
+
+        return LocalCodeExecutor(**options)
+    return vertex_code_executor(**options)
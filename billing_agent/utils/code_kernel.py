@@ -0,0 +1,267 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A Python kernel process of `LocalCodeExecutor`.
+
+The executor starts this file as a script (not as a module of the package,
+so the kernel does not import the agents) with the working directory and the
+resource limits as arguments. The kernel applies the limits, preloads pandas,
+NumPy and matplotlib and then runs code cells read from stdin, one JSON
+message per line:
+
+    {"code": "...", "files": [{"name": "data.csv", "content": "<base64>"}],
+     "data": {"df": "/dev/shm/billing_agent_results/3f2a....arrow"}}
+
+and answers each with
+
+    {"stdout": "...", "stderr": "...",
+     "files": [{"name": "plot_20250101_120000_0_1.png", "content": "<base64>",
+                "mime_type": "image/png"}],
+     "max_rss_mb": 312.5}
+
+Variables persist between cells, like in a notebook; the value of a final
+expression is printed. Arrow IPC files in "data" (see `arrow_results`) are
+memory-mapped and loaded as DataFrames of the given names, unless the same
+file was loaded before. Input files are written to the working directory,
+and files that a cell creates or changes there, as well as open matplotlib
+figures, are returned, along with the peak memory of the kernel. The kernel
+exits when stdin is closed.
+
+Only the standard library is imported at the top, so the kernel can start
+before the data libraries are loaded.
+"""
+
+import argparse
+import ast
+import base64
+import contextlib
+import io
+import json
+import mimetypes
+import os
+import sys
+import time
+import traceback
+
+# Output files larger than this are not returned.
+MAX_OUTPUT_FILE_BYTES = 20 * 1024 * 1024
+
+_PRELUDE = '''
+import io
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    pass
+
+try:
+    import scipy
+except ImportError:
+    pass
+
+
+def crop(s: str, max_chars: int = 64) -> str:
+    """Crops a string to max_chars characters."""
+    return s[: max_chars - 3] + "..." if len(s) > max_chars else s
+
+
+def explore_df(df: pd.DataFrame) -> None:
+    """Prints some information about a pandas DataFrame."""
+    with pd.option_context(
+        "display.max_columns", None, "display.expand_frame_repr", False
+    ):
+        df_nulls = (len(df) - df.isnull().sum()).apply(
+            lambda x: f"{x} / {df.shape[0]} non-null"
+        )
+        df_info = pd.concat(
+            (
+                df.dtypes.rename("Dtype"),
+                df_nulls.rename("Non-Null Count"),
+                df.apply(lambda x: len(x.unique())).rename("Unique Values Count"),
+                df.apply(lambda x: crop(str(list(x.unique())))).rename(
+                    "Unique Values"),
+            ),
+            axis=1,
+        )
+        df_info.index.name = "Columns"
+        print(f"""Total rows: {df.shape[0]}
+Total columns: {df.shape[1]}
+
+{df_info}""")
+'''
+
+
+def _set_limits(memory_mb: int, file_mb: int) -> None:
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:  # Not available on Windows.
+        return
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if file_mb:
+        limit = file_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limit, limit))
+
+
+def _max_rss_mb() -> float:
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return 0.0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _snapshot() -> dict[str, tuple[int, int]]:
+    files = {}
+    for entry in os.scandir("."):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def _write_inputs(files: list[dict]) -> None:
+    for file in files:
+        name = os.path.basename(file["name"])
+        try:
+            content = base64.b64decode(file["content"], validate=True)
+        except ValueError:
+            content = file["content"].encode("utf-8")
+        with open(name, "wb") as f:
+            f.write(content)
+
+
+def _output_file(name: str, content: bytes, mime_type: str = "") -> dict:
+    return {
+        "name": name,
+        "content": base64.b64encode(content).decode("ascii"),
+        "mime_type": mime_type or mimetypes.guess_type(name)[0] or "text/plain",
+    }
+
+
+def _figures(cell: int) -> list[dict]:
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is None:
+        return []
+    # Named like the plots of the Vertex code interpreter, unique per run so
+    # they do not replace earlier artifacts.
+    prefix = f"plot_{time.strftime('%Y%m%d_%H%M%S')}_{cell}"
+    files = []
+    for number in plt.get_fignums():
+        buffer = io.BytesIO()
+        plt.figure(number).savefig(buffer, format="png", bbox_inches="tight")
+        files.append(_output_file(
+            f"{prefix}_{number}.png", buffer.getvalue(), "image/png"))
+    plt.close("all")
+    return files
+
+
+def _load_data(data: dict[str, str], namespace: dict, loaded: dict) -> None:
+    """Loads Arrow IPC files as DataFrames, each once."""
+    for name, path in data.items():
+        if loaded.get(name) == path:
+            continue
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        # Reading a memory-mapped file does not copy it; the DataFrame gets
+        # its own copy, so the code can change it.
+        namespace[name] = pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas()
+        loaded[name] = path
+
+
+def _execute(code: str, namespace: dict) -> None:
+    """Runs a cell and prints the value of a final expression."""
+    tree = ast.parse(code, "<cell>", "exec")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+    exec(compile(tree, "<cell>", "exec"), namespace)  # pylint: disable=exec-used
+    if last is not None:
+        value = eval(compile(last, "<cell>", "eval"), namespace)  # pylint: disable=eval-used
+        if value is not None:
+            print(repr(value))
+
+
+def _run_cell(message: dict, namespace: dict, loaded: dict, cell: int) -> dict:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    _write_inputs(message.get("files") or [])
+    before = _snapshot()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            _load_data(message.get("data") or {}, namespace, loaded)
+            _execute(message["code"], namespace)
+        except BaseException:  # pylint: disable=broad-exception-caught
+            # Hide the frames of the kernel itself.
+            error_type, error, tb = sys.exc_info()
+            while tb is not None and tb.tb_frame.f_code.co_filename != "<cell>":
+                tb = tb.tb_next
+            stderr.write("".join(traceback.format_exception(error_type, error, tb)))
+
+    files = _figures(cell)
+    for name, stamp in _snapshot().items():
+        if before.get(name) == stamp or stamp[1] > MAX_OUTPUT_FILE_BYTES:
+            continue
+        with open(name, "rb") as f:
+            files.append(_output_file(name, f.read()))
+    return {
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "files": files,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--memory-mb", type=int, default=0)
+    parser.add_argument("--file-mb", type=int, default=0)
+    args = parser.parse_args()
+
+    # Answers go to the original stdout; anything written to the file
+    # descriptors by native code goes to stderr instead of the protocol.
+    channel = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    # Cells that read input get an empty stdin instead of the messages.
+    requests, sys.stdin = sys.stdin, io.StringIO()
+
+    os.chdir(args.workdir)
+    _set_limits(args.memory_mb, args.file_mb)
+    namespace: dict = {"__name__": "__main__"}
+    loaded: dict[str, str] = {}
+    exec(_PRELUDE, namespace)  # pylint: disable=exec-used
+    channel.write(json.dumps({"ready": True}) + "\n")
+    channel.flush()
+
+    for cell, line in enumerate(requests):
+        if not line.strip():
+            continue
+        answer = _run_cell(json.loads(line), namespace, loaded, cell)
+        channel.write(json.dumps(answer) + "\n")
+        channel.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Conversation history compression for long-running agent sessions.
+
+ADK sends the whole session history to the model on every turn. Once the
+history of a request is estimated to exceed `max_history_tokens`, the older
+turns are replaced by a compact summary: the question, the tools called and a
+cut-down answer of each turn, followed by references to the SQL and results of
+earlier turns recorded in the `turn_history` state (see `state_compaction`).
+The last `keep_recent_turns` turns are always sent in full.
+
+Use it as the `before_model_callback` of an agent:
+
+    before_model_callback=history_compression.before_model_callback(
+        HistoryCompressionConfig(max_history_tokens=16000)
+    )
+
+By default the summary is extractive and costs no model call. A
+`summarizer` (text in, summary out) can be configured to have a model
+condense it further.
+"""
+
+import dataclasses
+import json
+import logging
+from typing import Any, Callable, Optional
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio, good enough to decide when to compress.
+CHARS_PER_TOKEN = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class HistoryCompressionConfig:
+    """Per-agent settings of history compression.
+
+    Attributes:
+        max_history_tokens: Estimated size of the history above which older
+          turns are summarized.
+        keep_recent_turns: Number of most recent turns that are never
+          summarized, including the current one.
+        max_summary_turns: Maximum number of older turns listed in the
+          summary; turns before them are only counted, so the summary stops
+          growing.
+        max_turn_chars: Maximum length of each text kept in a turn summary.
+        summarizer: Optional function that condenses the extractive summary,
+          e.g. with a small model.
+    """
+
+    max_history_tokens: int = 16000
+    keep_recent_turns: int = 3
+    max_summary_turns: int = 20
+    max_turn_chars: int = 200
+    summarizer: Optional[Callable[[str], str]] = None
+
+
+def _part_size(part: types.Part) -> int:
+    if part.text:
+        return len(part.text)
+    if part.function_call:
+        return len(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        return len(json.dumps(part.function_response.response or {}, default=str))
+    return 0
+
+
+def estimate_tokens(contents: list[types.Content]) -> int:
+    """Estimates the number of tokens of a list of contents."""
+    chars = sum(
+        _part_size(part) for content in contents for part in content.parts or []
+    )
+    return chars // CHARS_PER_TOKEN
+
+
+def _starts_turn(content: types.Content) -> bool:
+    # A user message; function responses also have the user role.
+    return content.role == "user" and any(
+        part.text for part in content.parts or []
+    )
+
+
+def split_turns(contents: list[types.Content]) -> list[list[types.Content]]:
+    """Splits contents into turns, each starting with a user message."""
+    turns: list[list[types.Content]] = []
+    for content in contents:
+        if _starts_turn(content) or not turns:
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _cut(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else f"{text[:max_chars]}..."
+
+
+def summarize_turn(turn: list[types.Content], max_chars: int) -> str:
+    """Returns a one-line extractive summary of a turn."""
+    question, answer, calls = "", "", []
+    for content in turn:
+        for part in content.parts or []:
+            if part.function_call:
+                calls.append(part.function_call.name)
+            elif part.text and content.role == "user" and not question:
+                question = part.text
+            elif part.text and content.role == "model":
+                answer = part.text
+    summary = f"User: {_cut(question, max_chars)}"
+    if calls:
+        summary += f" | Tools: {', '.join(calls)}"
+    if answer:
+        summary += f" | Answer: {_cut(answer, max_chars)}"
+    return summary
+
+
+def _references(state: Any, max_chars: int) -> list[str]:
+    references = []
+    for entry in (state.get("turn_history") if state else None) or []:
+        result = entry.get("query_result") or {}
+        line = f"- {_cut(entry.get('question') or '', max_chars)}"
+        if entry.get("sql"):
+            line += f" | SQL: {_cut(entry['sql'], max_chars * 2)}"
+        if result.get("artifact_ref"):
+            line += f" | Result: artifact {result['artifact_ref']}"
+            if "rows" in result:
+                line += f" ({result['rows']} rows)"
+        references.append(line)
+    return references
+
+
+def compress_history(
+    llm_request: Any, config: HistoryCompressionConfig, state: Any = None
+) -> bool:
+    """Replaces the older turns of a model request with a summary.
+
+    Args:
+        llm_request: The `LlmRequest` about to be sent to the model.
+        config: The compression settings of the agent.
+        state: The session state, for references to earlier SQL and results.
+
+    Returns:
+        True if the history was compressed.
+    """
+    contents = llm_request.contents or []
+    if estimate_tokens(contents) <= config.max_history_tokens:
+        return False
+    turns = split_turns(contents)
+    if len(turns) <= config.keep_recent_turns:
+        return False
+    old_turns = turns[: -config.keep_recent_turns]
+    recent_turns = turns[-config.keep_recent_turns :]
+
+    lines = ["Summary of the earlier conversation (older turns were compacted):"]
+    omitted = max(0, len(old_turns) - config.max_summary_turns)
+    if omitted:
+        lines.append(f"({omitted} earlier turns omitted)")
+    lines += [
+        f"Turn {i}: {summarize_turn(turn, config.max_turn_chars)}"
+        for i, turn in enumerate(old_turns[omitted:], start=omitted + 1)
+    ]
+    references = _references(state, config.max_turn_chars)
+    if references:
+        lines += ["Earlier questions, SQL and results:", *references]
+    summary = "\n".join(lines)
+    if config.summarizer:
+        try:
+            summary = config.summarizer(summary)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("History summarizer failed, using extract")
+
+    # Prepend the summary to the first kept user message, so user and model
+    # messages still alternate.
+    first = recent_turns[0][0]
+    recent_turns[0][0] = types.Content(
+        role=first.role,
+        parts=[types.Part.from_text(text=summary), *(first.parts or [])],
+    )
+    llm_request.contents = [content for turn in recent_turns for content in turn]
+    logger.debug(
+        "Compressed %d turns of history to %d tokens",
+        len(old_turns),
+        estimate_tokens(llm_request.contents),
+    )
+    return True
+
+
+def before_model_callback(config: HistoryCompressionConfig) -> Callable:
+    """Returns an agent `before_model_callback` that compresses history.
+
+    Args:
+        config: The compression settings of the agent.
+
+    Returns:
+        The callback. It never skips the model call.
+    """
+
+    def callback(callback_context, llm_request):
+        compress_history(llm_request, config, callback_context.state)
+        return None
+
+    return callback
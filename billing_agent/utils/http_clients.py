@@ -0,0 +1,145 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide HTTP clients with connection pooling and keep-alive.
+
+Every LiteLLM proxy call and web fetch used to open a new connection, paying
+the TCP and TLS handshakes each time. The clients here are created once per
+process (the async client once per event loop) and reuse their connections:
+
+- `get_client()`: the shared `httpx.Client`, e.g. for `fetch_web_content`.
+- `get_async_client()`: the shared `httpx.AsyncClient` of the running loop.
+- `install_litellm_clients()`: makes LiteLLM, and so every `LiteLlm` model of
+  the process, send its requests through the shared clients.
+
+HTTP/2 is used when the `h2` package is installed. The pool and timeouts are
+set with `HTTP_MAX_CONNECTIONS` (default 100), `HTTP_MAX_KEEPALIVE` (default
+20), `HTTP_KEEPALIVE_EXPIRY` (seconds, default 60), `HTTP_CONNECT_TIMEOUT`
+(seconds, default 5) and `HTTP_TIMEOUT` (seconds, default 120, the model
+calls of the proxy can be slow). Set `HTTP2=false` to force HTTP/1.1.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+# Async clients by event loop.
+_async_clients = weakref.WeakKeyDictionary()
+# Async client used outside of an event loop, e.g. when installed at import.
+_default_async_client: Optional[httpx.AsyncClient] = None
+
+
+def http2_enabled() -> bool:
+    """Returns True if the clients negotiate HTTP/2."""
+    if os.getenv("HTTP2", "true").lower() != "true":
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def client_options() -> dict:
+    """Returns the options the shared clients are created with."""
+    return {
+        "http2": http2_enabled(),
+        "follow_redirects": True,
+        "limits": httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60)),
+        ),
+        "timeout": httpx.Timeout(
+            float(os.getenv("HTTP_TIMEOUT", 120)),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+        ),
+    }
+
+
+def get_client() -> httpx.Client:
+    """Returns the process-wide synchronous HTTP client."""
+    global _client
+    with _lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(**client_options())
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the shared asynchronous HTTP client of the running event loop.
+
+    Connections of an async client belong to the loop they were opened on, so
+    each loop gets its own client.
+    """
+    global _default_async_client
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _lock:
+        if loop is None:
+            if _default_async_client is None or _default_async_client.is_closed:
+                _default_async_client = httpx.AsyncClient(**client_options())
+            return _default_async_client
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = _async_clients[loop] = httpx.AsyncClient(**client_options())
+        return client
+
+
+def install_litellm_clients() -> None:
+    """Routes the requests of LiteLLM through the shared clients.
+
+    Call it from the event loop that serves the agents, e.g. at server
+    startup, so the async client belongs to that loop.
+    """
+    import litellm
+
+    litellm.client_session = get_client()
+    litellm.aclient_session = get_async_client()
+    logger.info(
+        "LiteLLM uses the shared HTTP clients (http2=%s)", http2_enabled()
+    )
+
+
+async def close_clients() -> None:
+    """Closes the shared clients of the process, e.g. at shutdown."""
+    global _client, _default_async_client
+    with _lock:
+        client, _client = _client, None
+        async_clients = list(_async_clients.values())
+        _async_clients.clear()
+        if _default_async_client is not None:
+            async_clients.append(_default_async_client)
+            _default_async_client = None
+    litellm = sys.modules.get("litellm")
+    if litellm is not None and litellm.client_session is client:
+        litellm.client_session = None
+        litellm.aclient_session = None
+    if client is not None:
+        client.close()
+    for async_client in async_clients:
+        try:
+            await async_client.aclose()
+        except RuntimeError:
+            # Opened on another, already closed, event loop.
+            pass
@@ -0,0 +1,513 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the code of the analytics agents in local Python kernels.
+
+`VertexAiCodeExecutor` sends every code block, and the data files with it, to
+a Vertex code interpreter extension, so each analysis step is a network round
+trip of seconds. `LocalCodeExecutor` is a drop-in replacement that runs the
+code in a Python process on the same machine (see `code_kernel`):
+
+- Stateful executors keep one kernel per session (the execution ID that ADK
+  passes), so variables and loaded data persist between steps. Stateless
+  executors run every block in a fresh kernel.
+- A `KernelPool` keeps kernels started ahead of use with pandas, NumPy and
+  matplotlib loaded, so the first step of a session does not wait for the
+  imports. It stops the kernels of idle sessions and kernels whose memory
+  grew past a high-water mark, and counts its work in `KERNEL_POOL_STATS`.
+- The last query result of the session (see `arrow_results`) is loaded in
+  the kernel as the DataFrame `df`, straight from its Arrow file.
+- Each kernel runs in its own working directory with a limit on its memory
+  and the size of files it writes, and with an environment without the
+  credentials of the server. A block that runs longer than the timeout kills
+  its kernel; the session starts over with a fresh one.
+
+The kernels isolate the server from crashes and runaway memory of the
+generated code, not from malicious code: they run as the same user with
+network access. Run the server in a sandbox (e.g. gVisor on Cloud Run) if that
+matters.
+
+Select the executor with `CODE_EXECUTOR=local` (see
+`client_registry.code_executor`).
+"""
+
+import atexit
+import collections
+import json
+import logging
+import os
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Optional
+
+from google.adk.code_executors import BaseCodeExecutor
+from google.adk.code_executors.code_execution_utils import (
+    CodeExecutionInput,
+    CodeExecutionResult,
+    File,
+)
+from pydantic import PrivateAttr
+
+from . import analysis_cache, arrow_results, tracing
+from .structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+_KERNEL_SCRIPT = os.path.join(os.path.dirname(__file__), "code_kernel.py")
+
+# Environment variables passed on to the kernels; the others, e.g. API keys
+# and credentials, are not.
+_KERNEL_ENV = ("PATH", "LANG", "LC_ALL", "TZ", "VIRTUAL_ENV", "PYTHONPATH")
+
+# Kernel assignments and recycling of all pools, e.g. "assigned_warm" or
+# "recycled_idle".
+KERNEL_POOL_STATS: collections.Counter = collections.Counter()
+
+
+class KernelError(Exception):
+    """A kernel died, timed out or sent an invalid answer."""
+
+
+class Kernel:
+    """A `code_kernel` process and its working directory.
+
+    Attributes:
+        workdir: The working directory of the kernel.
+        process: The kernel process.
+        last_used: When the kernel was last assigned or finished a block, in
+          `time.monotonic()` seconds.
+        peak_rss_mb: The peak memory of the kernel after its last block.
+        lock: Held while the kernel runs a block.
+    """
+
+    def __init__(self, memory_limit_mb: int, file_limit_mb: int):
+        self.workdir = tempfile.mkdtemp(prefix="code_kernel_")
+        env = {key: os.environ[key] for key in _KERNEL_ENV if key in os.environ}
+        env.update(
+            HOME=self.workdir,
+            MPLBACKEND="Agg",
+            MPLCONFIGDIR=self.workdir,
+            # Thread pools of the numeric libraries reserve address space
+            # per thread, which counts against the memory limit.
+            OPENBLAS_NUM_THREADS="1",
+            OMP_NUM_THREADS="1",
+        )
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                _KERNEL_SCRIPT,
+                f"--workdir={self.workdir}",
+                f"--memory-mb={memory_limit_mb}",
+                f"--file-mb={file_limit_mb}",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.workdir,
+            env=env,
+        )
+        self._buffer = b""
+        self._ready = False
+        self.last_used = time.monotonic()
+        self.peak_rss_mb = 0.0
+        self.lock = threading.Lock()
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def is_ready(self) -> bool:
+        """Returns True if the kernel has loaded its libraries, without waiting."""
+        if not self._ready:
+            try:
+                self.wait_ready(0)
+            except KernelError:
+                return False
+        return True
+
+    def wait_ready(self, timeout: float) -> None:
+        """Waits until the kernel has loaded its libraries."""
+        if not self._ready:
+            self._read_message(time.monotonic() + timeout)
+            self._ready = True
+
+    def run(
+        self,
+        code: str,
+        files: list[File],
+        timeout: float,
+        data: Optional[dict[str, str]] = None,
+    ) -> CodeExecutionResult:
+        """Runs a code block in the kernel.
+
+        Args:
+            code (str): The code.
+            files (list[File]): Files to write to the working directory first.
+            timeout (float): The seconds the code may run.
+            data (dict): Arrow IPC files to load first, by variable name.
+
+        Returns:
+            CodeExecutionResult: The output of the code and the files it wrote.
+
+        Raises:
+            KernelError: The kernel died or timed out; it cannot be used
+              anymore.
+        """
+        deadline = time.monotonic() + timeout
+        self.wait_ready(timeout)
+        message = {
+            "code": code,
+            "files": [{"name": f.name, "content": f.content} for f in files],
+            "data": data or {},
+        }
+        try:
+            self.process.stdin.write(json.dumps(message).encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            raise KernelError(f"Kernel exited: {e}") from e
+        answer = self._read_message(deadline)
+        self.last_used = time.monotonic()
+        self.peak_rss_mb = answer.get("max_rss_mb", 0.0)
+        return CodeExecutionResult(
+            stdout=answer.get("stdout", ""),
+            stderr=answer.get("stderr", ""),
+            output_files=[
+                File(name=f["name"], content=f["content"], mime_type=f["mime_type"])
+                for f in answer.get("files", [])
+            ],
+        )
+
+    def _read_message(self, deadline: float) -> dict:
+        stdout = self.process.stdout
+        while b"\n" not in self._buffer:
+            remaining = max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([stdout], [], [], remaining)
+            if not readable:
+                if time.monotonic() >= deadline:
+                    raise KernelError("Timed out")
+                continue
+            chunk = os.read(stdout.fileno(), 1 << 20)
+            if not chunk:
+                raise KernelError(f"Kernel exited with {self.process.wait()}")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise KernelError(f"Invalid answer from the kernel: {e}") from e
+
+    def close(self) -> None:
+        """Stops the kernel and deletes its working directory."""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class KernelPool:
+    """Started kernels for new sessions and the kernels of the sessions.
+
+    `acquire` assigns a session the kernel it already has, or a kernel of the
+    pool, preferring one that has finished loading, and starts another in
+    its place. `release` returns it after a block and stops it if the block
+    failed or the kernel's peak memory passed the high-water mark. A thread
+    stops the kernels of sessions idle for `idle_timeout` seconds, replaces
+    pool kernels that died and logs `stats()`.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        memory_limit_mb: int,
+        file_limit_mb: int,
+        idle_timeout: float,
+        memory_high_water_mb: int,
+        max_sessions: int,
+    ):
+        self.size = size
+        self.memory_limit_mb = memory_limit_mb
+        self.file_limit_mb = file_limit_mb
+        self.idle_timeout = idle_timeout
+        self.memory_high_water_mb = memory_high_water_mb
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._warm: list[Kernel] = []
+        self._sessions: collections.OrderedDict[str, Kernel] = (
+            collections.OrderedDict())
+        self._stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts the pool kernels and the thread that recycles kernels."""
+        with self._lock:
+            self._fill()
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap_loop, name="kernel-pool", daemon=True)
+                self._reaper.start()
+
+    def _fill(self) -> None:
+        # Called with the lock held; starting a kernel does not wait for it.
+        while len(self._warm) < self.size:
+            self._warm.append(Kernel(self.memory_limit_mb, self.file_limit_mb))
+            KERNEL_POOL_STATS["started"] += 1
+
+    def acquire(self, session_id: Optional[str] = None) -> Kernel:
+        """Returns the kernel of a session, or a new kernel without a session.
+
+        Args:
+            session_id (str): The session; None for a kernel of one block.
+
+        Returns:
+            Kernel: The kernel, which may still be loading its libraries.
+        """
+        self.start()
+        evicted = []
+        with self._lock:
+            kernel = self._sessions.get(session_id) if session_id else None
+            if kernel is not None and kernel.is_alive():
+                self._sessions.move_to_end(session_id)
+                return kernel
+            if kernel is not None:
+                KERNEL_POOL_STATS["recycled_dead"] += 1
+                evicted.append(self._sessions.pop(session_id))
+
+            self._fill()
+            kernel = next((k for k in self._warm if k.is_ready()), None)
+            if kernel is not None:
+                KERNEL_POOL_STATS["assigned_warm"] += 1
+            else:
+                # Every pool kernel is still loading; take the oldest.
+                kernel = self._warm[0]
+                KERNEL_POOL_STATS["assigned_loading"] += 1
+            self._warm.remove(kernel)
+            self._fill()
+            kernel.last_used = time.monotonic()
+            if session_id:
+                self._sessions[session_id] = kernel
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False)[1])
+                    KERNEL_POOL_STATS["recycled_evicted"] += 1
+        for old in evicted:
+            old.close()
+        return kernel
+
+    def release(
+        self, session_id: Optional[str], kernel: Kernel, failed: bool = False
+    ) -> Optional[str]:
+        """Returns a kernel after a block.
+
+        Args:
+            session_id (str): The session of the kernel, if any.
+            kernel (Kernel): The kernel from `acquire`.
+            failed (bool): Whether the kernel died or timed out.
+
+        Returns:
+            str: Why the kernel was stopped ("failed" or "memory"), or None if
+            the session keeps it.
+        """
+        reason = None
+        if failed:
+            reason = "failed"
+        elif (
+            self.memory_high_water_mb
+            and kernel.peak_rss_mb > self.memory_high_water_mb
+        ):
+            reason = "memory"
+        if reason:
+            KERNEL_POOL_STATS[f"recycled_{reason}"] += 1
+        if reason or not session_id:
+            with self._lock:
+                if session_id and self._sessions.get(session_id) is kernel:
+                    del self._sessions[session_id]
+            kernel.close()
+        return reason
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the current use of the pool and its counters."""
+        with self._lock:
+            warm_ready = sum(1 for k in self._warm if k.is_ready())
+            busy = sum(1 for k in self._sessions.values() if k.lock.locked())
+            stats = {
+                "pool_size": self.size,
+                "warm_ready": warm_ready,
+                "warm_loading": len(self._warm) - warm_ready,
+                "sessions": len(self._sessions),
+                "sessions_busy": busy,
+                "max_sessions": self.max_sessions,
+                "session_memory_mb": round(
+                    sum(k.peak_rss_mb for k in self._sessions.values()), 1),
+            }
+        stats.update(KERNEL_POOL_STATS)
+        return stats
+
+    def _reap_loop(self) -> None:
+        interval = max(1.0, min(60.0, self.idle_timeout / 4))
+        while not self._stop.wait(interval):
+            try:
+                self._reap()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Recycling kernels failed")
+
+    def _reap(self) -> None:
+        now = time.monotonic()
+        idle = []
+        with self._lock:
+            for session_id, kernel in list(self._sessions.items()):
+                if (
+                    not kernel.lock.locked()
+                    and now - kernel.last_used > self.idle_timeout
+                ):
+                    idle.append(self._sessions.pop(session_id))
+                    KERNEL_POOL_STATS["recycled_idle"] += 1
+            dead = [k for k in self._warm if not k.is_alive()]
+            for kernel in dead:
+                self._warm.remove(kernel)
+                KERNEL_POOL_STATS["recycled_dead"] += 1
+            self._fill()
+        for kernel in idle + dead:
+            kernel.close()
+        log_event(
+            logger,
+            "kernel_pool",
+            "Kernel pool utilization",
+            level=logging.DEBUG,
+            **self.stats(),
+        )
+
+    def close(self) -> None:
+        """Stops all kernels and the recycling thread."""
+        self._stop.set()
+        with self._lock:
+            kernels = self._warm + list(self._sessions.values())
+            self._warm.clear()
+            self._sessions.clear()
+        for kernel in kernels:
+            kernel.close()
+
+
+def _session_data(invocation_context) -> dict[str, str]:
+    """Returns the query result of the session to load as `df`, if any."""
+    session = getattr(invocation_context, "session", None)
+    ref = session.state.get(arrow_results.STATE_KEY) if session else None
+    if not arrow_results.is_available(ref):
+        return {}
+    return {"df": ref["path"]}
+
+
+class LocalCodeExecutor(BaseCodeExecutor):
+    """Code executor that runs code in local Python kernels.
+
+    Attributes:
+        timeout_seconds: The seconds a code block may run.
+        memory_limit_mb: The address space limit of a kernel, 0 for none.
+        file_limit_mb: The size limit of the files a kernel writes, 0 for none.
+        warm_kernels: The number of started kernels kept ready for new
+          sessions.
+        idle_timeout_seconds: The seconds after which the kernel of an idle
+          session is stopped.
+        memory_high_water_mb: The peak memory after which the kernel of a
+          session is restarted after the block, 0 for none.
+        max_sessions: The number of session kernels kept; the least recently
+          used kernel is stopped beyond it.
+    """
+
+    timeout_seconds: float = float(os.getenv("CODE_EXECUTOR_TIMEOUT", "120"))
+    memory_limit_mb: int = int(os.getenv("CODE_EXECUTOR_MEMORY_MB", "4096"))
+    file_limit_mb: int = 512
+    warm_kernels: int = int(os.getenv("CODE_EXECUTOR_WARM_KERNELS", "2"))
+    idle_timeout_seconds: float = float(
+        os.getenv("CODE_EXECUTOR_IDLE_TIMEOUT", "900"))
+    memory_high_water_mb: int = int(
+        os.getenv("CODE_EXECUTOR_HIGH_WATER_MB", "2048"))
+    max_sessions: int = 32
+
+    _pool: KernelPool = PrivateAttr()
+
+    def model_post_init(self, __context) -> None:
+        self._pool = KernelPool(
+            size=max(self.warm_kernels, 1),
+            memory_limit_mb=self.memory_limit_mb,
+            file_limit_mb=self.file_limit_mb,
+            idle_timeout=self.idle_timeout_seconds,
+            memory_high_water_mb=self.memory_high_water_mb,
+            max_sessions=self.max_sessions,
+        )
+        atexit.register(self._pool.close)
+
+    @property
+    def pool(self) -> KernelPool:
+        """The kernels of the executor."""
+        return self._pool
+
+    def start(self) -> None:
+        """Starts the pool kernels, e.g. during the server warmup."""
+        self._pool.start()
+
+    def execute_code(
+        self,
+        invocation_context,
+        code_execution_input: CodeExecutionInput,
+    ) -> CodeExecutionResult:
+        session_id = (
+            code_execution_input.execution_id if self.stateful else None)
+        data = _session_data(invocation_context)
+        with tracing.tracer.start_as_current_span("code_executor.execute") as span:
+            span.set_attribute("code_executor.stateful", session_id is not None)
+            kernel = self._pool.acquire(session_id)
+            span.set_attribute("code_executor.kernel_ready", kernel.is_ready())
+            failed = False
+            try:
+                with kernel.lock:
+                    result = kernel.run(
+                        code_execution_input.code,
+                        code_execution_input.input_files,
+                        self.timeout_seconds,
+                        data,
+                    )
+            except KernelError as e:
+                logger.warning("Code execution failed: %s", e)
+                span.set_attribute("code_executor.error", str(e))
+                failed = True
+                result = CodeExecutionResult(
+                    stderr=(
+                        f"Code execution failed: {e} (limit "
+                        f"{self.timeout_seconds:g}s, {self.memory_limit_mb} MB). "
+                        "The kernel was restarted; variables of earlier steps "
+                        "are lost."
+                    ),
+                )
+            span.set_attribute("code_executor.peak_rss_mb", kernel.peak_rss_mb)
+            if self._pool.release(session_id, kernel, failed) == "memory":
+                result.stdout += (
+                    f"\nNote: the kernel used {kernel.peak_rss_mb:.0f} MB and "
+                    "was restarted after this step; variables of earlier steps "
+                    "are lost.\n"
+                )
+            analysis_cache.record_execution(
+                code_execution_input.code, result.stdout, result.stderr)
+            return result
+
+    def close(self) -> None:
+        """Stops all kernels."""
+        self._pool.close()
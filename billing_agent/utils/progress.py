@@ -0,0 +1,163 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Progress events of a streamed agent run.
+
+Sub-agents run inside tools (`AgentTool`), so their steps never appear in the
+event stream of the root agent. Tools report their progress with `publish`
+instead:
+
+    progress.publish("sql_generated", sql=sql)
+
+The events go to the `ProgressChannel` of the current run, if the run is
+streamed (see `subscribe`), and are dropped otherwise. The channel is kept in
+a context variable, so it follows the run into sub-agents, tasks and threads
+started with `asyncio.to_thread` or `tracing.run_in_current_context`.
+
+Synchronous tools block the event loop, which holds back every event until
+they return. Wrap them with `off_loop` in the tool list of an agent to run
+them in a thread instead.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressChannel:
+    """Queue of the progress events of one streamed run.
+
+    Events can be published from any thread; they are read on the event loop
+    that created the channel.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._start = time.monotonic()
+
+    def put(self, event: dict[str, Any]) -> None:
+        """Adds an event, stamped with the milliseconds since the run began."""
+        elapsed_ms = round((time.monotonic() - self._start) * 1000)
+        event = {**event, "elapsed_ms": elapsed_ms}
+        if threading.get_ident() == self._loop_thread:
+            self.queue.put_nowait(event)
+        else:
+            self._loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+
+_channel: contextvars.ContextVar[Optional[ProgressChannel]] = (
+    contextvars.ContextVar("progress_channel", default=None)
+)
+
+
+@contextlib.contextmanager
+def subscribe() -> Iterator[ProgressChannel]:
+    """Sends the progress events of the current context to a new channel.
+
+    Start the agent run inside the `with` block, e.g. as a task, so that it
+    inherits the channel.
+    """
+    channel = ProgressChannel()
+    token = _channel.set(channel)
+    try:
+        yield channel
+    finally:
+        _channel.reset(token)
+
+
+def is_streaming() -> bool:
+    """Returns True if the current run streams its progress.
+
+    Use it to skip work that only serves progress events, e.g. dry runs.
+    """
+    return _channel.get() is not None
+
+
+def publish(stage: str, **fields: Any) -> None:
+    """Publishes a progress event to the channel of the current run.
+
+    Args:
+        stage (str): The step of the run, e.g. "sql_generated".
+        **fields: Details of the step; values must be JSON serializable.
+    """
+    channel = _channel.get()
+    if channel is None:
+        return
+    channel.put({"stage": stage, **fields})
+
+
+def off_loop(func: Callable) -> Callable:
+    """Runs a synchronous tool in a thread so it does not block the loop.
+
+    The wrapper keeps the name, docstring and signature of the tool, so the
+    model sees the same function declaration.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # to_thread copies the context, including the channel and the span.
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    return wrapper
+
+
+async def merge(
+    events: AsyncIterator[Any], channel: ProgressChannel
+) -> AsyncIterator[tuple[str, Any]]:
+    """Interleaves the events of a run with its progress events.
+
+    Args:
+        events: The events of the run, e.g. from `Runner.run_async`. It is
+          consumed in a task that inherits the current context.
+        channel: The channel of the run, from `subscribe`.
+
+    Yields:
+        ("event", event) or ("progress", progress event) tuples, in the order
+        they were produced, and ("error", exception) if the run fails.
+    """
+    done = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                channel.queue.put_nowait(("event", event))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            channel.queue.put_nowait(("error", e))
+        finally:
+            channel.queue.put_nowait(done)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await channel.queue.get()
+            if item is done:
+                break
+            if isinstance(item, dict):
+                yield "progress", item
+            else:
+                yield item
+    finally:
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
@@ -18,6 +18,8 @@ from dotenv import load_dotenv, set_key
 import vertexai
 from vertexai import rag
 
+from . import reference_index
+
 
 # Define the path to the .env file
 env_file_path = Path(__file__).parent.parent.parent / ".env"
@@ -84,6 +86,32 @@ def ingest_files(corpus_name):
 
 
 def rag_response(query: str) -> str:
+    """Retrieves contextually relevant information from the reference guide.
+
+    Searches the local reference index (see `reference_index`), or the Vertex
+    AI RAG corpus if `REFERENCE_RETRIEVAL` is "vertex" or no local index has
+    been built.
+
+    Args:
+        query (str): The query string to search within the corpus.
+
+    Returns:
+        str: The retrieved chunks with their source and distance.
+    """
+    if (
+        os.getenv("REFERENCE_RETRIEVAL", "local").lower() == "vertex"
+        or not reference_index.index_exists()
+    ):
+        return vertex_rag_response(query)
+
+    hits = reference_index.load_index().hybrid_search(query, top_k=3)
+    return "\n\n".join(
+        f"source: {hit.source}\ndistance: {hit.distance:.4f}\ntext: {hit.text}"
+        for hit in hits
+    )
+
+
+def vertex_rag_response(query: str) -> str:
     """Retrieves contextually relevant information from a RAG corpus.
 
     Args:
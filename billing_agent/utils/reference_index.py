@@ -0,0 +1,597 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local embedding index of the BQML and billing reference guide.
+
+`rag_response` used to query a Vertex AI RAG corpus for every lookup. This
+module keeps the chunks of the reference documents and their embeddings on
+disk instead and searches them in-process:
+
+    <index_dir>/index.json       # embedding model, dimension, chunking
+    <index_dir>/chunks.jsonl     # {"source": ..., "text": ...} per chunk
+    <index_dir>/embeddings.npy   # float32 [num_chunks, dimension], unit rows
+
+The embedding matrix is memory-mapped and a query is answered with one
+matrix-vector product (cosine similarity of unit vectors) and a partial sort.
+
+Documents are split with the chunking of the RAG corpus (512 tokens with an
+overlap of 100, counting words as tokens). Embeddings come from one of:
+
+* "hashing" (default): hashed word and word-pair counts. Needs no model and
+  no network, and matches the exact SQL function and column names that
+  reference lookups are about.
+* Any other name: a sentence-transformers model, e.g. "all-MiniLM-L6-v2"
+  (needs the `sentence-transformers` package).
+* Precomputed vectors: JSONL files whose lines have an "embedding" next to
+  "text" and "source" are added as they are; queries must then be embedded
+  with the same model.
+
+Build an index with the ingestion CLI, e.g.:
+
+    python -m billing_agent.utils.reference_index build docs/bqml \
+        gs://cloud-samples-data/adk-samples/data-science/bqml
+
+    python -m billing_agent.utils.reference_index search "ML.FORECAST horizon"
+
+Lookups (`hybrid_search`) combine the embedding similarity with BM25 over an
+inverted index of the chunk words, which finds exact function and column names
+(e.g. ML.DETECT_ANOMALIES or invoice.month) that embeddings blur. The two
+rankings are merged by reciprocal-rank fusion, and the results of recent
+queries are kept in an LRU cache of `REFERENCE_CACHE_SIZE` entries (default
+1024) per index.
+
+The index is read from `REFERENCE_INDEX_DIR` (default
+`billing_agent/reference_index`). It is not part of the repository; until it
+is built, `reference_guide_RAG.rag_response` queries the Vertex AI RAG corpus.
+"""
+
+import argparse
+import collections
+import dataclasses
+import math
+import html
+import io
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_INDEX_DIR = os.getenv(
+    "REFERENCE_INDEX_DIR", str(Path(__file__).parent.parent / "reference_index")
+)
+REFERENCE_EMBEDDING_MODEL = os.getenv("REFERENCE_EMBEDDING_MODEL", "hashing")
+# The chunking of the Vertex AI RAG corpus.
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+# Texts embedded per model call during ingestion.
+EMBEDDING_BATCH_SIZE = 256
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", 1024))
+# BM25 parameters and the rank constant of reciprocal-rank fusion.
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# The chunks of each ranking that take part in the fusion.
+FUSION_CANDIDATES = 50
+
+# Lookups of the query cache, "hit" or "miss".
+REFERENCE_CACHE_STATS: collections.Counter = collections.Counter()
+
+_INDEX_FILE = "index.json"
+_CHUNKS_FILE = "chunks.jsonl"
+_EMBEDDINGS_FILE = "embeddings.npy"
+_TEXT_SUFFIXES = {".txt", ".md", ".rst", ".sql", ".html", ".htm"}
+_TOKEN = re.compile(r"[a-z0-9_]+(?:\.[a-z0-9_]+)*")
+
+
+@dataclasses.dataclass
+class Chunk:
+    """A part of a reference document."""
+
+    source: str
+    text: str
+
+
+@dataclasses.dataclass
+class Hit:
+    """A chunk found for a query.
+
+    Attributes:
+        source: The document of the chunk.
+        text: The text of the chunk.
+        distance: The cosine distance of the chunk to the query.
+        score: The fused rank score of a hybrid search.
+    """
+
+    source: str
+    text: str
+    distance: float
+    score: float = 0.0
+
+
+def chunk_text(
+    text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+) -> list[str]:
+    """Splits a text into chunks of words that overlap.
+
+    Args:
+        text (str): The text.
+        chunk_size (int): The words per chunk.
+        chunk_overlap (int): The words a chunk shares with the one before.
+
+    Returns:
+        list[str]: The chunks.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size.")
+    words = text.split()
+    step = chunk_size - chunk_overlap
+    return [
+        " ".join(words[start : start + chunk_size])
+        for start in range(0, max(len(words) - chunk_overlap, 1), step)
+        if words[start : start + chunk_size]
+    ]
+
+
+def tokenize(text: str) -> list[str]:
+    """Returns the lowercase words of a text; dotted names stay one word."""
+    return _TOKEN.findall(text.lower())
+
+
+def _terms(words: list[str]) -> list[str]:
+    """Returns words and the parts of dotted names, e.g. ml.forecast."""
+    return words + [part for w in words if "." in w for part in w.split(".")]
+
+
+class HashingEmbedder:
+    """Embeds texts as hashed, log-scaled word and word-pair counts."""
+
+    # Hashed counts give lower similarities than trained embeddings, so the
+    # distance threshold of the RAG corpus would drop most hits.
+    max_distance = None
+
+    def __init__(self, dimension: int = 4096):
+        self.name = "hashing" if dimension == 4096 else f"hashing-{dimension}"
+        self.dimension = dimension
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns the unit embedding of each text."""
+        rows, columns = [], []
+        for row, text in enumerate(texts):
+            words = tokenize(text)
+            terms = _terms(words) + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            rows.extend([row] * len(terms))
+            columns.extend(zlib.crc32(t.encode("utf-8")) % self.dimension for t in terms)
+        counts = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(counts, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), 1)
+        embeddings = np.log1p(counts, out=counts)
+        return _normalize(embeddings)
+
+
+class SentenceTransformerEmbedder:
+    """Embeds texts with a local sentence-transformers model."""
+
+    # The `vector_distance_threshold` of the RAG corpus.
+    max_distance = 0.5
+
+    def __init__(self, name: str):
+        try:
+            from sentence_transformers import (  # pylint: disable=import-outside-toplevel
+                SentenceTransformer,
+            )
+        except ImportError as e:
+            raise ImportError(
+                f"Embedding model {name!r} needs the sentence-transformers package."
+            ) from e
+        self.name = name
+        self._model = SentenceTransformer(name)
+        self.dimension = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns the unit embedding of each text."""
+        embeddings = self._model.encode(
+            texts, batch_size=EMBEDDING_BATCH_SIZE, convert_to_numpy=True
+        )
+        return _normalize(embeddings.astype(np.float32))
+
+
+def get_embedder(name: str):
+    """Returns the embedder of a model name, see the module docstring."""
+    match = re.fullmatch(r"hashing(?:-(\d+))?", name)
+    if match:
+        return HashingEmbedder(int(match.group(1) or 4096))
+    return SentenceTransformerEmbedder(name)
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+class BM25:
+    """An inverted index of texts scored with Okapi BM25."""
+
+    def __init__(self, texts: list[str]):
+        postings = collections.defaultdict(lambda: ([], []))
+        lengths = []
+        for doc, text in enumerate(texts):
+            terms = _terms(tokenize(text))
+            lengths.append(len(terms))
+            for term, count in collections.Counter(terms).items():
+                docs, counts = postings[term]
+                docs.append(doc)
+                counts.append(count)
+        self.num_docs = len(texts)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        average = self.lengths.mean() if texts else 1.0
+        # The length normalization of each document, fixed per index.
+        self._norms = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / (average or 1.0))
+        self.postings = {
+            term: (np.asarray(docs, dtype=np.int32), np.asarray(counts, dtype=np.float32))
+            for term, (docs, counts) in postings.items()
+        }
+
+    def scores(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every text for a query."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(_terms(tokenize(query))):
+            if term not in self.postings:
+                continue
+            docs, counts = self.postings[term]
+            idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * counts * (BM25_K1 + 1) / (counts + self._norms[docs])
+        return scores
+
+
+def _ranking(scores: np.ndarray, count: int) -> np.ndarray:
+    """Returns the indexes of the highest scores, highest first."""
+    count = min(count, len(scores))
+    if count <= 0:
+        return np.zeros(0, dtype=np.intp)
+    best = np.argpartition(-scores, count - 1)[:count]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+class ReferenceIndex:
+    """Chunks of the reference documents and their embeddings."""
+
+    def __init__(self, directory: str):
+        """Opens the index in a directory; the embeddings are memory-mapped."""
+        self.directory = directory
+        with open(os.path.join(directory, _INDEX_FILE), encoding="utf-8") as f:
+            self.info = json.load(f)
+        with open(os.path.join(directory, _CHUNKS_FILE), encoding="utf-8") as f:
+            self.chunks = [Chunk(**json.loads(line)) for line in f if line.strip()]
+        self.embeddings = np.load(
+            os.path.join(directory, _EMBEDDINGS_FILE), mmap_mode="r"
+        )
+        self._embedder = None
+        self._bm25 = None
+        self._cache: collections.OrderedDict[tuple, list[Hit]] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def embedder(self):
+        """The embedder of the model the index was built with."""
+        if self._embedder is None:
+            self._embedder = get_embedder(self.info["embedding_model"])
+        return self._embedder
+
+    @property
+    def bm25(self) -> BM25:
+        """The BM25 index of the chunks, built on first use."""
+        if self._bm25 is None:
+            self._bm25 = BM25([chunk.text for chunk in self.chunks])
+        return self._bm25
+
+    def scores(self, query: str) -> np.ndarray:
+        """Returns the cosine similarity of the query to every chunk."""
+        return self.embeddings @ self.embedder.embed([query])[0]
+
+    def search(
+        self, query: str, top_k: int = 3, max_distance: Optional[float] = None
+    ) -> list[Hit]:
+        """Returns the chunks closest to a query.
+
+        Args:
+            query (str): The query.
+            top_k (int): The number of chunks to return at most.
+            max_distance (float): Leaves out chunks at a larger cosine
+              distance (1 - similarity) from the query. Defaults to the
+              threshold of the embedding model; `math.inf` keeps all chunks.
+
+        Returns:
+            list[Hit]: The chunks, closest first.
+        """
+        if not self.chunks:
+            return []
+        scores = self.scores(query)
+        hits = [self._hit(i, scores[i]) for i in _ranking(scores, top_k)]
+        if max_distance is None:
+            max_distance = self.embedder.max_distance
+        if max_distance is not None:
+            hits = [hit for hit in hits if hit.distance <= max_distance]
+        return hits
+
+    def hybrid_search(
+        self, query: str, top_k: int = 3, max_distance: Optional[float] = None
+    ) -> list[Hit]:
+        """Returns the best chunks for a query by embeddings and BM25.
+
+        The `FUSION_CANDIDATES` best chunks of each ranking are merged by
+        reciprocal-rank fusion. Chunks that contain a word of the query are
+        kept even if they are farther than `max_distance` from it; other
+        chunks must have a positive similarity to it. Results are
+        cached per normalized query.
+
+        Args:
+            query (str): The query.
+            top_k (int): The number of chunks to return at most.
+            max_distance (float): See `search`.
+
+        Returns:
+            list[Hit]: The chunks, best first.
+        """
+        key = (" ".join(query.lower().split()), top_k, max_distance)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                REFERENCE_CACHE_STATS["hit"] += 1
+                return list(self._cache[key])
+        REFERENCE_CACHE_STATS["miss"] += 1
+        if not self.chunks:
+            return []
+
+        similarities = self.scores(query)
+        keyword_scores = self.bm25.scores(query)
+        fused = collections.defaultdict(float)
+        for rank, i in enumerate(_ranking(similarities, FUSION_CANDIDATES)):
+            fused[i] += 1 / (RRF_K + rank + 1)
+        keyword_ranking = _ranking(keyword_scores, FUSION_CANDIDATES)
+        for rank, i in enumerate(keyword_ranking[keyword_scores[keyword_ranking] > 0]):
+            fused[i] += 1 / (RRF_K + rank + 1)
+
+        if max_distance is None:
+            max_distance = self.embedder.max_distance
+        hits = []
+        for i in sorted(fused, key=lambda i: -fused[i]):
+            if keyword_scores[i] > 0:
+                hits.append(self._hit(i, similarities[i], fused[i]))
+            elif similarities[i] > 0 and (
+                max_distance is None or 1 - similarities[i] <= max_distance
+            ):
+                # Without a keyword match, a chunk must be similar to the
+                # query; the hashing embedder has no threshold of its own.
+                hits.append(self._hit(i, similarities[i], fused[i]))
+            if len(hits) == top_k:
+                break
+
+        if REFERENCE_CACHE_SIZE > 0:
+            with self._lock:
+                self._cache[key] = hits
+                while len(self._cache) > REFERENCE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return list(hits)
+
+    def _hit(self, i: int, similarity: float, score: float = 0.0) -> Hit:
+        chunk = self.chunks[i]
+        return Hit(chunk.source, chunk.text, float(1 - similarity), float(score))
+
+
+_lock = threading.Lock()
+_indexes: dict[str, tuple[float, ReferenceIndex]] = {}
+
+
+def index_exists(directory: str = REFERENCE_INDEX_DIR) -> bool:
+    """Returns True if an index has been built in a directory."""
+    return os.path.exists(os.path.join(directory, _INDEX_FILE))
+
+
+def load_index(directory: str = REFERENCE_INDEX_DIR) -> ReferenceIndex:
+    """Returns the index in a directory, opened once until it is rebuilt."""
+    mtime = os.stat(os.path.join(directory, _INDEX_FILE)).st_mtime
+    with _lock:
+        cached = _indexes.get(directory)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, ReferenceIndex(directory))
+            _indexes[directory] = cached
+        return cached[1]
+
+
+def _read_text(path: str, content: bytes) -> str:
+    text = content.decode("utf-8", errors="replace")
+    if path.lower().endswith((".html", ".htm")):
+        text = re.sub(r"(?is)<(script|style)\b.*?</\1>", " ", text)
+        text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    return text
+
+
+def _read_pdf(content: bytes) -> str:
+    try:
+        from pypdf import PdfReader  # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError("Reading PDF files needs the pypdf package.") from e
+    reader = PdfReader(io.BytesIO(content))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _iter_files(paths: Iterable[str]) -> Iterator[tuple[str, bytes]]:
+    """Yields the name and content of the files under local and gs:// paths."""
+    for path in paths:
+        if path.startswith("gs://"):
+            from google.cloud import storage  # pylint: disable=import-outside-toplevel
+
+            bucket_name, _, prefix = path[len("gs://") :].partition("/")
+            for blob in storage.Client().list_blobs(bucket_name, prefix=prefix):
+                if not blob.name.endswith("/"):
+                    yield f"gs://{bucket_name}/{blob.name}", blob.download_as_bytes()
+        elif os.path.isdir(path):
+            for file in sorted(Path(path).rglob("*")):
+                if file.is_file():
+                    yield str(file), file.read_bytes()
+        else:
+            yield path, Path(path).read_bytes()
+
+
+def read_documents(
+    paths: Iterable[str],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Iterator[tuple[Chunk, Optional[list[float]]]]:
+    """Yields the chunks of documents, with precomputed embeddings if any.
+
+    Args:
+        paths (Iterable[str]): Files, directories or gs:// prefixes. Text,
+          Markdown, HTML and PDF files are chunked; the lines of JSONL files
+          are taken as chunks with "text", "source" and an optional
+          "embedding". Other files are skipped.
+        chunk_size (int): The words per chunk.
+        chunk_overlap (int): The words a chunk shares with the one before.
+
+    Yields:
+        tuple: A chunk and its embedding, or None.
+    """
+    for name, content in _iter_files(paths):
+        suffix = os.path.splitext(name)[1].lower()
+        if suffix == ".jsonl":
+            for line in content.decode("utf-8").splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    chunk = Chunk(record.get("source", name), record["text"])
+                    yield chunk, record.get("embedding")
+            continue
+        if suffix == ".pdf":
+            text = _read_pdf(content)
+        elif suffix in _TEXT_SUFFIXES:
+            text = _read_text(name, content)
+        else:
+            logger.info("Skipping %s", name)
+            continue
+        for part in chunk_text(text, chunk_size, chunk_overlap):
+            yield Chunk(name, part), None
+
+
+def build_index(
+    paths: Iterable[str],
+    directory: str = REFERENCE_INDEX_DIR,
+    embedding_model: str = REFERENCE_EMBEDDING_MODEL,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> int:
+    """Chunks and embeds documents and writes them as an index.
+
+    Chunks are embedded in batches of `EMBEDDING_BATCH_SIZE`. The files of
+    the index are replaced at the end, so a running agent keeps using the old
+    index until then.
+
+    Args:
+        paths (Iterable[str]): The documents, see `read_documents`.
+        directory (str): The directory of the index.
+        embedding_model (str): The embedding model, see the module docstring.
+        chunk_size (int): The words per chunk.
+        chunk_overlap (int): The words a chunk shares with the one before.
+
+    Returns:
+        int: The number of chunks in the index.
+    """
+    embedder = None
+    chunks: list[Chunk] = []
+    batches: list[np.ndarray] = []
+    pending: list[Chunk] = []
+
+    def flush():
+        nonlocal embedder
+        if pending:
+            embedder = embedder or get_embedder(embedding_model)
+            batches.append(embedder.embed([c.text for c in pending]))
+            pending.clear()
+
+    for chunk, embedding in read_documents(paths, chunk_size, chunk_overlap):
+        chunks.append(chunk)
+        if embedding is not None:
+            flush()
+            batches.append(_normalize(np.asarray([embedding], dtype=np.float32)))
+            continue
+        pending.append(chunk)
+        if len(pending) >= EMBEDDING_BATCH_SIZE:
+            flush()
+    flush()
+    if not chunks:
+        raise ValueError("No documents found.")
+    embeddings = np.concatenate(batches).astype(np.float32)
+
+    os.makedirs(directory, exist_ok=True)
+    files = {
+        _EMBEDDINGS_FILE: lambda f: np.save(f, embeddings),
+        _CHUNKS_FILE: lambda f: f.write(
+            "".join(json.dumps(dataclasses.asdict(c)) + "\n" for c in chunks).encode()
+        ),
+        _INDEX_FILE: lambda f: f.write(json.dumps({
+            "embedding_model": embedding_model,
+            "dimension": int(embeddings.shape[1]),
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "num_chunks": len(chunks),
+        }, indent=2).encode()),
+    }
+    # index.json goes last: `load_index` reopens the index when it changes.
+    for name, write in files.items():
+        temp_path = os.path.join(directory, f".{name}.tmp")
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, os.path.join(directory, name))
+    return len(chunks)
+
+
+def main():
+    """Builds or searches the reference index."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index-dir", default=REFERENCE_INDEX_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Chunk, embed and index documents.")
+    build.add_argument("paths", nargs="+", help="Files, directories or gs:// prefixes.")
+    build.add_argument("--embedding-model", default=REFERENCE_EMBEDDING_MODEL)
+    build.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    build.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    search = commands.add_parser("search", help="Search the index.")
+    search.add_argument("query")
+    search.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "build":
+        count = build_index(
+            args.paths,
+            args.index_dir,
+            embedding_model=args.embedding_model,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+        )
+        print(f"Indexed {count} chunks in {args.index_dir}")
+    else:
+        for hit in load_index(args.index_dir).hybrid_search(args.query, args.top_k):
+            print(f"[{hit.distance:.3f}] {hit.source}\n{hit.text[:500]}\n")
+
+
+if __name__ == "__main__":
+    main()
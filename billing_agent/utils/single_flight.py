@@ -0,0 +1,154 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalesces identical work that is in flight at the same time.
+
+When a dashboard or several users ask the same question at once, every
+session would run NL2SQL, table expansion and the BigQuery job on its own.
+With a `SingleFlight`, the first caller of a key runs the work and the callers
+that arrive while it is running wait for it and get the same result (or
+exception):
+
+    sql = nl2sql_flight.do(
+        ("baseline", normalize_question(question), schema_version(ddl)),
+        lambda: generate_sql(question, ddl),
+    )
+
+Nothing is cached: once the work finishes, the next caller runs it again.
+Results are shared between callers and must be treated as read-only.
+Coalescing is per process; each server worker has its own flights.
+"""
+
+import collections
+import dataclasses
+import hashlib
+import logging
+import re
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Executed and coalesced calls per flight, e.g. "bigquery.coalesced".
+SINGLE_FLIGHT_STATS: collections.Counter = collections.Counter()
+
+_SQL_TOKEN_RE = re.compile(
+    r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)"""  # Quoted.
+    r"|(?:\s|--[^\n]*|/\*.*?\*/)+",  # Whitespace and comments.
+    re.DOTALL,
+)
+
+
+def normalize_question(question: str) -> str:
+    """Normalizes case, whitespace and trailing punctuation of a question."""
+    return " ".join(question.casefold().split()).rstrip(" ?.!")
+
+
+def normalize_sql(sql: str) -> str:
+    """Normalizes a SQL statement without changing its meaning.
+
+    Comments are removed, whitespace outside of quotes is collapsed and
+    trailing semicolons are dropped. Case is kept, since string literals and
+    BigQuery table names are case sensitive.
+    """
+
+    def replace(match: re.Match) -> str:
+        if match.group(1):
+            return match.group(1)
+        return " "
+
+    return _SQL_TOKEN_RE.sub(replace, sql).strip().rstrip(";").strip()
+
+
+def schema_version(ddl_schema: Optional[str]) -> str:
+    """Returns a short fingerprint of a schema, to key work that depends on it."""
+    return hashlib.sha1((ddl_schema or "").encode("utf-8")).hexdigest()[:12]
+
+
+@dataclasses.dataclass
+class _Call:
+    done: threading.Event = dataclasses.field(default_factory=threading.Event)
+    result: Any = None
+    error: Optional[BaseException] = None
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Runs a function once per key for all concurrent callers.
+
+    Attributes:
+        name: The name of the flight, used in stats, spans and logs.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Returns the result of `func`, sharing it with concurrent callers.
+
+        Args:
+            key: Identifies identical work, e.g. a normalized question.
+            func: The work; it is only called if no call with the same key is
+              in flight.
+
+        Returns:
+            The result of the call that ran the work.
+
+        Raises:
+            The exception raised by the call that ran the work.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            SINGLE_FLIGHT_STATS[f"{self.name}.coalesced"] += 1
+            with tracing.tracer.start_as_current_span(
+                f"single_flight.{self.name}.wait"
+            ):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_STATS[f"{self.name}.executed"] += 1
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.info(
+                    "Shared %s result with %d waiting callers",
+                    self.name,
+                    call.waiters,
+                )
+
+    def in_flight(self) -> int:
+        """Returns the number of keys being worked on."""
+        with self._lock:
+            return len(self._calls)
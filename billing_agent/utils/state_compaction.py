@@ -0,0 +1,155 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps session state small as billing conversations grow.
+
+Session state is copied into every sub-agent session and every change to it is
+persisted with the event that made it. Large values (`query_result`,
+`db_agent_output`, `ds_agent_output`) are therefore stored as session artifacts
+and state only holds a small reference:
+
+    {"artifact_ref": "query_result-<invocation id>.json", "chars": 51234,
+     "rows": 80, "preview": "..."}
+
+`load_state_value` resolves a reference back to the value. Values are only
+offloaded to an artifact service every worker can read (e.g. GCS with
+`ARTIFACT_BUCKET`); an in-memory artifact service belongs to one worker, and a
+follow-up turn served by another worker could not load the value. Each turn is also
+recorded in `turn_history` (question, SQL, result reference), capped at
+`MAX_TURN_HISTORY` entries, so older turns are summarized rather than kept in
+full.
+
+Limits are set with `STATE_VALUE_MAX_CHARS` (default 4000) and
+`MAX_TURN_HISTORY` (default 10).
+"""
+
+import json
+import logging
+import os
+from typing import Any
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_REF_KEY = "artifact_ref"
+STATE_VALUE_MAX_CHARS = int(os.getenv("STATE_VALUE_MAX_CHARS", 4000))
+MAX_TURN_HISTORY = int(os.getenv("MAX_TURN_HISTORY", 10))
+PREVIEW_CHARS = 300
+
+_JSON_MIME_TYPE = "application/json"
+
+
+def is_artifact_ref(value: Any) -> bool:
+    """Returns True if a state value is a reference to an artifact."""
+    return isinstance(value, dict) and ARTIFACT_REF_KEY in value
+
+
+def _has_shared_artifact_service(context: Any) -> bool:
+    """Returns True if every worker can load the artifacts of the context."""
+    invocation_context = getattr(context, "_invocation_context", None)
+    service = getattr(invocation_context, "artifact_service", None)
+    return service is not None and not isinstance(service, InMemoryArtifactService)
+
+
+def _serialize(value: Any) -> str:
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+async def offload_state_value(context: Any, key: str) -> None:
+    """Moves a large state value into an artifact and keeps a reference.
+
+    Values up to `STATE_VALUE_MAX_CHARS` serialized characters stay in state.
+    If the session has no artifact service, or only one in the memory of the
+    worker, the value is left in place.
+
+    Args:
+        context: The `ToolContext` or `CallbackContext` of the call.
+        key (str): The state key.
+    """
+    value = context.state.get(key)
+    if value is None or is_artifact_ref(value):
+        return
+    if not _has_shared_artifact_service(context):
+        logger.debug("Keeping %s in state: no shared artifact service", key)
+        return
+    serialized = _serialize(value)
+    if len(serialized) <= STATE_VALUE_MAX_CHARS:
+        return
+    filename = f"{key}-{context.invocation_id}.json"
+    await context.save_artifact(
+        filename,
+        types.Part.from_bytes(
+            data=serialized.encode("utf-8"), mime_type=_JSON_MIME_TYPE
+        ),
+    )
+    reference = {
+        ARTIFACT_REF_KEY: filename,
+        "chars": len(serialized),
+        "preview": serialized[:PREVIEW_CHARS],
+    }
+    if isinstance(value, list):
+        reference["rows"] = len(value)
+    context.state[key] = reference
+
+
+async def load_state_value(context: Any, key: str, default: Any = None) -> Any:
+    """Returns a state value, loading it from its artifact if offloaded.
+
+    Args:
+        context: The `ToolContext` or `CallbackContext` of the call.
+        key (str): The state key.
+        default: The value to return if the key is not set or its artifact
+          can no longer be loaded.
+
+    Returns:
+        The state value.
+    """
+    value = context.state.get(key, default)
+    if not is_artifact_ref(value):
+        return value
+    try:
+        artifact = await context.load_artifact(value[ARTIFACT_REF_KEY])
+    except ValueError:
+        artifact = None
+    if artifact is None or artifact.inline_data is None:
+        logger.warning("Artifact %s of %s not found", value[ARTIFACT_REF_KEY], key)
+        return default
+    return json.loads(artifact.inline_data.data.decode("utf-8"))
+
+
+def _summarize(value: Any) -> Any:
+    if value is None or is_artifact_ref(value):
+        return value
+    if isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value[:STATE_VALUE_MAX_CHARS]
+    return {"preview": _serialize(value)[:PREVIEW_CHARS]}
+
+
+def record_turn(context: Any, **summary: Any) -> None:
+    """Appends a turn summary to `turn_history`, dropping the oldest turns.
+
+    Args:
+        context: The `ToolContext` or `CallbackContext` of the call.
+        **summary: The fields of the turn, e.g. question, SQL and result
+          reference. Strings are cut to `STATE_VALUE_MAX_CHARS`; other values
+          that are not artifact references are kept as a short preview.
+    """
+    entry = {name: _summarize(value) for name, value in summary.items()}
+    history = list(context.state.get("turn_history") or [])
+    history.append(entry)
+    context.state["turn_history"] = history[-MAX_TURN_HISTORY:]
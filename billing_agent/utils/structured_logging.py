@@ -0,0 +1,253 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Asynchronous, sampled JSON logging for the agent server.
+
+`configure_logging` replaces the root handlers with a `QueueHandler`, so the
+request path only truncates and enqueues a record; a `QueueListener` thread
+formats it as one JSON object per line (the structured format Cloud Run log
+ingestion understands) and writes it to stdout.
+
+Verbose events are logged with `log_event` and an event type. Each event type
+can be sampled, and every message and field is truncated before it is queued,
+so large prompts and query results never reach the log in full. Records at
+WARNING and above are never sampled out. When the queue is full, records are
+dropped rather than blocking the request.
+
+Configuration comes from the arguments of `configure_logging` or from the
+environment:
+
+- `LOG_LEVEL`: root log level (default `INFO`).
+- `LOG_SAMPLE_RATES`: comma separated `event=rate` pairs, e.g.
+  `llm_prompt=0.01,tool_response=0.1`, overriding `DEFAULT_SAMPLE_RATES`.
+- `LOG_MAX_FIELD_CHARS`: maximum length of a message or field
+  (default 2000).
+"""
+
+import atexit
+import collections
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Any, TextIO
+
+from billing_agent.utils import tracing
+
+# Sampling rates of the verbose event types logged by the agents. Event types
+# that are not listed are always logged.
+DEFAULT_SAMPLE_RATES = {
+    "llm_prompt": 0.01,
+    "tool_response": 0.1,
+    "query_result": 0.1,
+    "agent_turn": 1.0,
+}
+DEFAULT_MAX_FIELD_CHARS = 2000
+DEFAULT_QUEUE_SIZE = 10000
+
+# Counts of records that never reached the output, by reason.
+LOGGING_STATS: collections.Counter = collections.Counter()
+
+_listener: logging.handlers.QueueListener | None = None
+_configure_lock = threading.Lock()
+
+
+def get_logging_stats() -> dict[str, int]:
+    """Returns the number of sampled-out and dropped log records."""
+    return dict(LOGGING_STATS)
+
+
+def log_event(
+    logger: logging.Logger,
+    event: str,
+    message: str,
+    level: int = logging.INFO,
+    **fields: Any,
+) -> None:
+    """Logs a structured event.
+
+    Args:
+        logger: The logger to log to.
+        event: The event type, used for sampling, e.g. `llm_prompt`.
+        message: A short human readable message.
+        level: The log level.
+        **fields: Extra fields of the JSON record. Values are truncated.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"event": event, "fields": fields})
+
+
+def _truncate(value: Any, max_chars: int) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else str(value)
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...[truncated {len(text) - max_chars} chars]"
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random fraction of the records of each event type."""
+
+    def __init__(self, sample_rates: dict[str, float]):
+        super().__init__()
+        self._sample_rates = sample_rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._sample_rates.get(getattr(record, "event", None), 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        LOGGING_STATS["sampled_out"] += 1
+        return False
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that truncates records instead of formatting them.
+
+    The standard handler formats every record on the calling thread. This one
+    only resolves the message, truncates it and the structured fields, and
+    leaves JSON formatting to the listener thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_field_chars: int):
+        super().__init__(log_queue)
+        self._max_field_chars = max_field_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = _truncate(record.getMessage(), self._max_field_chars)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _truncate(
+                logging.Formatter().formatException(record.exc_info),
+                self._max_field_chars * 4,
+            )
+            record.exc_info = None
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = {
+                key: _truncate(value, self._max_field_chars)
+                for key, value in fields.items()
+            }
+        record.session_id = tracing.current_session_id()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGGING_STATS["dropped"] += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "severity": record.levelname,
+            "time": datetime.datetime.fromtimestamp(
+                record.created, tz=datetime.timezone.utc
+            ).isoformat(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("event", "session_id"):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _parse_sample_rates(spec: str) -> dict[str, float]:
+    rates = {}
+    for pair in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = pair.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(
+    level: str | int | None = None,
+    sample_rates: dict[str, float] | None = None,
+    max_field_chars: int | None = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    stream: TextIO | None = None,
+) -> logging.handlers.QueueListener:
+    """Routes all logging through a background JSON writer.
+
+    Calling this again returns the listener of the first call.
+
+    Args:
+        level: The root log level. Defaults to `LOG_LEVEL` or `INFO`.
+        sample_rates: Sampling rates by event type, merged over
+          `DEFAULT_SAMPLE_RATES`. Defaults to `LOG_SAMPLE_RATES`.
+        max_field_chars: Maximum length of a message or field. Defaults to
+          `LOG_MAX_FIELD_CHARS` or `DEFAULT_MAX_FIELD_CHARS`.
+        queue_size: Maximum number of queued records before records are
+          dropped.
+        stream: The output stream. Defaults to stdout.
+
+    Returns:
+        The running queue listener.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return _listener
+        level = level or os.getenv("LOG_LEVEL", "INFO")
+        if sample_rates is None:
+            sample_rates = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+        sample_rates = {**DEFAULT_SAMPLE_RATES, **sample_rates}
+        max_field_chars = max_field_chars or int(
+            os.getenv("LOG_MAX_FIELD_CHARS", DEFAULT_MAX_FIELD_CHARS)
+        )
+
+        output_handler = logging.StreamHandler(stream or sys.stdout)
+        output_handler.setFormatter(JsonFormatter())
+        log_queue = queue.Queue(maxsize=queue_size)
+        queue_handler = TruncatingQueueHandler(log_queue, max_field_chars)
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, output_handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _listener
+
+
+def shutdown_logging() -> None:
+    """Flushes the queued records and stops the background writer."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
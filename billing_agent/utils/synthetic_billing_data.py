@@ -0,0 +1,651 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic GCP billing export data for load and scale testing.
+
+Generates billing export tables with the nested layout of the detailed usage
+cost export (service, sku, project, labels, credits, invoice, ...) as Parquet,
+one file per usage day:
+
+    <output_dir>/<table_name>/<YYYYMMDD>.parquet
+
+Rows are built with vectorized NumPy/Arrow operations, so tables with tens of
+millions of rows can be generated in minutes. The files can be loaded into a
+local DuckDB database (`load_to_duckdb`) or into BigQuery as an ingestion-time
+partitioned table, one partition per day (`load_to_bigquery`).
+
+Usage:
+    python -m billing_agent.utils.synthetic_billing_data \
+        --tables my-project.billing.export_01,my-project.billing.export_02 \
+        --start-date 2025-01-01 --days 90 --rows-per-day 120000 \
+        --output-dir /tmp/billing_export --load-bigquery
+"""
+
+import argparse
+import datetime
+import os
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+_KEY_VALUE = pa.struct([("key", pa.string()), ("value", pa.string())])
+
+# Layout of the GCP detailed usage cost export. `_PARTITIONTIME` is a
+# BigQuery pseudo-column and is only added for local engines.
+BILLING_EXPORT_SCHEMA = pa.schema(
+    [
+        ("billing_account_id", pa.string()),
+        ("service", pa.struct([("id", pa.string()), ("description", pa.string())])),
+        ("sku", pa.struct([("id", pa.string()), ("description", pa.string())])),
+        ("usage_start_time", pa.timestamp("us", tz="UTC")),
+        ("usage_end_time", pa.timestamp("us", tz="UTC")),
+        (
+            "project",
+            pa.struct(
+                [
+                    ("id", pa.string()),
+                    ("number", pa.string()),
+                    ("name", pa.string()),
+                    ("labels", pa.list_(_KEY_VALUE)),
+                    ("ancestry_numbers", pa.string()),
+                ]
+            ),
+        ),
+        ("labels", pa.list_(_KEY_VALUE)),
+        ("system_labels", pa.list_(_KEY_VALUE)),
+        (
+            "location",
+            pa.struct(
+                [
+                    ("location", pa.string()),
+                    ("country", pa.string()),
+                    ("region", pa.string()),
+                    ("zone", pa.string()),
+                ]
+            ),
+        ),
+        (
+            "resource",
+            pa.struct([("name", pa.string()), ("global_name", pa.string())]),
+        ),
+        ("export_time", pa.timestamp("us", tz="UTC")),
+        ("cost", pa.float64()),
+        ("currency", pa.string()),
+        ("currency_conversion_rate", pa.float64()),
+        (
+            "usage",
+            pa.struct(
+                [
+                    ("amount", pa.float64()),
+                    ("unit", pa.string()),
+                    ("amount_in_pricing_units", pa.float64()),
+                    ("pricing_unit", pa.string()),
+                ]
+            ),
+        ),
+        (
+            "credits",
+            pa.list_(
+                pa.struct(
+                    [
+                        ("name", pa.string()),
+                        ("amount", pa.float64()),
+                        ("full_name", pa.string()),
+                        ("id", pa.string()),
+                        ("type", pa.string()),
+                    ]
+                )
+            ),
+        ),
+        (
+            "invoice",
+            pa.struct([("month", pa.string()), ("publisher_type", pa.string())]),
+        ),
+        ("cost_type", pa.string()),
+        (
+            "price",
+            pa.struct(
+                [
+                    ("effective_price", pa.float64()),
+                    ("tier_start_amount", pa.float64()),
+                    ("unit", pa.string()),
+                    ("pricing_unit_quantity", pa.float64()),
+                ]
+            ),
+        ),
+        ("cost_at_list", pa.float64()),
+        ("transaction_type", pa.string()),
+        ("seller_name", pa.string()),
+    ]
+)
+
+PARTITION_TIME_COLUMN = "_PARTITIONTIME"
+
+# (service id, service description, relative weight,
+#  [(sku description, usage unit, price per unit)])
+_SERVICES = [
+    (
+        "6F81-5844-456A",
+        "Compute Engine",
+        0.35,
+        [
+            ("N2 Instance Core running in Americas", "seconds", 0.0000088),
+            ("N2 Instance Ram running in Americas", "byte-seconds", 1.1e-15),
+            ("Storage PD Capacity", "byte-seconds", 1.5e-17),
+            ("Network Internet Egress from Americas", "bytes", 1.1e-10),
+        ],
+    ),
+    (
+        "24E6-581D-38E5",
+        "BigQuery",
+        0.25,
+        [
+            ("Analysis", "bytes", 5.7e-12),
+            ("Active Logical Storage", "byte-seconds", 7.6e-18),
+            ("Streaming Insert", "bytes", 4.7e-11),
+        ],
+    ),
+    (
+        "95FF-2EF5-5EA1",
+        "Cloud Storage",
+        0.15,
+        [
+            ("Standard Storage US Multi-region", "byte-seconds", 9.7e-18),
+            ("Download Worldwide Destinations", "bytes", 1.1e-10),
+            ("Class A Operations", "requests", 0.000005),
+        ],
+    ),
+    (
+        "152E-C115-5142",
+        "Cloud Run",
+        0.1,
+        [
+            ("CPU Allocation Time", "seconds", 0.000024),
+            ("Memory Allocation Time", "byte-seconds", 2.3e-15),
+            ("Requests", "requests", 4e-7),
+        ],
+    ),
+    (
+        "9662-B51E-5089",
+        "Cloud SQL",
+        0.1,
+        [
+            ("Cloud SQL for PostgreSQL: vCPU", "seconds", 0.0000114),
+            ("Cloud SQL for PostgreSQL: Storage", "byte-seconds", 6.3e-17),
+        ],
+    ),
+    (
+        "58CD-E7C3-72CA",
+        "Cloud Monitoring",
+        0.05,
+        [("Metric Volume", "bytes", 2.5e-10)],
+    ),
+]
+_REGIONS = [
+    ("us-central1", "US", "us-central1-a"),
+    ("us-east1", "US", "us-east1-b"),
+    ("europe-west1", "BE", "europe-west1-c"),
+    ("asia-southeast1", "SG", "asia-southeast1-a"),
+]
+_LABEL_KEYS = ["env", "team", "app"]
+_LABEL_VALUES = {
+    "env": ["prod", "staging", "dev"],
+    "team": ["data", "platform", "web", "ml"],
+    "app": ["checkout", "search", "ingest", "reporting", "auth"],
+}
+_CREDIT_TYPES = [
+    ("COMMITTED_USAGE_DISCOUNT", "Committed use discount: CPU"),
+    ("SUSTAINED_USAGE_DISCOUNT", "Sustained usage discount"),
+    ("PROMOTION", "Free trial credit"),
+    ("FREE_TIER", "Free tier"),
+]
+
+_MICROS_PER_HOUR = 3_600_000_000
+
+
+def _take(values: list[str], indices: np.ndarray) -> pa.Array:
+    """Returns an Arrow string array of `values` picked by `indices`."""
+    return pa.array(values, type=pa.string()).take(pa.array(indices))
+
+
+def _struct(struct_type: pa.StructType, arrays: list[pa.Array]) -> pa.StructArray:
+    return pa.StructArray.from_arrays(arrays, fields=list(struct_type))
+
+
+def _list(lengths: np.ndarray, values: pa.Array) -> pa.ListArray:
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+
+def _timestamps(micros: np.ndarray) -> pa.Array:
+    return pa.array(micros, type=pa.timestamp("us", tz="UTC"))
+
+
+def _hourly_weights() -> np.ndarray:
+    """Returns usage weights per hour of day, peaking in business hours."""
+    weights = 1.0 + np.sin((np.arange(24) - 6) / 24 * 2 * np.pi).clip(min=0)
+    return weights / weights.sum()
+
+
+def generate_day(
+    usage_date: datetime.date,
+    num_rows: int,
+    billing_account_id: str,
+    num_projects: int = 25,
+    seed: int = 0,
+    with_partition_time: bool = False,
+) -> pa.Table:
+    """Generates the billing export rows of a single usage day.
+
+    Args:
+        usage_date (datetime.date): The usage day.
+        num_rows (int): The number of rows to generate.
+        billing_account_id (str): The billing account ID of every row.
+        num_projects (int): The number of projects the cost is spread over.
+          Project sizes follow a Zipf-like distribution.
+        seed (int): The random seed. The same seed, date and sizes always
+          generate the same rows.
+        with_partition_time (bool): True to add the `_PARTITIONTIME` column for
+          local engines.
+
+    Returns:
+        pa.Table: The rows in the `BILLING_EXPORT_SCHEMA` layout.
+    """
+    rng = np.random.default_rng([seed, usage_date.toordinal()])
+    schema = BILLING_EXPORT_SCHEMA
+
+    # Service and SKU.
+    service_weights = np.array([s[2] for s in _SERVICES])
+    service_idx = rng.choice(
+        len(_SERVICES), size=num_rows, p=service_weights / service_weights.sum()
+    )
+    sku_counts = np.array([len(s[3]) for s in _SERVICES])
+    sku_offsets = np.concatenate([[0], np.cumsum(sku_counts)[:-1]])
+    sku_idx = sku_offsets[service_idx] + (
+        rng.random(num_rows) * sku_counts[service_idx]
+    ).astype(np.int64)
+    skus = [(s[0], sku) for s in _SERVICES for sku in s[3]]
+    sku_prices = np.array([sku[2] for _, sku in skus])
+    sku_units = [sku[1] for _, sku in skus]
+
+    # Project and location, with a few large and many small projects.
+    project_weights = 1.0 / np.arange(1, num_projects + 1)
+    project_idx = rng.choice(
+        num_projects, size=num_rows, p=project_weights / project_weights.sum()
+    )
+    project_ids = [f"project-{i:03d}" for i in range(num_projects)]
+    project_numbers = [str(100000000000 + i) for i in range(num_projects)]
+    region_idx = project_idx % len(_REGIONS)
+
+    # Usage and cost, with a diurnal usage pattern.
+    day_start = int(
+        datetime.datetime.combine(
+            usage_date, datetime.time(), tzinfo=datetime.timezone.utc
+        ).timestamp()
+    ) * 1_000_000
+    hours = rng.choice(24, size=num_rows, p=_hourly_weights()).astype(np.int64)
+    usage_start = day_start + hours * _MICROS_PER_HOUR
+    usage_end = usage_start + _MICROS_PER_HOUR
+    export_time = usage_end + rng.integers(1, 12, size=num_rows) * _MICROS_PER_HOUR
+    cost = np.round(rng.lognormal(mean=0.5, sigma=1.3, size=num_rows), 6)
+    usage_amount = cost / sku_prices[sku_idx]
+    cost_at_list = np.round(cost * rng.uniform(1.0, 1.25, size=num_rows), 6)
+
+    # Credits: most rows have none, some have one or two.
+    credit_lengths = rng.choice(3, size=num_rows, p=[0.7, 0.25, 0.05])
+    credit_rows = np.repeat(np.arange(num_rows), credit_lengths)
+    credit_idx = rng.integers(0, len(_CREDIT_TYPES), size=len(credit_rows))
+    credit_names = [c[1] for c in _CREDIT_TYPES]
+    credits = _list(
+        credit_lengths,
+        _struct(
+            schema.field("credits").type.value_type,
+            [
+                _take(credit_names, credit_idx),
+                pa.array(
+                    -np.round(
+                        cost[credit_rows]
+                        * rng.uniform(0.05, 0.3, size=len(credit_rows)),
+                        6,
+                    )
+                ),
+                _take(credit_names, credit_idx),
+                _take([f"credit-{i}" for i in range(len(_CREDIT_TYPES))], credit_idx),
+                _take([c[0] for c in _CREDIT_TYPES], credit_idx),
+            ],
+        ),
+    )
+
+    # Labels: the first 0-3 of `_LABEL_KEYS`, each with a random value.
+    label_lengths = rng.integers(0, len(_LABEL_KEYS) + 1, size=num_rows)
+    label_key_idx = np.arange(int(label_lengths.sum())) - np.repeat(
+        np.cumsum(label_lengths) - label_lengths, label_lengths
+    )
+    value_counts = np.array([len(_LABEL_VALUES[k]) for k in _LABEL_KEYS])
+    value_offsets = np.concatenate([[0], np.cumsum(value_counts)[:-1]])
+    label_value_idx = value_offsets[label_key_idx] + rng.integers(
+        0, value_counts[label_key_idx]
+    )
+    labels = _list(
+        label_lengths,
+        _struct(
+            _KEY_VALUE,
+            [
+                _take(_LABEL_KEYS, label_key_idx),
+                _take(
+                    [v for k in _LABEL_KEYS for v in _LABEL_VALUES[k]],
+                    label_value_idx,
+                ),
+            ],
+        ),
+    )
+
+    # System labels: machine spec on Compute Engine rows only.
+    is_compute = (service_idx == 0).astype(np.int64)
+    compute_rows = np.zeros(int(is_compute.sum()), dtype=np.int64)
+    system_labels = _list(
+        is_compute,
+        _struct(
+            _KEY_VALUE,
+            [
+                _take(["compute.googleapis.com/machine_spec"], compute_rows),
+                _take(["n2-standard-4"], compute_rows),
+            ],
+        ),
+    )
+
+    # Index array for columns with the same value on every row.
+    constant = np.zeros(num_rows, dtype=np.int64)
+    columns = {
+        "billing_account_id": _take([billing_account_id], constant),
+        "service": _struct(
+            schema.field("service").type,
+            [
+                _take([s[0] for s in _SERVICES], service_idx),
+                _take([s[1] for s in _SERVICES], service_idx),
+            ],
+        ),
+        "sku": _struct(
+            schema.field("sku").type,
+            [
+                _take([f"{sid}-{i:02d}" for i, (sid, _) in enumerate(skus)], sku_idx),
+                _take([sku[0] for _, sku in skus], sku_idx),
+            ],
+        ),
+        "usage_start_time": _timestamps(usage_start),
+        "usage_end_time": _timestamps(usage_end),
+        "project": _struct(
+            schema.field("project").type,
+            [
+                _take(project_ids, project_idx),
+                _take(project_numbers, project_idx),
+                _take(project_ids, project_idx),
+                _list(constant, _struct(_KEY_VALUE, [pa.array([], pa.string())] * 2)),
+                _take([f"/123456789012/{n}/" for n in project_numbers], project_idx),
+            ],
+        ),
+        "labels": labels,
+        "system_labels": system_labels,
+        "location": _struct(
+            schema.field("location").type,
+            [
+                _take([r[0] for r in _REGIONS], region_idx),
+                _take([r[1] for r in _REGIONS], region_idx),
+                _take([r[0] for r in _REGIONS], region_idx),
+                _take([r[2] for r in _REGIONS], region_idx),
+            ],
+        ),
+        "resource": _struct(
+            schema.field("resource").type,
+            [pa.nulls(num_rows, pa.string()), pa.nulls(num_rows, pa.string())],
+        ),
+        "export_time": _timestamps(export_time),
+        "cost": pa.array(cost),
+        "currency": _take(["USD"], constant),
+        "currency_conversion_rate": pa.array(np.ones(num_rows)),
+        "usage": _struct(
+            schema.field("usage").type,
+            [
+                pa.array(usage_amount),
+                _take(sku_units, sku_idx),
+                pa.array(usage_amount),
+                _take(sku_units, sku_idx),
+            ],
+        ),
+        "credits": credits,
+        "invoice": _struct(
+            schema.field("invoice").type,
+            [
+                _take([usage_date.strftime("%Y%m")], constant),
+                _take(["GOOGLE"], constant),
+            ],
+        ),
+        "cost_type": _take(["regular"], constant),
+        "price": _struct(
+            schema.field("price").type,
+            [
+                pa.array(sku_prices[sku_idx]),
+                pa.array(np.zeros(num_rows)),
+                _take(sku_units, sku_idx),
+                pa.array(np.ones(num_rows)),
+            ],
+        ),
+        "cost_at_list": pa.array(cost_at_list),
+        "transaction_type": _take(["GOOGLE"], constant),
+        "seller_name": _take(["Google"], constant),
+    }
+    table = pa.Table.from_pydict(columns, schema=schema)
+    if with_partition_time:
+        table = table.append_column(
+            pa.field(PARTITION_TIME_COLUMN, pa.timestamp("us", tz="UTC")),
+            _timestamps(np.full(num_rows, day_start, dtype=np.int64)),
+        )
+    return table
+
+
+def generate_table(
+    start_date: datetime.date,
+    num_days: int,
+    rows_per_day: int,
+    billing_account_id: str,
+    num_projects: int = 25,
+    seed: int = 0,
+) -> pa.Table:
+    """Generates an in-memory billing export table with `_PARTITIONTIME`.
+
+    Args:
+        start_date (datetime.date): The first usage day.
+        num_days (int): The number of usage days.
+        rows_per_day (int): The number of rows per usage day.
+        billing_account_id (str): The billing account ID of every row.
+        num_projects (int): The number of projects the cost is spread over.
+        seed (int): The random seed.
+
+    Returns:
+        pa.Table: The rows of all days, for loading into a local engine.
+    """
+    return pa.concat_tables(
+        [
+            generate_day(
+                start_date + datetime.timedelta(days=day),
+                num_rows=rows_per_day,
+                billing_account_id=billing_account_id,
+                num_projects=num_projects,
+                seed=seed,
+                with_partition_time=True,
+            )
+            for day in range(num_days)
+        ]
+    )
+
+
+def write_billing_export(
+    output_dir: Path,
+    table_id: str,
+    start_date: datetime.date,
+    num_days: int,
+    rows_per_day: int,
+    billing_account_id: str,
+    num_projects: int = 25,
+    seed: int = 0,
+) -> Path:
+    """Writes a synthetic billing export table as one Parquet file per day.
+
+    Args:
+        output_dir (Path): The root output directory.
+        table_id (str): The table ID. Only the table name is used for the
+          output directory.
+        start_date (datetime.date): The first usage day.
+        num_days (int): The number of usage days.
+        rows_per_day (int): The number of rows per usage day.
+        billing_account_id (str): The billing account ID of every row.
+        num_projects (int): The number of projects the cost is spread over.
+        seed (int): The random seed.
+
+    Returns:
+        Path: The directory holding the Parquet files of the table.
+    """
+    table_dir = Path(output_dir) / table_id.split(".")[-1]
+    table_dir.mkdir(parents=True, exist_ok=True)
+    for day in range(num_days):
+        usage_date = start_date + datetime.timedelta(days=day)
+        pq.write_table(
+            generate_day(
+                usage_date,
+                num_rows=rows_per_day,
+                billing_account_id=billing_account_id,
+                num_projects=num_projects,
+                seed=seed,
+            ),
+            table_dir / f"{usage_date:%Y%m%d}.parquet",
+        )
+    print(f"Wrote {num_days * rows_per_day} rows to {table_dir}")
+    return table_dir
+
+
+def load_to_duckdb(connection, table_name: str, table_dir: Path) -> None:
+    """Loads a Parquet billing export into a DuckDB table.
+
+    `_PARTITIONTIME` is derived from the file name of every daily file.
+
+    Args:
+        connection: A DuckDB connection.
+        table_name (str): The name of the DuckDB table to (re)create.
+        table_dir (Path): The directory written by `write_billing_export`.
+    """
+    connection.execute(
+        f"""
+        CREATE OR REPLACE TABLE "{table_name}" AS
+        SELECT
+          * EXCLUDE (filename),
+          timezone(
+            'UTC',
+            strptime(regexp_extract(filename, '(\\d{{8}})\\.parquet$', 1), '%Y%m%d')
+          ) AS {PARTITION_TIME_COLUMN}
+        FROM read_parquet('{Path(table_dir) / "*.parquet"}', filename = true)
+        """
+    )
+
+
+def load_to_bigquery(client, table_id: str, table_dir: Path) -> None:
+    """Loads a Parquet billing export into BigQuery, one partition per day.
+
+    The table is created as an ingestion-time partitioned table, like the
+    billing export, and every daily file is loaded into its own partition, so
+    that `_PARTITIONTIME` matches the usage day.
+
+    Args:
+        client (bigquery.Client): A BigQuery client.
+        table_id (str): The fully qualified table ID.
+        table_dir (Path): The directory written by `write_billing_export`.
+    """
+    from google.cloud import bigquery
+
+    table = bigquery.Table(table_id)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY
+    )
+    client.create_table(table, exists_ok=True)
+
+    parquet_options = bigquery.ParquetOptions()
+    parquet_options.enable_list_inference = True
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        parquet_options=parquet_options,
+    )
+    for parquet_file in sorted(Path(table_dir).glob("*.parquet")):
+        with open(parquet_file, "rb") as source_file:
+            job = client.load_table_from_file(
+                source_file, f"{table_id}${parquet_file.stem}", job_config=job_config
+            )
+        job.result()  # Wait for the job to complete
+        print(f"Loaded {job.output_rows} rows into {table_id}${parquet_file.stem}")
+
+
+def main():
+    """Generates synthetic billing exports and optionally loads them."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tables",
+        default=os.getenv("TARGET_BILLING_TABLES", ""),
+        help="Comma-separated table IDs, defaults to TARGET_BILLING_TABLES.",
+    )
+    parser.add_argument(
+        "--start-date",
+        type=datetime.date.fromisoformat,
+        default=datetime.date.today().replace(day=1) - datetime.timedelta(days=90),
+    )
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--rows-per-day", type=int, default=10000)
+    parser.add_argument("--projects", type=int, default=25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", type=Path, default=Path("billing_export"))
+    parser.add_argument(
+        "--load-bigquery", action="store_true", help="Load the tables into BigQuery."
+    )
+    parser.add_argument("--duckdb", help="Load the tables into this DuckDB file.")
+    args = parser.parse_args()
+
+    table_ids = [t.strip().strip("'") for t in args.tables.split(",") if t.strip()]
+    if not table_ids:
+        raise ValueError("No tables given and TARGET_BILLING_TABLES is not set.")
+
+    for index, table_id in enumerate(table_ids):
+        table_dir = write_billing_export(
+            args.output_dir,
+            table_id,
+            start_date=args.start_date,
+            num_days=args.days,
+            rows_per_day=args.rows_per_day,
+            billing_account_id=f"01{index:04X}-{args.seed:06X}-{index:06X}",
+            num_projects=args.projects,
+            seed=args.seed + index,
+        )
+        if args.duckdb:
+            import duckdb
+
+            with duckdb.connect(args.duckdb) as connection:
+                load_to_duckdb(connection, table_id.split(".")[-1], table_dir)
+        if args.load_bigquery:
+            from google.cloud import bigquery
+
+            project_id = table_id.split(".")[0]
+            load_to_bigquery(bigquery.Client(project=project_id), table_id, table_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""OpenTelemetry tracing for the billing agent pipeline.
+
+Spans are emitted for every tool call (`trace_tool`), every LLM call made from
+inside a tool (`trace_llm_call`) and every BigQuery job (`trace_bigquery_job`).
+They nest under the agent and model spans that ADK emits itself, and every span
+carries the ADK session ID in the `session.id` attribute, so one billing answer
+can be followed end to end.
+
+The exporter is configured once per process with `configure_tracing`, from the
+`TRACE_EXPORTER` environment variable by default:
+
+- `none` (default): spans are created but not exported.
+- `console`: spans are printed to stdout.
+- `file`: spans are appended as JSON lines to `TRACE_FILE`
+  (default `traces.jsonl`).
+- `memory`: spans are kept in an `InMemorySpanExporter`, for tests and
+  benchmarks.
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+from typing import Any, Callable, Iterator, Sequence
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import ReadableSpan, Span, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import Status, StatusCode
+
+SESSION_ID_ATTRIBUTE = "session.id"
+
+tracer = trace.get_tracer("billing_agent")
+
+_session_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "billing_agent_session_id", default=None
+)
+_configure_lock = threading.Lock()
+_configured_exporter: SpanExporter | None = None
+
+
+class SessionSpanProcessor(SpanProcessor):
+    """Adds the current session ID to every span when it starts."""
+
+    def on_start(self, span: Span, parent_context=None) -> None:
+        session_id = _session_id.get()
+        if session_id:
+            span.set_attribute(SESSION_ID_ATTRIBUTE, session_id)
+
+
+class JsonLinesFileSpanExporter(SpanExporter):
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = [json.dumps(json.loads(span.to_json())) for span in spans]
+        with self._lock, open(self._path, "a", encoding="utf-8") as trace_file:
+            trace_file.write("".join(f"{line}\n" for line in lines))
+        return SpanExportResult.SUCCESS
+
+
+def configure_tracing(
+    exporter: str | None = None, path: str | None = None
+) -> SpanExporter | None:
+    """Configures span export for the process.
+
+    If a tracer provider is already installed (e.g. by ADK when tracing to
+    Cloud Trace), the processors are added to it; otherwise a new provider is
+    installed. Calling this again returns the exporter of the first call.
+
+    Args:
+        exporter: One of `none`, `console`, `file` or `memory`. Defaults to the
+          `TRACE_EXPORTER` environment variable.
+        path: The output file of the `file` exporter. Defaults to the
+          `TRACE_FILE` environment variable.
+
+    Returns:
+        The configured span exporter, or None if spans are not exported.
+    """
+    global _configured_exporter
+    exporter = (exporter or os.getenv("TRACE_EXPORTER", "none")).lower()
+    with _configure_lock:
+        if _configured_exporter is not None:
+            return _configured_exporter
+        if exporter == "console":
+            span_exporter = ConsoleSpanExporter()
+        elif exporter == "file":
+            span_exporter = JsonLinesFileSpanExporter(
+                path or os.getenv("TRACE_FILE", "traces.jsonl")
+            )
+        elif exporter == "memory":
+            span_exporter = InMemorySpanExporter()
+        elif exporter == "none":
+            return None
+        else:
+            raise ValueError(f"Unsupported trace exporter: {exporter}")
+
+        provider = trace.get_tracer_provider()
+        if not isinstance(provider, TracerProvider):
+            provider = TracerProvider()
+            trace.set_tracer_provider(provider)
+        provider.add_span_processor(SessionSpanProcessor())
+        provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+        _configured_exporter = span_exporter
+        return span_exporter
+
+
+def bind_session(session_id: str | None) -> None:
+    """Tags all spans started from the current context with a session ID."""
+    _session_id.set(session_id)
+
+
+def _session_id_from_context(tool_context: Any) -> str | None:
+    invocation_context = getattr(tool_context, "_invocation_context", None)
+    session = getattr(invocation_context, "session", None)
+    return getattr(session, "id", None)
+
+
+def _record_exception(span: trace.Span, error: BaseException) -> None:
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+def trace_tool(func: Callable) -> Callable:
+    """Decorator that runs an ADK tool function inside a `tool.<name>` span.
+
+    The wrapper keeps the signature of the tool, so ADK builds the same
+    function declaration for it. Works for sync and async tools.
+    """
+    signature = inspect.signature(func)
+    span_name = f"tool.{func.__name__}"
+
+    def _start(args, kwargs):
+        tool_context = signature.bind_partial(*args, **kwargs).arguments.get(
+            "tool_context"
+        )
+        session_id = _session_id_from_context(tool_context)
+        if session_id:
+            bind_session(session_id)
+        return tracer.start_as_current_span(span_name, record_exception=False)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with _start(args, kwargs) as span:
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    _record_exception(span, e)
+                    raise
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _start(args, kwargs) as span:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                _record_exception(span, e)
+                raise
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def trace_llm_call(
+    model: str | None, region: str | None = None, stage: str | None = None
+) -> Iterator[trace.Span]:
+    """Context manager for a span around a single LLM call.
+
+    Args:
+        model: The model name.
+        region: The region the request is sent to, if known.
+        stage: The pipeline stage that makes the call, e.g. `initial_bq_nl2sql`.
+
+    Yields:
+        The span, to record token usage with `record_llm_usage`.
+    """
+    with tracer.start_as_current_span("llm.generate_content") as span:
+        span.set_attribute("llm.model", model or "")
+        if region:
+            span.set_attribute("llm.region", region)
+        if stage:
+            span.set_attribute("llm.stage", stage)
+        yield span
+
+
+def record_llm_usage(span: trace.Span, usage_metadata: Any) -> None:
+    """Records prompt and output token counts from a model response."""
+    if usage_metadata is None:
+        return
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", None)
+    output_tokens = getattr(usage_metadata, "candidates_token_count", None)
+    if prompt_tokens is not None:
+        span.set_attribute("llm.prompt_tokens", prompt_tokens)
+    if output_tokens is not None:
+        span.set_attribute("llm.output_tokens", output_tokens)
+
+
+def record_retry(attempt: int, error: BaseException) -> None:
+    """Adds a retry event to the current span."""
+    trace.get_current_span().add_event(
+        "retry", {"attempt": attempt, "error": str(error)[:500]}
+    )
+
+
+@contextlib.contextmanager
+def trace_bigquery_job(sql: str) -> Iterator[trace.Span]:
+    """Context manager for a span around a BigQuery job.
+
+    Args:
+        sql: The SQL of the job. Only its length is recorded.
+
+    Yields:
+        The span, to record the job statistics with `record_bigquery_job`.
+    """
+    with tracer.start_as_current_span("bigquery.query") as span:
+        span.set_attribute("bigquery.sql_length", len(sql))
+        yield span
+
+
+def record_bigquery_job(span: trace.Span, query_job: Any) -> None:
+    """Records the statistics of a finished BigQuery job."""
+    for attribute, name in (
+        ("job_id", "bigquery.job_id"),
+        ("total_bytes_processed", "bigquery.bytes_processed"),
+        ("total_bytes_billed", "bigquery.bytes_billed"),
+        ("slot_millis", "bigquery.slot_ms"),
+        ("cache_hit", "bigquery.cache_hit"),
+    ):
+        value = getattr(query_job, attribute, None)
+        if value is not None:
+            span.set_attribute(name, value)
+
+
+def run_in_current_context(func: Callable) -> Callable:
+    """Binds a callable to a copy of the current context.
+
+    Thread pools do not propagate context variables, so spans started in a
+    worker would lose their parent span and session ID without this. A context
+    copy can only be entered by one thread at a time, so bind once per
+    submitted task.
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+def current_session_id() -> str | None:
+    """Returns the session ID bound to the current context, if any."""
+    return _session_id.get()
@@ -0,0 +1,96 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup warmup for the billing agent.
+
+The server calls `warmup` in every worker before the worker reports ready, so
+the first user request does not pay for building the agent tree, rendering the
+prompt templates, creating the model and BigQuery clients, fetching the
+BigQuery schema or starting a local code kernel.
+"""
+
+import logging
+import time
+from typing import Callable
+
+from .agent import root_agent
+from .prompts import return_instructions_root
+from .sub_agents.analytics.agent import root_agent as ds_agent
+from .sub_agents.analytics.prompts import return_instructions_ds
+from .sub_agents.bigquery import tools as bq_tools
+from .sub_agents.bigquery.prompts import return_instructions_bigquery
+from .utils import client_registry
+from .utils.local_code_executor import LocalCodeExecutor
+from .utils.structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+
+def _render_prompts() -> None:
+    return_instructions_root()
+    return_instructions_bigquery()
+    return_instructions_ds()
+
+
+def _load_database_settings() -> None:
+    # Creates the BigQuery client and caches the schema for all sessions.
+    bq_tools.get_database_settings()
+
+
+def _create_models() -> None:
+    # Models are created lazily to keep imports fast; build the shared
+    # LiteLLM model (and import LiteLLM) before the first request.
+    client_registry.litellm_model().llm
+
+
+def _start_code_kernels() -> None:
+    # The first analysis step of a session gets a kernel with the data
+    # libraries already loaded.
+    if isinstance(ds_agent.code_executor, LocalCodeExecutor):
+        ds_agent.code_executor.start()
+
+
+WARMUP_STEPS: list[tuple[str, Callable[[], None]]] = [
+    ("prompts", _render_prompts),
+    ("models", _create_models),
+    ("database_settings", _load_database_settings),
+    ("code_kernels", _start_code_kernels),
+]
+
+
+def warmup() -> dict[str, float]:
+    """Runs the warmup steps.
+
+    A failing step is logged and skipped, so the worker still starts and the
+    step is retried lazily by the first request that needs it.
+
+    Returns:
+        The duration of each successful step in milliseconds.
+    """
+    timings = {}
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Warmup step %s failed", name)
+            continue
+        timings[name] = (time.perf_counter() - start) * 1000
+    log_event(
+        logger,
+        "warmup",
+        f"Warmup of {root_agent.name} finished",
+        **{f"{name}_ms": round(ms, 1) for name, ms in timings.items()},
+    )
+    return timings
@@ -35,9 +35,17 @@ from .sub_agents.bigquery.tools import (
 )
 from .prompts import return_instructions_root
 from .tools import call_db_agent, call_ds_agent
+from billing_agent.utils import history_compression
 
 date_today = date.today()
 
+# Past this estimated size, older turns of the root agent's history are sent
+# as a summary.
+HISTORY_COMPRESSION = history_compression.HistoryCompressionConfig(
+    max_history_tokens=int(os.getenv("ROOT_AGENT_MAX_HISTORY_TOKENS", 16000)),
+    keep_recent_turns=3,
+)
+
 
 def setup_before_agent_call(callback_context: CallbackContext):
     """Setup the agent."""
@@ -112,6 +120,8 @@ root_agent = Agent(
     ],
     before_agent_callback=setup_before_agent_call,
     after_agent_callback=after_call_back,
+    before_model_callback=history_compression.before_model_callback(
+        HISTORY_COMPRESSION),
 #   before_model_callback=before_model_callback,
     generate_content_config=types.GenerateContentConfig(temperature=0.01),
 )
\ No newline at end of file
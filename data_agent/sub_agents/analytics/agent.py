@@ -1,6 +1,6 @@
 import os
 
-from google.adk.code_executors import VertexAiCodeExecutor
+from billing_agent.utils import client_registry
 from google.adk.agents import LlmAgent
 from .prompts import return_instructions_ds
 # from google.adk.code_executors import BuiltInCodeExecutor
@@ -12,7 +12,7 @@ root_agent = LlmAgent(
     name="data_science_agent",
 #    tools=[built_in_code_execution],
     instruction=return_instructions_ds(),
-    code_executor=VertexAiCodeExecutor(
+    code_executor=client_registry.code_executor(
         optimize_data_file=True,
         stateful=True,
     ),    
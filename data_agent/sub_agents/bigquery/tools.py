@@ -18,8 +18,8 @@ import datetime
 import logging
 import os
 import re
-import requests
 
+from billing_agent.utils import http_clients
 # from data_science.utils.utils import get_env_var
 from google.adk.tools import ToolContext
 from google.cloud import bigquery
@@ -53,7 +53,7 @@ def fetch_web_content(url):
         str: The HTML content of the webpage
     """
     try:
-        response = requests.get(url)
+        response = http_clients.get_client().get(url)
         response.raise_for_status()  # Raise an exception for HTTP errors
         return response.text
     except Exception as e:
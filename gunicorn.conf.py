@@ -0,0 +1,38 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Gunicorn settings for serving `main:app` with one uvicorn worker per vCPU.
+
+Each worker imports and warms up the app itself (no `preload_app`), because
+the gRPC and HTTP clients of the agents must not be shared across a fork.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# One worker per vCPU available to the container.
+workers = int(
+    os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)
+)
+
+# Cloud Run sends SIGTERM 10 seconds before SIGKILL; in-flight requests get
+# GRACEFUL_TIMEOUT seconds to finish.
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 8))
+# Agent turns can take minutes; Cloud Run enforces the request timeout.
+timeout = 0
+keepalive = 75
+
+accesslog = None
+errorlog = "-"
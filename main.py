@@ -1,21 +1,101 @@
+import asyncio
+import contextlib
+import importlib
+import json
+import logging
 import os
+import signal
+from typing import Any, AsyncIterator
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.cli.fast_api import get_fast_api_app
+from google.adk.events import Event
+from google.adk.runners import Runner
+from google.genai import types
+from pydantic import BaseModel
 
-import logging
-logging.getLogger('google_adk').setLevel(logging.DEBUG)
+from billing_agent.utils import http_clients, progress, session_store
+from billing_agent.utils.structured_logging import configure_logging
+from billing_agent.utils.tracing import configure_tracing
+
+# JSON logs through a background writer, as configured by LOG_LEVEL,
+# LOG_SAMPLE_RATES and LOG_MAX_FIELD_CHARS.
+configure_logging()
 
 # Get the directory where main.py is located
 AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
-# Example session DB URL (e.g., SQLite)
-SESSION_DB_URL = "sqlite:///./sessions.db"
+# Session DB URL from SESSION_DB_URL: postgresql://... for shared, pooled
+# storage, or a local SQLite file (WAL mode) for a single node.
+SESSION_DB_URL = session_store.session_db_url()
 # Example allowed origins for CORS
 ALLOWED_ORIGINS = ["http://localhost", "http://localhost:8080", "*"]
 # Set web=True if you intend to serve a web interface, False otherwise
 SERVE_WEB_INTERFACE = True
 
+logger = logging.getLogger(__name__)
+
+# Seconds in-flight requests get to finish after SIGTERM. Cloud Run kills the
+# instance 10 seconds after SIGTERM.
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", 8))
+
+
+class Lifecycle:
+    """Readiness of this worker: warmed up and not draining."""
+
+    warmed_up = False
+    draining = False
+
+    @classmethod
+    def ready(cls) -> bool:
+        return cls.warmed_up and not cls.draining
+
+
+def _drain_on_sigterm() -> None:
+    """Reports not-ready as soon as SIGTERM arrives.
+
+    Chains to the handler the server installed, which stops accepting
+    connections and lets in-flight requests finish.
+    """
+    server_handler = signal.getsignal(signal.SIGTERM)
+
+    def handler(signum, frame):
+        Lifecycle.draining = True
+        logger.info("SIGTERM received, draining")
+        if callable(server_handler):
+            server_handler(signum, frame)
+
+    try:
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        # Not on the main thread, e.g. under a test client.
+        pass
+
+
+@contextlib.asynccontextmanager
+async def lifespan(fastapi_app: FastAPI):
+    """Warms up the billing agent before the worker accepts traffic."""
+    del fastapi_app  # Unused.
+    _drain_on_sigterm()
+    # Pooled keep-alive connections for every LiteLlm model of the worker.
+    http_clients.install_litellm_clients()
+    if os.environ.get("WARMUP", "true").lower() == "true":
+        from billing_agent.warmup import warmup
+        await asyncio.to_thread(warmup)
+    Lifecycle.warmed_up = True
+    yield
+    Lifecycle.draining = True
+    await session_store.flush_session_services()
+    await http_clients.close_clients()
+
+
+# get_fast_api_app opens SESSION_DB_URL itself; WAL mode is enabled first so
+# its engine is configured like the pooled one.
+if SESSION_DB_URL.startswith("sqlite"):
+    session_store.enable_sqlite_wal()
+
 # Call the function to get the FastAPI app instance
 # Ensure the agent directory name ('capital_agent') matches your agent folder
 app: FastAPI = get_fast_api_app(
@@ -23,14 +103,150 @@ app: FastAPI = get_fast_api_app(
     session_db_url=SESSION_DB_URL,
     allow_origins=ALLOWED_ORIGINS,
     web=SERVE_WEB_INTERFACE,
+    lifespan=lifespan,
 )
+# /run, /run_sse, the session routes and the web UI use the pooled, batching
+# session service and the shared artifact service, like /run_stream.
+session_store.install_shared_services(app)
+
+# Export pipeline spans as configured by TRACE_EXPORTER / TRACE_FILE.
+configure_tracing()
+
+# Routes of the ADK app; the routes added below are moved in front of them.
+_adk_route_count = len(app.router.routes)
+
+
+@app.get("/healthz", include_in_schema=False)
+async def liveness() -> dict[str, str]:
+    """Liveness probe: the worker's event loop is responsive."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readiness(response: Response) -> dict[str, str]:
+    """Readiness probe: warmed up and not shutting down."""
+    if Lifecycle.ready():
+        return {"status": "ready"}
+    response.status_code = 503
+    return {"status": "draining" if Lifecycle.draining else "starting"}
+
+
+class StreamRequest(BaseModel):
+    """Body of `/run_stream`; the session is created if it does not exist."""
+
+    app_name: str = "billing_agent"
+    user_id: str
+    session_id: str
+    message: str
+
+
+_runners: dict[str, Runner] = {}
+
+
+async def _get_runner(app_name: str) -> Runner:
+    """Returns the streaming runner of an agent, sharing the app's sessions."""
+    if app_name not in _runners:
+        if not os.path.isdir(os.path.join(AGENT_DIR, app_name)):
+            raise HTTPException(status_code=404, detail="Agent not found")
+        agent_module = await asyncio.to_thread(importlib.import_module, app_name)
+        _runners[app_name] = Runner(
+            app_name=app_name,
+            agent=agent_module.agent.root_agent,
+            session_service=session_store.shared_session_service(),
+            artifact_service=session_store.shared_artifact_service(),
+        )
+    return _runners[app_name]
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _event_messages(event: Event) -> list[str]:
+    """Converts an agent event to SSE messages."""
+    messages = [
+        _sse("progress", {"stage": "tool_call", "tool": call.name})
+        for call in event.get_function_calls()
+    ]
+    text = "".join(
+        part.text for part in (event.content.parts if event.content else [])
+        if part.text
+    )
+    if text and event.partial:
+        messages.append(_sse("token", {"author": event.author, "text": text}))
+    elif text and event.is_final_response():
+        messages.append(_sse("answer", {"author": event.author, "text": text}))
+    return messages
+
+
+async def _stream_run(
+    runner: Runner, request: StreamRequest
+) -> AsyncIterator[str]:
+    # Sent before any work, so the client gets its first byte right away.
+    yield _sse("progress", {"stage": "started", "elapsed_ms": 0})
+    with progress.subscribe() as channel:
+        events = runner.run_async(
+            user_id=request.user_id,
+            session_id=request.session_id,
+            new_message=types.Content(
+                role="user", parts=[types.Part(text=request.message)]
+            ),
+            run_config=RunConfig(streaming_mode=StreamingMode.SSE),
+        )
+        async for kind, item in progress.merge(events, channel):
+            if kind == "progress":
+                yield _sse("progress", item)
+            elif kind == "error":
+                logger.error("Streamed run failed", exc_info=item)
+                yield _sse("error", {"message": str(item)})
+            else:
+                for message in _event_messages(item):
+                    yield message
+    yield _sse("done", {})
+
+
+@app.post("/run_stream")
+async def run_stream(request: StreamRequest) -> StreamingResponse:
+    """Runs an agent and streams its progress and answer as server-sent events.
+
+    Events: `progress` (e.g. sql_generated, query_running with bytes_estimate,
+    rows_ready), `token` (partial model text), `answer` (the final markdown
+    answer), `error` and `done`.
+    """
+    runner = await _get_runner(request.app_name)
+    session_service = runner.session_service
+    session = await session_service.get_session(
+        app_name=request.app_name,
+        user_id=request.user_id,
+        session_id=request.session_id,
+    )
+    if session is None:
+        await session_service.create_session(
+            app_name=request.app_name,
+            user_id=request.user_id,
+            session_id=request.session_id,
+        )
+    return StreamingResponse(
+        _stream_run(runner, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# The web UI is mounted at "/" and would shadow routes added after it, so the
+# probes and the streaming endpoint go first.
+_main_routes = app.router.routes[_adk_route_count:]
+del app.router.routes[_adk_route_count:]
+app.router.routes[:0] = _main_routes
 
-# You can add more FastAPI routes or configurations below if needed
-# Example:
-# @app.get("/hello")
-# async def read_root():
-#     return {"Hello": "World"}
 
 if __name__ == "__main__":
-    # Use the PORT environment variable provided by Cloud Run, defaulting to 8080
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
+    # Local multi-worker launcher; the container runs gunicorn with
+    # gunicorn.conf.py instead. Cloud Run provides PORT.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8080)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from google.adk.code_executors import VertexAiCodeExecutor
+from billing_agent.utils import client_registry
 from google.adk.agents import LlmAgent
 from .prompts import return_instructions_ds
 from google.adk.tools import built_in_code_execution
@@ -13,7 +13,7 @@ root_agent = LlmAgent(
     model=GEMINI_MODEL,
 #    tools=[built_in_code_execution],
     instruction=return_instructions_ds(),
-    code_executor=VertexAiCodeExecutor(
+    code_executor=client_registry.code_executor(
         optimize_data_file=True,
         stateful=True,
     ),    
@@ -0,0 +1,41 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the statistics tools of the analytics agent."""
+
+import asyncio
+import types
+
+from billing_agent.sub_agents.analytics import tools
+
+
+def _describe(rows):
+    tool_context = types.SimpleNamespace(state={tools.INPUT_ROWS_KEY: rows})
+    return asyncio.run(tools.describe_data(tool_context=tool_context))
+
+
+def test_describes_numeric_and_categorical_columns():
+    result = _describe([
+        {"service": "BigQuery", "cost": 1.5},
+        {"service": "GCS", "cost": 2.0},
+    ])
+    assert result["num_rows"] == 2
+    assert result["numeric"]["cost"]["sum"] == 3.5
+    assert result["categorical"]["service"]["distinct"] == 2
+
+
+def test_describes_results_without_numeric_columns():
+    result = _describe([{"service": "BigQuery"}, {"service": "GCS"}])
+    assert result["numeric"] == {}
+    assert result["categorical"]["service"]["distinct"] == 2
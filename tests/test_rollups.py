@@ -0,0 +1,95 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the daily billing rollup."""
+
+import datetime
+
+from billing_agent.sub_agents.bigquery import rollups
+
+
+SOURCE = "p.billing.export"
+WATERMARKS = {SOURCE: datetime.date(2025, 3, 31)}
+
+
+def test_refresh_groups_by_dimensions_only():
+    sql = rollups.refresh_rollup_sql("p.billing.rollup", "p.billing.export")
+    group_by = sql.split("GROUP BY ")[1].split(";")[0]
+    ordinals = [int(ordinal) for ordinal in group_by.split(", ")]
+    # Item 1 is the source table literal, followed by the two days and the
+    # dimension columns.
+    assert ordinals == list(range(2, len(rollups.DIMENSIONS) + 4))
+
+
+def _route(sql):
+    router = rollups.RollupRouter("p.billing.rollup", [SOURCE])
+    return router.route(sql, WATERMARKS)
+
+
+def test_routes_partitions_up_to_the_watermark():
+    sql = (
+        "SELECT service.description, SUM(cost) FROM `p.billing.export` "
+        "WHERE _PARTITIONTIME >= '2025-03-01' AND _PARTITIONTIME < '2025-04-01' "
+        "GROUP BY 1"
+    )
+    routed = _route(sql)
+    assert routed is not None
+    assert "p.billing.rollup" in routed
+
+
+def test_does_not_route_partitions_after_the_watermark():
+    sql = (
+        "SELECT SUM(cost) FROM `p.billing.export` "
+        "WHERE _PARTITIONTIME >= '2025-03-01' AND _PARTITIONTIME <= '2025-04-01'"
+    )
+    assert _route(sql) is None
+
+
+def test_does_not_route_unbounded_queries():
+    sql = (
+        "SELECT SUM(cost) FROM `p.billing.export` "
+        "WHERE _PARTITIONTIME >= '2025-03-01'"
+    )
+    assert _route(sql) is None
+
+
+def test_routes_usage_days_before_the_lookback():
+    closed = (
+        "SELECT SUM(cost) FROM `p.billing.export` "
+        "WHERE usage_start_time < '2025-03-01'"
+    )
+    recent = (
+        "SELECT SUM(cost) FROM `p.billing.export` "
+        "WHERE usage_start_time < '2025-03-31'"
+    )
+    assert _route(closed) is not None
+    assert _route(recent) is None
+
+
+def test_bounds_cte_rows_by_the_consumer_filter():
+    sql = (
+        "WITH rows AS (SELECT * FROM `p.billing.export`) "
+        "SELECT SUM(cost) FROM rows WHERE _PARTITIONTIME < '2025-02-01'"
+    )
+    assert _route(sql) is not None
+    assert _route(sql.replace("<", ">=")) is None
+
+
+def test_does_not_route_unknown_sources():
+    sql = (
+        "SELECT SUM(cost) FROM `p.billing.export` "
+        "WHERE _PARTITIONTIME < '2025-02-01'"
+    )
+    router = rollups.RollupRouter("p.billing.rollup", [SOURCE])
+    assert router.route(sql, {}) is None
@@ -0,0 +1,44 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the lexical rules of the rule-based SQL repair."""
+
+from billing_agent.sub_agents.bigquery.chase_sql.sql_postprocessor import (
+    sql_repair,
+)
+
+
+def test_quotes_hyphenated_table_reference():
+    sql = "SELECT cost FROM my-project.billing.export"
+    assert sql_repair.apply_lexical_rules(sql) == (
+        "SELECT cost FROM `my-project.billing.export`"
+    )
+
+
+def test_leaves_string_literals_unchanged():
+    sql = (
+        "SELECT cost FROM `p.d.t` "
+        "WHERE note = 'moved from x.y to z' AND label = \"join a.b\""
+    )
+    assert sql_repair.apply_lexical_rules(sql) == sql
+
+
+def test_leaves_comments_unchanged():
+    sql = "SELECT cost -- taken from x.y\nFROM `p.d.t`"
+    assert sql_repair.apply_lexical_rules(sql) == sql
+
+
+def test_leaves_extract_arguments_unchanged():
+    sql = "SELECT EXTRACT(MONTH FROM t.usage_start_time) FROM `p.d.t` AS t"
+    assert sql_repair.apply_lexical_rules(sql) == sql